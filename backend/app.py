@@ -1,595 +1,1033 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Blueprint, Flask, current_app, request, jsonify
 from flask_cors import CORS
-import sqlite3
-import json
-from datetime import datetime, timedelta
+from werkzeug.http import parse_content_range_header, unquote_etag
+from werkzeug.wsgi import wrap_file
+import math
 import os
-import smtplib
-import random
-import string
-import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email_validator import validate_email, EmailNotValidError
-
-app = Flask(__name__)
-CORS(app, origins=["http://localhost:1234", "http://127.0.0.1:1234", "http://localhost:3000", "http://149.102.158.71:3000"], 
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     allow_headers=["Content-Type", "Authorization"])
-
-# Configure login logging
-def setup_login_logging():
-    """Setup logging for all login-related activities"""
-    # Create logs directory if it doesn't exist
-    log_dir = os.path.join(os.path.dirname(__file__), 'logs')
-    os.makedirs(log_dir, exist_ok=True)
-    
-    # Create login logger
-    login_logger = logging.getLogger('login_activities')
-    login_logger.setLevel(logging.INFO)
-    
-    # Create file handler for login logs
-    log_file = os.path.join(log_dir, 'login_activities.log')
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    
-    # Add handler to logger
-    login_logger.addHandler(file_handler)
-    
-    return login_logger
-
-# Initialize login logger
-login_logger = setup_login_logging()
-
-def log_login_activity(activity_type, email, ip_address, user_agent, status, details=None):
-    """Log login-related activities"""
-    log_data = {
-        'activity': activity_type,
-        'email': email,
-        'ip_address': ip_address,
-        'user_agent': user_agent,
-        'status': status,
-        'details': details or {},
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    log_message = f"{activity_type.upper()} | Email: {email} | IP: {ip_address} | Status: {status}"
-    if details:
-        log_message += f" | Details: {details}"
-    
-    login_logger.info(log_message)
-    print(f"[LOGIN LOG] {log_message}")  # Also print to console for immediate feedback
+import sqlite3
+import time
+from urllib.parse import quote
+import click
+from auth import require_admin, require_auth, require_metrics_access, bearer_token
+from db import pool, get_db, init_app as init_db_pool
+from mailer import delivery_worker, queue_counts
+from metrics import (add_process_gauges, clear_snapshots, profiler_settings, render_metrics,
+                     set_profiler, init_app as init_metrics)
+from otp_store import otp_store
+from rate_limit import rate_limiter, RATE_LIMITS
+from login import login_activity_log, request_otp, check_otp, end_session, queue_confirmation_email
+from quotations import quote_store
+from login_logs import LOGIN_LOG_FILE, MAX_LOG_QUERY_LIMIT, query_login_logs
+from estimator import QuoteEstimator, application_load_features, ESTIMATE_CHUNK_SIZE
+from applications import (if_match_version, insert_application, application_version, fetch_application, update_application,
+                          patch_section, list_load_items, add_load_item, add_load_items, delete_load_item,
+                          load_item_totals, list_applications, LIST_FIELDS, LIST_SORTS, MAX_LIST_LIMIT,
+                          search_applications, fts_query, MAX_SEARCH_LIMIT, MAX_SEARCH_OFFSET,
+                          UPDATED as APPLICATION_UPDATED, NOT_FOUND as APPLICATION_NOT_FOUND,
+                          CONFLICT as VERSION_CONFLICT)
+from export import EXPORT_FORMATS, export_chunks, parquet_available
+from uploads import (create_upload, get_upload, delete_upload, write_chunk, finish_upload, find_document,
+                     document_content_type, safe_filename, INLINE_CONTENT_TYPES,
+                     blob_path, FileRange, MAX_UPLOAD_SIZE, MAX_UPLOAD_CHUNK_SIZE, UPLOAD_CHUNK_SIZE,
+                     ACCEPTED as UPLOAD_ACCEPTED, NOT_FOUND as UPLOAD_NOT_FOUND, OFFSET_MISMATCH, INTERRUPTED)
+from geometry import (applications_within, measure_click_quote, overlapping_shapes, rebuild_geometry_index,
+                      MAX_NEARBY_LIMIT, MAX_NEARBY_RADIUS_M, MAX_OVERLAP_TOLERANCE_M, OVERLAP_TOLERANCE_M)
+from offers import load_offer_inputs, cached_offer, generate_offers, prune_offer_cache, OFFER_BATCH_SIZE
+from schema import JSON_SECTIONS, MIGRATIONS, migrate, backfill_hot_columns, rebuild_search_index, schema_version
 
-# Email configuration
-EMAIL_ADDRESS = "alphanxzen@gmail.com"
-EMAIL_PASSWORD = "rewn cxqu eiuz fgmd"
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+CORS_ORIGINS = ["http://localhost:1234", "http://127.0.0.1:1234", "http://localhost:3000", "http://149.102.158.71:3000"]
+CORS_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+CORS_HEADERS = ["Content-Type", "Authorization", "If-Match", "If-None-Match", "Content-Range", "Range", "If-Range"]
+CORS_EXPOSE_HEADERS = ["ETag", "Upload-Offset", "Content-Range", "Accept-Ranges"]
 
-# In-memory storage for OTPs (in production, use Redis or database)
-otp_storage = {}
+# All routes and CLI commands live on this blueprint; create_app() assembles the app
+api = Blueprint('api', __name__, cli_group=None)
 
-def generate_otp():
-    """Generate a 6-digit OTP"""
-    return ''.join(random.choices(string.digits, k=6))
+def create_app():
+    """Build the Flask application (used by wsgi.py, the dev server and the flask CLI)"""
+    app = Flask(__name__)
+    init_db_pool(app)
+    init_metrics(app)
+    CORS(app, origins=CORS_ORIGINS, methods=CORS_METHODS, allow_headers=CORS_HEADERS,
+         expose_headers=CORS_EXPOSE_HEADERS)
+    app.register_blueprint(api)
+    return app
 
-def send_otp_email(email, otp):
-    """Send OTP via email"""
-    try:
-        # For development/testing purposes, we'll log the OTP instead of sending email
-        # In production, uncomment the email sending code below
-        print(f"OTP for {email}: {otp}")
-        print(f"Email would be sent to: {email}")
-        print(f"OTP expires in 10 minutes")
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = email
-        msg['Subject'] = "UK Power Networks - One-Time Password"
+# Upper bound on load items accepted by one batch request
+MAX_LOAD_ITEMS_BATCH = 500
+
+# Upper bound on application_ids listed in one re-pricing request
+MAX_ESTIMATE_BATCH = 5000
+
+quote_estimator = QuoteEstimator(quote_store)
+
+# Database initialization
+def init_db():
+    with pool.connection() as conn:
+        cursor = conn.cursor()
         
-        # Email body
-        body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <h1 style="color: #007bff; margin: 0;">UK Power Networks</h1>
-                    <p style="color: #666; margin: 5px 0;">Application Portal</p>
-                </div>
-                
-                <div style="background: #f8f9fa; padding: 30px; border-radius: 8px; margin-bottom: 20px;">
-                    <h2 style="color: #333; margin-top: 0;">Your One-Time Password</h2>
-                    <p>You have requested to sign in to the UK Power Networks Application Portal.</p>
-                    <p>Please use the following one-time password to complete your login:</p>
-                    
-                    <div style="background: white; padding: 20px; border-radius: 8px; text-align: center; margin: 20px 0;">
-                        <h1 style="color: #007bff; font-size: 2.5em; letter-spacing: 0.2em; margin: 0; font-family: monospace;">{otp}</h1>
-                    </div>
-                    
-                    <p><strong>This OTP will expire in 10 minutes.</strong></p>
-                    <p>If you did not request this login, please ignore this email.</p>
-                </div>
-                
-                <div style="text-align: center; color: #666; font-size: 0.9em;">
-                    <p>Need help? Contact support at support@ukpowernetworks.co.uk</p>
-                    <p>&copy; 2025 UK Power Networks. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        # Create applications table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                applicant_details TEXT,
+                general_information TEXT,
+                site_address TEXT,
+                load_details TEXT,
+                other_contact TEXT,
+                click_quote_data TEXT,
+                project_details TEXT,
+                auto_quote_eligibility TEXT,
+                upload_docs TEXT,
+                summary TEXT,
+                status TEXT DEFAULT 'draft',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         
-        msg.attach(MIMEText(body, 'html'))
+        # Create load_items table for domestic load table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS load_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                application_id INTEGER,
+                connection_type TEXT,
+                phases TEXT,
+                heating_type TEXT,
+                bedrooms TEXT,
+                quantity INTEGER,
+                load_per_installation REAL,
+                summed_load REAL,
+                FOREIGN KEY (application_id) REFERENCES applications (id)
+            )
+        ''')
         
-        # Send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_ADDRESS, email, text)
-        server.quit()
+        conn.commit()
         
-        print(f"Email sent successfully to {email}")
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        if "AuthenticationError" in str(e) or "BadCredentials" in str(e):
-            print("Gmail authentication failed. Please check:")
-            print("1. Gmail account has 'Less secure app access' enabled")
-            print("2. App password is correct")
-            print("3. 2-factor authentication is properly configured")
-        return False
+        # Bring older databases up to the current schema
+        migrate(conn)
 
-# Database initialization
-def init_db():
-    # Create data directory if it doesn't exist
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    conn = sqlite3.connect(os.path.join(data_dir, 'applications.db'))
-    cursor = conn.cursor()
-    
-    # Create applications table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS applications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            applicant_details TEXT,
-            general_information TEXT,
-            site_address TEXT,
-            load_details TEXT,
-            other_contact TEXT,
-            click_quote_data TEXT,
-            project_details TEXT,
-            auto_quote_eligibility TEXT,
-            upload_docs TEXT,
-            summary TEXT,
-            status TEXT DEFAULT 'draft',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create load_items table for domestic load table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS load_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            application_id INTEGER,
-            connection_type TEXT,
-            phases TEXT,
-            heating_type TEXT,
-            bedrooms TEXT,
-            quantity INTEGER,
-            load_per_installation REAL,
-            summed_load REAL,
-            FOREIGN KEY (application_id) REFERENCES applications (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+def startup():
+    """One-time startup work: migrate the database and load the quote files.
+
+    gunicorn runs this once in the master process before workers fork
+    (see gunicorn.conf.py), so workers never race on migrations.
+    """
+    init_db()
+    quote_store.refresh()
+    clear_snapshots()
+
+@api.cli.command('init-db')
+def init_db_command():
+    """Create tables and apply pending schema migrations"""
+    init_db()
+    click.echo('Database initialised')
+
+@api.cli.command('backfill-applications')
+def backfill_applications_command():
+    """Re-derive the indexed columns from the JSON sections"""
+    init_db()
+    with pool.connection() as conn:
+        updated = backfill_hot_columns(conn)
+    click.echo(f'Backfilled {updated} applications')
 
-@app.route('/api/applications', methods=['POST'])
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-index every application for full-text search"""
+    init_db()
+    with pool.connection() as conn:
+        indexed = rebuild_search_index(conn)
+    click.echo(f'Indexed {indexed} applications for search')
+
+@api.cli.command('rebuild-geometry-index')
+def rebuild_geometry_index_command():
+    """Re-index every application's map shapes for the nearby and overlap queries"""
+    init_db()
+    with pool.connection() as conn:
+        indexed = rebuild_geometry_index(conn)
+    click.echo(f'Indexed {indexed} map shapes')
+
+@api.cli.command('generate-offers')
+@click.option('--status', default='accepted', help='Applications with this status (default: accepted)')
+def generate_offers_command(status):
+    """Render formal offer PDFs into the cache across every CPU"""
+    init_db()
+    with pool.connection() as conn:
+        result = generate_offer_batch(conn, None, status)
+    click.echo(f"Generated {result['generated']} offers ({result['pages']} pages), "
+               f"{result['cached']} already cached, {result['skipped']} without a quote")
+
+@api.cli.command('prune-offers')
+def prune_offers_command():
+    """Delete cached offer PDFs past the OFFER_CACHE_MAX_AGE_DAYS / OFFER_CACHE_MAX_MB limits"""
+    removed = prune_offer_cache()
+    click.echo(f'Removed {removed} cached offers')
+
+EXPORT_FILTERS = ['status', 'postcode', 'email', 'created_after', 'created_before', 'updated_after', 'updated_before']
+
+@api.cli.command('export-applications')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--output', '-o', default='-', help='File to write (default: stdout)')
+@click.option('--status', help='Only applications with this status, e.g. submitted')
+@click.option('--created-after')
+@click.option('--created-before')
+@click.option('--updated-after')
+@click.option('--updated-before')
+def export_applications_command(export_format, output, **filters):
+    """Stream applications and their load items as NDJSON, CSV or Parquet"""
+    if export_format == 'parquet' and not parquet_available():
+        raise click.ClickException('Parquet export needs pyarrow (pip install pyarrow)')
+    init_db()
+    with click.open_file(output, 'wb') as f:
+        for chunk in export_chunks(export_format, filters):
+            f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+
+@api.route('/api/applications', methods=['POST'])
+@require_auth
 def create_application():
-    data = request.json
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    conn = sqlite3.connect(os.path.join(data_dir, 'applications.db'))
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO applications (applicant_details, general_information, site_address, 
-                                load_details, other_contact, click_quote_data, 
-                                project_details, auto_quote_eligibility, upload_docs, summary)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        json.dumps(data.get('applicant_details', {})),
-        json.dumps(data.get('general_information', {})),
-        json.dumps(data.get('site_address', {})),
-        json.dumps(data.get('load_details', {})),
-        json.dumps(data.get('other_contact', {})),
-        json.dumps(data.get('click_quote_data', {})),
-        json.dumps(data.get('project_details', {})),
-        json.dumps(data.get('auto_quote_eligibility', {})),
-        json.dumps(data.get('upload_docs', {})),
-        json.dumps(data.get('summary', {}))
-    ))
-    
-    application_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    application_id = insert_application(get_db(), request.json)
     
     return jsonify({'id': application_id, 'message': 'Application created successfully'})
 
-@app.route('/api/applications/<int:app_id>', methods=['GET', 'PUT'])
+@api.route('/api/applications', methods=['GET'])
+@require_auth
+def list_applications_route():
+    """Keyset-paginated application listing.
+
+    Filters: ``status``, ``postcode`` (full or outward code), ``email``,
+    ``created_after``/``created_before`` and ``updated_after``/``updated_before``.
+    ``sort`` is ``id`` or ``updated_at``, ``order`` is ``desc`` (default) or
+    ``asc`` and ``fields`` picks the returned fields (scalar columns by
+    default). Pass the returned ``next_cursor`` as ``cursor`` for the next page.
+    """
+    sort = request.args.get('sort', 'id')
+    order = request.args.get('order', 'desc')
+    if sort not in LIST_SORTS:
+        return jsonify({'error': f"sort must be one of: {', '.join(LIST_SORTS)}"}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    unknown = [field for field in fields if field not in LIST_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    
+    filters = {name: request.args.get(name) for name in (
+        'status', 'postcode', 'email', 'created_after', 'created_before', 'updated_after', 'updated_before')}
+    try:
+        limit = min(int(request.args.get('limit', 50)), MAX_LIST_LIMIT)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        applications, next_cursor = list_applications(get_db(), limit, request.args.get('cursor') or None,
+                                                      sort, order, filters, fields)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    
+    return jsonify({'applications': applications, 'count': len(applications), 'next_cursor': next_cursor})
+
+@api.route('/api/applications/search', methods=['GET'])
+@require_auth
+def search_applications_route():
+    """Full-text search over applicant name, company, site address and project fields.
+
+    Every word of ``q`` must match (as a prefix); results are ranked by
+    bm25 and carry a snippet with the matched words highlighted.
+    """
+    text = request.args.get('q', '')
+    if not fts_query(text):
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_SEARCH_LIMIT)
+        offset = min(max(int(request.args.get('offset', 0)), 0), MAX_SEARCH_OFFSET)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    
+    results = search_applications(get_db(), text, limit, offset, request.args.get('status') or None)
+    return jsonify({'results': results, 'count': len(results), 'offset': offset})
+
+@api.route('/api/applications/export', methods=['GET'])
+@require_auth
+def export_applications():
+    """Stream applications with their load items as NDJSON (default), CSV or Parquet.
+
+    Takes the listing filters (e.g. ``status=submitted``) and reads the
+    table in id-ordered batches, so memory stays flat however many rows match.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export is not available on this server'}), 501
+    
+    filters = {name: request.args.get(name) for name in EXPORT_FILTERS}
+    try:
+        chunks = export_chunks(export_format, filters)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return current_app.response_class(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="applications.{extension}"'
+    })
+
+@api.route('/api/applications/nearby', methods=['GET'])
+@require_auth
+def nearby_applications():
+    """Applications whose site boundary, substation or cable route lies within ``radius`` metres of a point"""
+    try:
+        lat, lng = float(request.args['lat']), float(request.args['lng'])
+        radius = float(request.args.get('radius', 500))
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_NEARBY_LIMIT)
+    except KeyError:
+        return jsonify({'error': 'lat and lng are required'}), 400
+    except ValueError:
+        return jsonify({'error': 'lat, lng, radius and limit must be numbers'}), 400
+    if not 0 <= radius <= MAX_NEARBY_RADIUS_M:
+        return jsonify({'error': f'radius must be between 0 and {MAX_NEARBY_RADIUS_M:g} metres'}), 400
+    
+    kinds = [kind for kind in request.args.get('kind', '').split(',') if kind]
+    try:
+        results = applications_within(get_db(), lat, lng, radius, kinds, limit)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    return jsonify({'results': results, 'count': len(results)})
+
+@api.route('/api/applications/<int:app_id>/geometry', methods=['GET'])
+@require_auth
+def application_geometry(app_id):
+    """Lengths, areas and edge midpoints of the shapes drawn on the map, measured server-side"""
+    application = fetch_application(get_db(), app_id)
+    if not application:
+        return jsonify({'error': 'Application not found'}), 404
+    return jsonify(measure_click_quote(application['click_quote_data']))
+
+@api.route('/api/applications/<int:app_id>/overlapping-routes', methods=['GET'])
+@require_auth
+def overlapping_routes(app_id):
+    """Other applications' cable routes (or site boundaries with ``kind=siteBoundary``) within ``tolerance`` metres"""
+    kind = request.args.get('kind', 'cableRoute')
+    try:
+        tolerance = float(request.args.get('tolerance', OVERLAP_TOLERANCE_M))
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_NEARBY_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'tolerance and limit must be numbers'}), 400
+    if not 0 <= tolerance <= MAX_OVERLAP_TOLERANCE_M:
+        return jsonify({'error': f'tolerance must be between 0 and {MAX_OVERLAP_TOLERANCE_M:g} metres'}), 400
+    
+    try:
+        results = overlapping_shapes(get_db(), app_id, kind, tolerance, limit)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+    if results is None:
+        return jsonify({'error': f'Application has no {kind} on the map'}), 404
+    return jsonify({'results': results, 'count': len(results)})
+
+def expected_version():
+    """Row version the client last saw, taken from the If-Match header"""
+    return if_match_version(request.if_match)
+
+def version_conflict(current_version, expected=None):
+    """412 when the If-Match version is stale, 409 when an unconditional write kept losing races"""
+    response = jsonify({
+        'error': 'Application was modified by another request',
+        'version': current_version
+    })
+    response.set_etag(str(current_version))
+    return response, 409 if expected is None else 412
+
+@api.route('/api/applications/<int:app_id>', methods=['GET', 'PUT'])
+@require_auth
 def handle_application(app_id):
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    conn = sqlite3.connect(os.path.join(data_dir, 'applications.db'))
-    cursor = conn.cursor()
+    conn = get_db()
     
     if request.method == 'GET':
-        cursor.execute('SELECT * FROM applications WHERE id = ?', (app_id,))
-        app = cursor.fetchone()
+        # Answer conditional requests before loading and parsing the JSON sections
+        if request.if_none_match:
+            version = application_version(conn, app_id)
+            if version is not None and request.if_none_match.contains(str(version)):
+                response = current_app.response_class(status=304)
+                response.set_etag(str(version))
+                return response
         
-        if not app:
+        app_dict = fetch_application(conn, app_id)
+        if not app_dict:
             return jsonify({'error': 'Application not found'}), 404
         
-        # Convert to dict
-        columns = [description[0] for description in cursor.description]
-        app_dict = dict(zip(columns, app))
-        
-        # Parse JSON fields
-        for field in ['applicant_details', 'general_information', 'site_address', 
-                     'load_details', 'other_contact', 'click_quote_data',
-                     'project_details', 'auto_quote_eligibility', 'upload_docs', 'summary']:
-            if app_dict[field]:
-                app_dict[field] = json.loads(app_dict[field])
-            else:
-                app_dict[field] = {}
-        
-        conn.close()
-        return jsonify(app_dict)
+        response = jsonify(app_dict)
+        response.set_etag(str(app_dict['version']))
+        return response
     
     elif request.method == 'PUT':
-        data = request.json
-        cursor.execute('''
-            UPDATE applications SET 
-                applicant_details = ?, general_information = ?, site_address = ?,
-                load_details = ?, other_contact = ?, click_quote_data = ?,
-                project_details = ?, auto_quote_eligibility = ?, upload_docs = ?,
-                summary = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (
-            json.dumps(data.get('applicant_details', {})),
-            json.dumps(data.get('general_information', {})),
-            json.dumps(data.get('site_address', {})),
-            json.dumps(data.get('load_details', {})),
-            json.dumps(data.get('other_contact', {})),
-            json.dumps(data.get('click_quote_data', {})),
-            json.dumps(data.get('project_details', {})),
-            json.dumps(data.get('auto_quote_eligibility', {})),
-            json.dumps(data.get('upload_docs', {})),
-            json.dumps(data.get('summary', {})),
-            app_id
-        ))
+        expected = expected_version()
+        updated, version = update_application(conn, app_id, request.json, expected)
+        if not updated and version is not None:
+            return version_conflict(version, expected)
         
-        conn.commit()
-        conn.close()
-        return jsonify({'message': 'Application updated successfully'})
+        response = jsonify({'message': 'Application updated successfully'})
+        if version is not None:
+            response.set_etag(str(version))
+        return response
 
-@app.route('/api/load-items/<int:app_id>', methods=['GET', 'POST', 'DELETE'])
+@api.route('/api/applications/<int:app_id>/<section>', methods=['PATCH'])
+@require_auth
+def patch_application_section(app_id, section):
+    """Merge-patch a single JSON section (RFC 7386) with optimistic concurrency"""
+    if section not in JSON_SECTIONS:
+        return jsonify({'error': f'Unknown section: {section}'}), 404
+    
+    patch = request.get_json(silent=True)
+    if not isinstance(patch, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    
+    expected = expected_version()
+    outcome, version = patch_section(get_db(), app_id, section, patch, expected)
+    if outcome == APPLICATION_NOT_FOUND:
+        return jsonify({'error': 'Application not found'}), 404
+    if outcome == VERSION_CONFLICT:
+        return version_conflict(version, expected)
+    
+    response = jsonify({'message': 'Application section updated successfully', 'section': section, 'version': version})
+    response.set_etag(str(version))
+    return response
+
+@api.route('/api/applications/<int:app_id>/uploads', methods=['POST'])
+@require_auth
+def start_upload(app_id):
+    """Start a resumable upload of one document (``name`` is its slot, e.g. "Site Plan")"""
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    size = data.get('size')
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({'error': 'name is required'}), 400
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return jsonify({'error': 'size must be a positive number of bytes'}), 400
+    if size > MAX_UPLOAD_SIZE:
+        return jsonify({'error': f'Documents are limited to {MAX_UPLOAD_SIZE} bytes'}), 413
+    
+    conn = get_db()
+    if application_version(conn, app_id) is None:
+        return jsonify({'error': 'Application not found'}), 404
+    upload = create_upload(conn, app_id, name.strip(), data.get('filename'), size, data.get('content_type'))
+    return jsonify(upload_status(upload)), 201
+
+def upload_status(upload):
+    return {'id': upload['id'], 'offset': upload['received'], 'size': upload['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE}
+
+@api.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@require_auth
+def handle_upload(upload_id):
+    """Resume point (GET), next chunk (PUT with Content-Range) or abort (DELETE) of an upload.
+
+    The chunk body is streamed to disk a block at a time. The chunk that
+    completes the file stores it in the blob store under its SHA-256 and
+    records the reference in the application's upload_docs.documents. If
+    that record fails the session stays open, and a PUT to the complete
+    upload (e.g. the last chunk again) retries it.
+    """
+    conn = get_db()
+    if request.method == 'DELETE':
+        if not delete_upload(conn, upload_id):
+            return jsonify({'error': 'Upload not found'}), 404
+        return '', 204
+    
+    upload = get_upload(conn, upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found or expired'}), 404
+    if request.method == 'GET':
+        response = jsonify(upload_status(upload))
+        response.headers['Upload-Offset'] = str(upload['received'])
+        return response
+    
+    if upload['received'] == upload['size']:
+        return attach_upload(conn, upload)
+    
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes' or content_range.length != upload['size']:
+        return jsonify({'error': f"Content-Range must be 'bytes start-end/{upload['size']}'"}), 400
+    length = content_range.stop - content_range.start
+    if request.content_length != length:
+        return jsonify({'error': 'Content-Length must match the Content-Range'}), 400
+    if length > MAX_UPLOAD_CHUNK_SIZE:
+        return jsonify({'error': f'Chunks are limited to {MAX_UPLOAD_CHUNK_SIZE} bytes'}), 413
+    
+    outcome, received = write_chunk(conn, upload, content_range.start, request.stream, length)
+    if outcome == UPLOAD_NOT_FOUND:
+        return jsonify({'error': 'Upload not found or expired'}), 404
+    if outcome in (OFFSET_MISMATCH, INTERRUPTED):
+        message = 'Chunk does not start at the upload offset' if outcome == OFFSET_MISMATCH else 'Chunk was cut short'
+        response = jsonify({'error': message, 'offset': received})
+        response.headers['Upload-Offset'] = str(received)
+        return response, 409 if outcome == OFFSET_MISMATCH else 400
+    if outcome == UPLOAD_ACCEPTED:
+        upload['received'] = received
+        response = jsonify(upload_status(upload))
+        response.headers['Upload-Offset'] = str(received)
+        return response
+    
+    upload['received'] = received
+    return attach_upload(conn, upload)
+
+def attach_upload(conn, upload):
+    """Store a complete upload and record it on the application, ending the session only on success"""
+    document = finish_upload(upload)
+    outcome, version = patch_section(conn, upload['application_id'], 'upload_docs',
+                                     {'documents': {upload['name']: document}})
+    if outcome != APPLICATION_UPDATED:
+        response = jsonify({'error': 'Could not attach the document to the application; retry the PUT',
+                            'offset': upload['received']})
+        response.headers['Upload-Offset'] = str(upload['received'])
+        return response, 409
+    delete_upload(conn, upload['id'])
+    return jsonify({'name': upload['name'], 'document': document, 'version': version}), 201
+
+@api.route('/api/applications/<int:app_id>/documents/<sha256>', methods=['GET'])
+@require_auth
+def download_document(app_id, sha256):
+    """Serve an uploaded document, honouring Range (206) and If-None-Match (304)"""
+    application = fetch_application(get_db(), app_id)
+    document = find_document(application['upload_docs'], sha256) if application else None
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+    try:
+        path = blob_path(sha256)
+    except ValueError:
+        return jsonify({'error': 'Document not found'}), 404
+    if not os.path.exists(path):
+        return jsonify({'error': 'Document content is missing'}), 410
+    return blob_response(path, sha256, document_content_type(document.get('contentType')),
+                         safe_filename(document.get('filename')))
+
+def blob_response(path, etag, mimetype, filename):
+    """Response for an immutable stored file; single byte ranges are served as 206.
+
+    Only the INLINE_CONTENT_TYPES are shown in the browser; anything else is
+    a download, and nosniff stops the browser guessing a type of its own.
+    """
+    size = os.path.getsize(path)
+    disposition = 'inline' if mimetype in INLINE_CONTENT_TYPES else 'attachment'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Content-Disposition': f"{disposition}; filename*=UTF-8''{quote(filename or etag, safe='')}",
+        'X-Content-Type-Options': 'nosniff',
+    }
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+    
+    start, stop, status = 0, size, 200
+    if_range = request.headers.get('If-Range')
+    if request.range and (not if_range or unquote_etag(if_range)[0] == etag):
+        byte_range = request.range.range_for_length(size)
+        if byte_range:
+            (start, stop), status = byte_range, 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        elif len(request.range.ranges) == 1:
+            headers['Content-Range'] = f'bytes */{size}'
+            return current_app.response_class(status=416, headers=headers)
+    
+    body = wrap_file(request.environ, FileRange(path, start, stop - start))
+    response = current_app.response_class(body, status=status, mimetype=mimetype or 'application/octet-stream',
+                                          headers=headers, direct_passthrough=True)
+    response.content_length = stop - start
+    response.set_etag(etag)
+    return response
+
+@api.route('/api/load-items/<int:app_id>', methods=['GET', 'POST', 'DELETE'])
+@require_auth
 def handle_load_items(app_id):
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    conn = sqlite3.connect(os.path.join(data_dir, 'applications.db'))
-    cursor = conn.cursor()
+    conn = get_db()
     
     if request.method == 'GET':
-        cursor.execute('SELECT * FROM load_items WHERE application_id = ?', (app_id,))
-        items = cursor.fetchall()
-        
-        columns = [description[0] for description in cursor.description]
-        items_list = [dict(zip(columns, item)) for item in items]
-        
-        conn.close()
-        return jsonify(items_list)
+        return jsonify(list_load_items(conn, app_id))
     
     elif request.method == 'POST':
-        data = request.json
-        cursor.execute('''
-            INSERT INTO load_items (application_id, connection_type, phases, heating_type,
-                                  bedrooms, quantity, load_per_installation, summed_load)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            app_id, data.get('connection_type'), data.get('phases'),
-            data.get('heating_type'), data.get('bedrooms'), data.get('quantity'),
-            data.get('load_per_installation'), data.get('summed_load')
-        ))
-        
-        conn.commit()
-        conn.close()
+        try:
+            item_id = add_load_item(conn, app_id, request.json)
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': 'quantity and load_per_installation must be finite numbers'}), 400
+        if item_id is None:
+            return jsonify({'error': 'Application not found'}), 404
         return jsonify({'message': 'Load item added successfully'})
     
     elif request.method == 'DELETE':
-        item_id = request.args.get('item_id')
-        cursor.execute('DELETE FROM load_items WHERE id = ? AND application_id = ?', (item_id, app_id))
-        conn.commit()
-        conn.close()
+        delete_load_item(conn, app_id, request.args.get('item_id'))
         return jsonify({'message': 'Load item deleted successfully'})
 
-@app.route('/api/test', methods=['GET'])
-def test_endpoint():
-    return jsonify({'message': 'Backend is working!', 'status': 'success'})
-
-@app.route('/api/send-otp', methods=['POST'])
-def send_otp():
-    """Send OTP to user's email"""
-    try:
-        data = request.json
-        email = data.get('email', '').strip().lower()
-        ip_address = request.remote_addr
-        user_agent = request.headers.get('User-Agent', 'Unknown')
-        
-        if not email:
-            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Email is required'})
-            return jsonify({'error': 'Email is required'}), 400
+@api.route('/api/load-items/<int:app_id>/batch', methods=['POST', 'DELETE'])
+@require_auth
+def handle_load_items_batch(app_id):
+    """Insert or delete many load items in one transaction"""
+    data = request.get_json(silent=True) or {}
+    conn = get_db()
+    
+    if request.method == 'POST':
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        if len(items) > MAX_LOAD_ITEMS_BATCH:
+            return jsonify({'error': f'At most {MAX_LOAD_ITEMS_BATCH} items per batch'}), 400
         
-        # Validate email
         try:
-            valid = validate_email(email)
-            email = valid.email
-        except EmailNotValidError:
-            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Invalid email address'})
-            return jsonify({'error': 'Invalid email address'}), 400
+            inserted = add_load_items(conn, app_id, items)
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': 'quantity and load_per_installation must be finite numbers'}), 400
+        if inserted is None:
+            return jsonify({'error': 'Application not found'}), 404
         
-        # Generate OTP
-        otp = generate_otp()
+        return jsonify({
+            'message': f'{inserted} load items added successfully',
+            'inserted': inserted,
+            'totals': load_item_totals(conn, app_id)
+        })
+    
+    elif request.method == 'DELETE':
+        item_ids = data.get('item_ids') if isinstance(data, dict) else None
+        if item_ids is None and request.args.get('item_ids'):
+            item_ids = request.args.get('item_ids').split(',')
+        try:
+            item_ids = [int(item_id) for item_id in item_ids or []]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'item_ids must be integers'}), 400
+        if not item_ids:
+            return jsonify({'error': 'item_ids is required'}), 400
+        if len(item_ids) > MAX_LOAD_ITEMS_BATCH:
+            return jsonify({'error': f'At most {MAX_LOAD_ITEMS_BATCH} items per batch'}), 400
         
-        # Store OTP with expiration time (10 minutes)
-        otp_storage[email] = {
-            'otp': otp,
-            'expires_at': datetime.now() + timedelta(minutes=10),
-            'attempts': 0,
-            'ip_address': ip_address,
-            'user_agent': user_agent
-        }
+        cursor = conn.executemany('DELETE FROM load_items WHERE id = ? AND application_id = ?',
+                                  [(item_id, app_id) for item_id in item_ids])
+        conn.commit()
         
-        # Send email
-        if send_otp_email(email, otp):
-            log_login_activity('OTP_SENT', email, ip_address, user_agent, 'SUCCESS', {'otp_length': len(otp)})
-            return jsonify({'message': 'OTP sent successfully'})
-        else:
-            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Failed to send email'})
-            return jsonify({'error': 'Failed to send OTP email'}), 500
-            
-    except Exception as e:
-        log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'ERROR', {'error': str(e)})
-        print(f"Error in send_otp: {e}")
-        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+        return jsonify({
+            'message': f'{cursor.rowcount} load items deleted successfully',
+            'deleted': cursor.rowcount,
+            'totals': load_item_totals(conn, app_id)
+        })
 
-@app.route('/api/verify-otp', methods=['POST'])
-def verify_otp():
-    """Verify OTP and authenticate user"""
+def float_arg(name):
+    """Optional float query parameter; raises ValueError on bad input, including nan and inf"""
+    value = request.args.get(name)
+    return finite_float(value) if value not in (None, '') else None
+
+def finite_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'{value!r} is not a finite number')
+    return number
+
+@api.route('/api/quotations', methods=['GET'])
+def list_quotations():
+    """Quotes filtered by postcode district, connection type and kVA range"""
     try:
-        data = request.json
-        email = data.get('email', '').strip().lower()
-        otp = data.get('otp', '').strip()
-        ip_address = request.remote_addr
-        user_agent = request.headers.get('User-Agent', 'Unknown')
-        
-        if not email or not otp:
-            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'Missing email or OTP'})
-            return jsonify({'error': 'Email and OTP are required'}), 400
-        
-        # Check if OTP exists for this email
-        if email not in otp_storage:
-            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'OTP not found or expired'})
-            return jsonify({'error': 'OTP not found or expired'}), 400
-        
-        otp_data = otp_storage[email]
-        
-        # Check if OTP has expired
-        if datetime.now() > otp_data['expires_at']:
-            del otp_storage[email]
-            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'OTP expired'})
-            return jsonify({'error': 'OTP has expired'}), 400
-        
-        # Check attempt limit (max 3 attempts)
-        if otp_data['attempts'] >= 3:
-            del otp_storage[email]
-            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'BLOCKED', {'error': 'Too many failed attempts', 'attempts': otp_data['attempts']})
-            return jsonify({'error': 'Too many failed attempts'}), 400
-        
-        # Verify OTP
-        if otp_data['otp'] != otp:
-            otp_data['attempts'] += 1
-            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'Invalid OTP', 'attempt': otp_data['attempts']})
-            return jsonify({'error': 'Invalid OTP'}), 400
-        
-        # OTP is valid - generate token and clean up
-        del otp_storage[email]
-        
-        # Generate a simple token (in production, use JWT)
-        token = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+        min_kva = float_arg('min_kva')
+        max_kva = float_arg('max_kva')
+    except ValueError:
+        return jsonify({'error': 'min_kva and max_kva must be finite numbers'}), 400
+    
+    quotations = quote_store.search(
+        postcode=request.args.get('postcode'),
+        connection_type=request.args.get('connection_type'),
+        min_kva=min_kva,
+        max_kva=max_kva
+    )
+    return jsonify({'quotations': quotations, 'count': len(quotations)})
+
+@api.route('/api/quotations/match', methods=['GET'])
+def match_quotations():
+    """Nearest quotes by kVA for a postcode and connection type"""
+    try:
+        kva = float_arg('kva')
+        limit = min(int(request.args.get('limit', 5)), 50)
+    except ValueError:
+        return jsonify({'error': 'kva and limit must be finite numbers'}), 400
+    
+    quotations = quote_store.nearest(
+        postcode=request.args.get('postcode'),
+        connection_type=request.args.get('connection_type'),
+        kva=kva,
+        limit=limit
+    )
+    return jsonify({'quotations': quotations, 'count': len(quotations)})
+
+@api.route('/api/quotations/<quote_id>', methods=['GET'])
+def get_quotation(quote_id):
+    quote = quote_store.get(quote_id)
+    if not quote:
+        return jsonify({'error': 'Quotation not found'}), 404
+    return jsonify(quote)
+
+@api.route('/api/estimates', methods=['GET'])
+def estimate_quote():
+    """Indicative quote for an ad-hoc load, phase count and postcode"""
+    try:
+        kva = float_arg('kva')
+        tariff = float_arg('tariff_multiplier')
+    except ValueError:
+        return jsonify({'error': 'kva and tariff_multiplier must be finite numbers'}), 400
+    if not kva or kva <= 0:
+        return jsonify({'error': 'kva must be a positive number'}), 400
+    
+    estimate = quote_estimator.estimate(kva, request.args.get('phases'), request.args.get('postcode'), tariff)
+    if not estimate:
+        return jsonify({'error': 'No historical quotes available'}), 503
+    return jsonify(estimate)
+
+@api.route('/api/applications/<int:app_id>/estimate', methods=['GET'])
+@require_auth
+def estimate_application(app_id):
+    """Indicative quote for an application from its load items and site postcode"""
+    features = application_load_features(get_db(), [app_id]).get(app_id)
+    if not features:
+        return jsonify({'error': 'Application not found'}), 404
+    if not features['load_kva']:
+        return jsonify({'error': 'Application has no load items'}), 400
+    
+    estimate = quote_estimator.estimate(features['load_kva'], features['phases'], features['postcode'])
+    if not estimate:
+        return jsonify({'error': 'No historical quotes available'}), 503
+    return jsonify(estimate)
+
+@api.route('/api/estimates/batch', methods=['POST'])
+@require_admin
+def reprice_applications():
+    """Re-price many applications in one call and store the estimated cost (admin endpoint).
+    
+    Body: ``application_ids`` (at most MAX_ESTIMATE_BATCH; defaults to every
+    application with ``status``, itself defaulting to 'draft'), optional
+    ``tariff_multiplier`` and ``save``.
+    """
+    data = request.get_json(silent=True) or {}
+    application_ids = data.get('application_ids')
+    status = data.get('status', 'draft')
+    save = data.get('save', True)
+    if application_ids is not None and not isinstance(application_ids, list):
+        return jsonify({'error': 'application_ids must be a list'}), 400
+    if application_ids is not None and len(application_ids) > MAX_ESTIMATE_BATCH:
+        return jsonify({'error': f'At most {MAX_ESTIMATE_BATCH} application_ids per batch'}), 400
+    try:
+        tariff = finite_float(data['tariff_multiplier']) if data.get('tariff_multiplier') is not None else None
+        if application_ids is not None:
+            application_ids = sorted({int(app_id) for app_id in application_ids})
+    except (TypeError, ValueError):
+        return jsonify({'error': 'application_ids must be integers and tariff_multiplier a finite number'}), 400
+    
+    conn = get_db()
+    repriced = 0
+    skipped = 0
+    costs = {}
+    last_id = 0
+    while True:
+        # Walk the selection in id-ordered chunks so memory stays bounded
+        if application_ids is not None:
+            chunk = application_ids[repriced + skipped:repriced + skipped + ESTIMATE_CHUNK_SIZE]
+        else:
+            chunk = [row['id'] for row in conn.execute(
+                'SELECT id FROM applications WHERE status = ? AND id > ? ORDER BY id LIMIT ?',
+                (status, last_id, ESTIMATE_CHUNK_SIZE))]
+        if not chunk:
+            break
+        last_id = chunk[-1]
         
-        # Log successful login
-        log_login_activity('LOGIN_SUCCESS', email, ip_address, user_agent, 'SUCCESS', {'token_length': len(token)})
+        features = application_load_features(conn, chunk)
+        found = [app_id for app_id in chunk if app_id in features]
+        estimates = quote_estimator.estimate_many([features[app_id] for app_id in found], tariff)
+        updates = [(estimate['estimatedCost'], app_id) for app_id, estimate in zip(found, estimates) if estimate]
         
-        return jsonify({
-            'message': 'Authentication successful',
-            'token': token,
-            'email': email
-        })
+        if save and updates:
+            conn.executemany('''
+                UPDATE applications SET estimated_cost = ?, estimated_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', updates)
+            conn.commit()
+        if application_ids is not None:
+            costs.update({str(app_id): cost for cost, app_id in updates})
+        repriced += len(updates)
+        skipped += len(chunk) - len(updates)
+    
+    response = {'message': f'Re-priced {repriced} applications', 'repriced': repriced, 'skipped': skipped}
+    if application_ids is not None:
+        response['estimated_costs'] = costs
+    return jsonify(response)
+
+@api.route('/api/applications/<int:app_id>/offer.pdf', methods=['GET'])
+@require_auth
+def download_offer(app_id):
+    """The formal offer for an application, rendered once per distinct content and then served from disk"""
+    inputs = load_offer_inputs(get_db(), [app_id], quote_store, quote_estimator).get(app_id)
+    if not inputs:
+        if not application_version(get_db(), app_id):
+            return jsonify({'error': 'Application not found'}), 404
+        return jsonify({'error': 'Application has no selected quote or load items to price'}), 409
+    key, path = cached_offer(inputs)
+    return blob_response(path, key, 'application/pdf', f'offer-{app_id}.pdf')
+
+@api.route('/api/offers/batch', methods=['POST'])
+@require_auth
+def generate_offers_route():
+    """Render offers for many applications in parallel worker processes.
+    
+    Body: ``application_ids`` (defaults to every application with ``status``,
+    itself defaulting to 'accepted'). Offers already in the cache are not re-rendered.
+    """
+    data = request.get_json(silent=True) or {}
+    application_ids = data.get('application_ids')
+    try:
+        if application_ids is not None:
+            application_ids = sorted({int(app_id) for app_id in application_ids})
+    except (TypeError, ValueError):
+        return jsonify({'error': 'application_ids must be integers'}), 400
+    
+    result = generate_offer_batch(get_db(), application_ids, data.get('status', 'accepted'))
+    result['message'] = f"Generated {result['generated']} offers"
+    return jsonify(result)
+
+def generate_offer_batch(conn, application_ids, status):
+    """Walk the selection in id-ordered chunks, handing each chunk's cache misses to the process pool"""
+    started = time.perf_counter()
+    result = {'generated': 0, 'cached': 0, 'skipped': 0, 'pages': 0}
+    position = 0
+    last_id = 0
+    while True:
+        if application_ids is not None:
+            chunk = application_ids[position:position + OFFER_BATCH_SIZE]
+            position += len(chunk)
+        else:
+            chunk = [row['id'] for row in conn.execute(
+                'SELECT id FROM applications WHERE status = ? AND id > ? ORDER BY id LIMIT ?',
+                (status, last_id, OFFER_BATCH_SIZE))]
+        if not chunk:
+            break
+        last_id = chunk[-1]
         
-    except Exception as e:
-        log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'ERROR', {'error': str(e)})
-        return jsonify({'error': 'Internal server error'}), 500
+        inputs = load_offer_inputs(conn, chunk, quote_store, quote_estimator, issue=True)
+        for outcome in generate_offers(inputs).values():
+            if outcome['cached']:
+                result['cached'] += 1
+            else:
+                result['generated'] += 1
+                result['pages'] += outcome['pages']
+        result['skipped'] += len(chunk) - len(inputs)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
 
-@app.route('/api/send-confirmation-email', methods=['POST'])
+@api.route('/api/email-queue/stats', methods=['GET'])
+@require_metrics_access
+def get_email_queue_stats():
+    """Outbound email queue depth and delivery counters (admin endpoint)"""
+    return jsonify(delivery_worker.stats())
+
+@api.route('/api/login-failures', methods=['GET'])
+@require_auth
+def get_login_failures():
+    """Live failed-login counts per IP from the rate limiter's sliding windows (admin endpoint)"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 1000)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    rule = RATE_LIMITS['login_failures_ip']
+    failures = [
+        {'ip_address': ip_address, 'failures': round(count, 2), 'blocked': count + 1 > rule.limit}
+        for ip_address, count in rate_limiter.top('login_failures_ip', limit)
+    ]
+    return jsonify({
+        'window_seconds': rule.window,
+        'limit': rule.limit,
+        'ips': failures,
+        'rate_limiter': rate_limiter.stats()
+    })
+
+@api.route('/api/db/pool-stats', methods=['GET'])
+@require_metrics_access
+def get_pool_stats():
+    """Connection pool hit/wait counters (admin endpoint)"""
+    return jsonify(pool.stats())
+
+def connection_gauges():
+    """Per-process connection state for /api/metrics, summed across workers"""
+    stats = pool.stats()
+    return [
+        ('sqlite_pool_connections', 'Pooled SQLite connections by state', 'gauge',
+         [({'state': 'in_use'}, stats['in_use']), ({'state': 'idle'}, stats['idle'])]),
+        ('sqlite_pool_waits_total', 'Times a request waited for a free connection', 'counter', [({}, stats['waits'])]),
+        ('sqlite_pool_timeouts_total', 'Times no connection freed up in time', 'counter', [({}, stats['timeouts'])]),
+        ('smtp_connections_total', 'SMTP sessions opened by the delivery worker', 'counter',
+         [({}, delivery_worker.connects)]),
+        ('smtp_sessions_open', 'Delivery workers holding an SMTP session', 'gauge',
+         [({}, int(delivery_worker.connected))]),
+    ]
+
+add_process_gauges(connection_gauges)
+
+@api.route('/api/metrics', methods=['GET'])
+@require_metrics_access
+def prometheus_metrics():
+    """Prometheus metrics merged across every worker process (admin endpoint)"""
+    try:
+        otp_codes = otp_store.size()
+        emails = queue_counts()
+    except sqlite3.Error as e:
+        print(f"Error reading metrics gauges: {e}")
+        otp_codes, emails = None, {}
+    gauges = [('email_queue_messages', 'Outbound emails by delivery status', 'gauge',
+               [({'status': status}, count) for status, count in emails.items()])]
+    if otp_codes is not None:
+        gauges.append(('otp_store_codes', 'One-time passcodes currently stored', 'gauge', [({}, otp_codes)]))
+    return current_app.response_class(render_metrics(gauges), mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/metrics/profiler', methods=['GET'])
+@require_metrics_access
+def slow_request_profiler():
+    """Current settings of the slow-request sampling profiler"""
+    return jsonify(profiler_settings())
+
+@api.route('/api/metrics/profiler', methods=['PUT'])
+@require_admin
+def switch_slow_request_profiler():
+    """Switch the slow-request sampling profiler (admin endpoint).
+    
+    PUT ``{"enabled": true, "threshold_ms": 250}``; every worker picks it up
+    within a few seconds.
+    """
+    data = request.get_json(silent=True) or {}
+    if 'enabled' not in data:
+        return jsonify({'error': 'enabled is required'}), 400
+    try:
+        threshold_ms = float(data['threshold_ms']) if data.get('threshold_ms') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'threshold_ms must be numeric'}), 400
+    if threshold_ms is not None and threshold_ms < 0:
+        return jsonify({'error': 'threshold_ms must not be negative'}), 400
+    return jsonify(set_profiler(data['enabled'], threshold_ms))
+
+@api.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the worker is up and serving requests"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+@api.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: the database is reachable and fully migrated (503 otherwise)"""
+    checks = {}
+    ready = True
+    try:
+        version = schema_version(get_db())
+        checks['database'] = 'ok'
+        checks['schema_version'] = version
+        if version < len(MIGRATIONS):
+            checks['database'] = f'schema at version {version}, expected {len(MIGRATIONS)}'
+            ready = False
+    except sqlite3.Error as e:
+        checks['database'] = str(e)
+        ready = False
+    checks['quotations'] = quote_store.stats()['quotes']
+    # Not stats(): its queue count would take a second pooled connection while this request holds one
+    checks['email_worker'] = delivery_worker.running
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+@api.route('/api/test', methods=['GET'])
+def test_endpoint():
+    return jsonify({'message': 'Backend is working!', 'status': 'success'})
+
+@api.route('/api/send-otp', methods=['POST'])
+def send_otp():
+    """Send OTP to user's email"""
+    body, status, headers = request_otp(request.get_json(silent=True), request.remote_addr,
+                                        request.headers.get('User-Agent', 'Unknown'))
+    return jsonify(body), status, headers
+
+@api.route('/api/verify-otp', methods=['POST'])
+def verify_otp():
+    """Verify OTP and authenticate user"""
+    body, status, headers = check_otp(request.get_json(silent=True), request.remote_addr,
+                                      request.headers.get('User-Agent', 'Unknown'))
+    return jsonify(body), status, headers
+
+@api.route('/api/logout', methods=['POST'])
+def logout():
+    """Revoke the presented session token"""
+    body, status, headers = end_session(bearer_token(), request.remote_addr,
+                                        request.headers.get('User-Agent', 'Unknown'))
+    return jsonify(body), status, headers
+
+@api.route('/api/send-confirmation-email', methods=['POST'])
 def send_confirmation_email():
     """Send confirmation email for submitted application"""
-    try:
-        data = request.get_json()
-        email = data.get('email')
-        application_number = data.get('applicationNumber')
-        application_id = data.get('applicationId')
-        submitted_date = data.get('submittedDate')
-        submitted_time = data.get('submittedTime')
-        
-        if not email:
-            return jsonify({'error': 'Email is required'}), 400
-        
-        # Create confirmation email
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = email
-        msg['Subject'] = f"UK Power Networks - Application Confirmation ({application_number})"
-        
-        # Email body
-        body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <h1 style="color: #007bff; margin: 0;">UK Power Networks</h1>
-                    <p style="color: #666; margin: 5px 0;">Application Portal</p>
-                </div>
-                
-                <div style="background: #f8f9fa; padding: 30px; border-radius: 8px; margin-bottom: 20px;">
-                    <h2 style="color: #28a745; margin-top: 0;">✅ Application Submitted Successfully!</h2>
-                    <p>Dear Applicant,</p>
-                    <p>We are pleased to confirm that your application has been successfully submitted to UK Power Networks.</p>
-                    
-                    <div style="background: white; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                        <h3 style="color: #333; margin-top: 0;">Application Details</h3>
-                        <table style="width: 100%; border-collapse: collapse;">
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Application Number:</td>
-                                <td style="padding: 8px 0;">{application_number}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Application ID:</td>
-                                <td style="padding: 8px 0;">{application_id or 'N/A'}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Submitted Date:</td>
-                                <td style="padding: 8px 0;">{submitted_date}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Submitted Time:</td>
-                                <td style="padding: 8px 0;">{submitted_time}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Status:</td>
-                                <td style="padding: 8px 0; color: #28a745; font-weight: bold;">Submitted</td>
-                            </tr>
-                        </table>
-                    </div>
-                    
-                    <h3 style="color: #333;">What happens next?</h3>
-                    <ol style="color: #333;">
-                        <li style="margin-bottom: 8px;"><strong>Initial Review:</strong> Our team will review your application and may contact you for additional information if needed.</li>
-                        <li style="margin-bottom: 8px;"><strong>Site Survey:</strong> If required, we will arrange a site survey to assess the connection requirements.</li>
-                        <li style="margin-bottom: 8px;"><strong>Quote Generation:</strong> We will generate your quote based on the information provided and site assessment.</li>
-                        <li style="margin-bottom: 8px;"><strong>Quote Delivery:</strong> Your quote will be delivered via your preferred method within 10-15 working days.</li>
-                    </ol>
-                    
-                    <div style="background: #fff3cd; padding: 15px; border-radius: 6px; margin: 20px 0;">
-                        <h4 style="color: #856404; margin-top: 0;">Important Information</h4>
-                        <ul style="color: #333; margin: 0;">
-                            <li>Please keep your application reference number safe as you will need it for future correspondence.</li>
-                            <li>If you need to make any changes to your application, please contact us as soon as possible.</li>
-                            <li>Quotes are valid for 90 days from the date of issue.</li>
-                        </ul>
-                    </div>
-                </div>
-                
-                <div style="text-align: center; color: #666; font-size: 0.9em;">
-                    <p>Need help? Contact support at applications@ukpowernetworks.co.uk</p>
-                    <p>Phone: 0800 029 4285 | Hours: Monday to Friday, 8am to 6pm</p>
-                    <p>&copy; 2025 UK Power Networks. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_ADDRESS, email, text)
-        server.quit()
-        
-        print(f"Confirmation email sent successfully to {email}")
-        return jsonify({'message': 'Confirmation email sent successfully'})
-        
-    except Exception as e:
-        print(f"Error sending confirmation email: {e}")
-        return jsonify({'error': 'Failed to send confirmation email'}), 500
+    body, status, headers = queue_confirmation_email(request.get_json(silent=True))
+    return jsonify(body), status, headers
 
-@app.route('/api/login-logs', methods=['GET'])
+@api.route('/api/login-logs', methods=['GET'])
+@require_admin
 def get_login_logs():
-    """Get login activity logs (admin endpoint)"""
+    """Get login activity logs (admin endpoint).
+
+    Newest first by default, tailing the file from EOF; ``order=asc`` with
+    ``since``/``until`` seeks through the sparse offset index. Pass the
+    returned ``next_cursor`` as ``cursor`` to fetch the next page.
+    """
     try:
-        log_file = os.path.join(os.path.dirname(__file__), 'logs', 'login_activities.log')
-        
-        if not os.path.exists(log_file):
+        limit = min(int(request.args.get('limit', 100)), MAX_LOG_QUERY_LIMIT)
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'limit and cursor must be integers'}), 400
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': "order must be 'asc' or 'desc'"}), 400
+    if limit < 1 or (cursor is not None and cursor < 0):
+        return jsonify({'error': 'limit must be positive and cursor non-negative'}), 400
+
+    try:
+        if not os.path.exists(LOGIN_LOG_FILE):
             return jsonify({'message': 'No login logs found', 'logs': []})
-        
-        # Read the log file
-        with open(log_file, 'r') as f:
-            logs = f.readlines()
-        
-        # Parse logs and return last 100 entries
-        parsed_logs = []
-        for log_line in logs[-100:]:  # Last 100 entries
-            if log_line.strip():
-                # Parse log line (format: timestamp - level - message)
-                parts = log_line.strip().split(' - ', 2)
-                if len(parts) >= 3:
-                    timestamp, level, message = parts
-                    parsed_logs.append({
-                        'timestamp': timestamp,
-                        'level': level,
-                        'message': message
-                    })
-        
+
+        filters = {
+            'activity_type': request.args.get('activity_type'),
+            'status': request.args.get('status'),
+            'email': request.args.get('email'),
+            'ip_address': request.args.get('ip')
+        }
+        logs, next_cursor, index = query_login_logs(
+            limit=limit,
+            cursor=cursor,
+            order=order,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            filters=filters
+        )
+
         return jsonify({
-            'message': f'Found {len(parsed_logs)} log entries',
-            'logs': parsed_logs,
-            'total_lines': len(logs)
+            'message': f'Found {len(logs)} log entries',
+            'logs': logs,
+            'next_cursor': next_cursor,
+            'total_lines': index['line_count']
         })
         
     except Exception as e:
         return jsonify({'error': f'Failed to read logs: {str(e)}'}), 500
 
-@app.route('/api/login-logs/clear', methods=['POST'])
+@api.route('/api/login-logs/clear', methods=['POST'])
+@require_admin
 def clear_login_logs():
-    """Clear login activity logs (admin endpoint)"""
+    """Rotate the login activity log into a compressed backup (admin endpoint)"""
     try:
-        log_file = os.path.join(os.path.dirname(__file__), 'logs', 'login_activities.log')
-        
-        if os.path.exists(log_file):
-            # Backup current log before clearing
-            backup_file = f"{log_file}.backup.{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            os.rename(log_file, backup_file)
-            
-            return jsonify({
-                'message': 'Login logs cleared successfully',
-                'backup_created': backup_file
-            })
-        else:
+        backup_file = login_activity_log.rotate()
+        if backup_file is None:
             return jsonify({'message': 'No login logs to clear'})
+        
+        return jsonify({
+            'message': 'Login logs cleared successfully',
+            'backup_created': backup_file
+        })
             
     except Exception as e:
         return jsonify({'error': f'Failed to clear logs: {str(e)}'}), 500
 
 if __name__ == '__main__':
-    init_db()
+    # Development server only; production runs gunicorn -c gunicorn.conf.py wsgi:app.
+    # Set FLASK_DEBUG=1 for the reloader and debugger.
+    startup()
+    delivery_worker.start()
     # Use 0.0.0.0 to allow external connections in Docker
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+    create_app().run(host='0.0.0.0', port=int(os.environ.get('PORT', '5000')), threaded=True)
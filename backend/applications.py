@@ -0,0 +1,389 @@
+import base64
+import html
+import json
+import math
+import re
+import sqlite3
+from datetime import datetime, timezone
+
+from geometry import index_application_geometry
+from schema import (JSON_SECTIONS, SEARCH_WEIGHTS, hot_fields, section_hot_fields, json_merge_patch,
+                    normalize_postcode)
+
+# Attempts for a section PATCH that loses a version race without If-Match
+PATCH_RETRIES = 3
+
+# Outcomes of patch_section
+UPDATED = 'updated'
+NOT_FOUND = 'not_found'
+CONFLICT = 'conflict'
+
+# Listing: scalar columns returned by default; JSON sections only when asked for
+LIST_COLUMNS = ['id', 'status', 'version', 'postcode', 'postcode_district', 'applicant_email',
+                'estimated_cost', 'estimated_at', 'created_at', 'updated_at']
+LIST_FIELDS = LIST_COLUMNS + JSON_SECTIONS
+LIST_SORTS = ['id', 'updated_at']
+MAX_LIST_LIMIT = 500
+# Upper bound for id comparisons when a created_at bound is past the newest row
+MAX_ROWID = 2 ** 63 - 1
+
+# Full-text search
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_OFFSET = 1000
+MAX_SEARCH_TERMS = 10
+# snippet() marks matches with control characters; the text between them is
+# HTML-escaped before they become <mark> tags, so indexed user text never
+# reaches the client as markup
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+SNIPPET_TOKENS = 12
+
+
+def if_match_version(if_match):
+    """Row version the client last saw, from a parsed If-Match header (None if absent)"""
+    if not if_match or if_match.star_tag:
+        return None
+    for etag in if_match.as_set():
+        try:
+            return int(etag)
+        except ValueError:
+            continue
+    return None
+
+
+def _section_values(data):
+    return [json.dumps(data.get(section, {})) for section in JSON_SECTIONS]
+
+
+def insert_application(conn, data):
+    """Insert a new application; returns its id"""
+    fields = hot_fields(data.get('applicant_details'), data.get('site_address'), data.get('summary'))
+    cursor = conn.execute('''
+        INSERT INTO applications (applicant_details, general_information, site_address,
+                                load_details, other_contact, click_quote_data,
+                                project_details, auto_quote_eligibility, upload_docs, summary,
+                                postcode, postcode_district, applicant_email, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, 'draft'))
+    ''', (
+        *_section_values(data),
+        fields['postcode'], fields['postcode_district'],
+        fields['applicant_email'], fields['status']
+    ))
+    index_application_geometry(conn, cursor.lastrowid, data.get('click_quote_data'))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def application_version(conn, app_id):
+    row = conn.execute('SELECT version FROM applications WHERE id = ?', (app_id,)).fetchone()
+    return row['version'] if row else None
+
+
+def fetch_application(conn, app_id):
+    """The application row with its JSON sections parsed, or None"""
+    app_row = conn.execute('SELECT * FROM applications WHERE id = ?', (app_id,)).fetchone()
+    if not app_row:
+        return None
+    app_dict = dict(app_row)
+    for field in JSON_SECTIONS:
+        app_dict[field] = json.loads(app_dict[field]) if app_dict[field] else {}
+    return app_dict
+
+
+def update_application(conn, app_id, data, expected=None):
+    """Replace every section; with ``expected`` only if the row is still at that version.
+
+    Returns (updated, current_version); current_version is None when the
+    application does not exist.
+    """
+    fields = hot_fields(data.get('applicant_details'), data.get('site_address'), data.get('summary'))
+    cursor = conn.execute('''
+        UPDATE applications SET
+            applicant_details = ?, general_information = ?, site_address = ?,
+            load_details = ?, other_contact = ?, click_quote_data = ?,
+            project_details = ?, auto_quote_eligibility = ?, upload_docs = ?,
+            summary = ?, postcode = ?, postcode_district = ?, applicant_email = ?,
+            status = COALESCE(?, status), version = version + 1,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (? IS NULL OR version = ?)
+    ''', (
+        *_section_values(data),
+        fields['postcode'], fields['postcode_district'],
+        fields['applicant_email'], fields['status'],
+        app_id, expected, expected
+    ))
+    if cursor.rowcount:
+        index_application_geometry(conn, app_id, data.get('click_quote_data'))
+    conn.commit()
+    return cursor.rowcount > 0, application_version(conn, app_id)
+
+
+def patch_section(conn, app_id, section, patch, expected=None, retries=PATCH_RETRIES):
+    """Merge-patch one JSON section (RFC 7386) with optimistic concurrency.
+
+    Without ``expected`` a lost race is retried against the fresh row; with
+    it the caller asked for that exact version, so a mismatch is a conflict.
+    Returns (outcome, version) with outcome UPDATED, NOT_FOUND or CONFLICT.
+    """
+    for _ in range(retries):
+        row = conn.execute(f'SELECT {section}, version FROM applications WHERE id = ?', (app_id,)).fetchone()
+        if not row:
+            return NOT_FOUND, None
+        if expected is not None and row['version'] != expected:
+            return CONFLICT, row['version']
+
+        merged = json_merge_patch(json.loads(row[section]) if row[section] else {}, patch)
+        columns = section_hot_fields(section, merged)
+        assignments = ''.join(f', {column} = ?' for column in columns)
+        cursor = conn.execute(f'''
+            UPDATE applications SET {section} = ?{assignments},
+                version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND version = ?
+        ''', (json.dumps(merged), *columns.values(), app_id, row['version']))
+        if cursor.rowcount and section == 'click_quote_data':
+            index_application_geometry(conn, app_id, merged)
+        conn.commit()
+
+        if cursor.rowcount:
+            return UPDATED, row['version'] + 1
+        if expected is not None:
+            break
+
+    return CONFLICT, application_version(conn, app_id)
+
+
+def list_load_items(conn, app_id):
+    return [dict(item) for item in conn.execute('SELECT * FROM load_items WHERE application_id = ?', (app_id,))]
+
+
+LOAD_ITEM_INSERT = '''
+    INSERT INTO load_items (application_id, connection_type, phases, heating_type,
+                            bedrooms, quantity, load_per_installation, summed_load)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def load_item_number(value):
+    """A finite number from a load item field; whole numbers come back as int, like the column affinity"""
+    number = float(value or 0)
+    if not math.isfinite(number):
+        raise ValueError('Load item numbers must be finite')
+    return int(number) if number.is_integer() else number
+
+
+def load_item_params(app_id, item):
+    """INSERT parameters for a load item, with summed_load computed server-side.
+
+    Any client-supplied ``summed_load`` is ignored. Raises ValueError,
+    TypeError or AttributeError on a malformed item.
+    """
+    quantity = load_item_number(item.get('quantity'))
+    load_per_installation = float(load_item_number(item.get('load_per_installation')))
+    return (
+        app_id, item.get('connection_type'), item.get('phases'),
+        item.get('heating_type'), item.get('bedrooms'), quantity,
+        load_per_installation, quantity * load_per_installation
+    )
+
+
+def add_load_item(conn, app_id, data):
+    """Insert one load item; returns its id, or None when the application does not exist"""
+    try:
+        cursor = conn.execute(LOAD_ITEM_INSERT, load_item_params(app_id, data))
+    except sqlite3.IntegrityError:
+        # foreign_keys is on, so the insert fails for an unknown application
+        conn.rollback()
+        return None
+    conn.commit()
+    return cursor.lastrowid
+
+
+def add_load_items(conn, app_id, items):
+    """Insert many load items in one transaction; returns the number inserted, or None
+    when the application does not exist"""
+    params = [load_item_params(app_id, item) for item in items]
+    try:
+        conn.executemany(LOAD_ITEM_INSERT, params)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None
+    conn.commit()
+    return len(params)
+
+
+def load_item_totals(conn, app_id):
+    """Aggregate load per connection type and phase for an application"""
+    rows = conn.execute('''
+        SELECT connection_type, phases, COUNT(*) AS items,
+               SUM(quantity) AS quantity, SUM(summed_load) AS summed_load
+        FROM load_items WHERE application_id = ?
+        GROUP BY connection_type, phases
+        ORDER BY connection_type, phases
+    ''', (app_id,)).fetchall()
+    groups = [dict(row) for row in rows]
+    return {
+        'by_type_and_phase': groups,
+        'total_items': sum(group['items'] for group in groups),
+        'total_quantity': sum(group['quantity'] or 0 for group in groups),
+        'total_load': sum(group['summed_load'] or 0 for group in groups)
+    }
+
+
+def delete_load_item(conn, app_id, item_id):
+    conn.execute('DELETE FROM load_items WHERE id = ? AND application_id = ?', (item_id, app_id))
+    conn.commit()
+
+
+def encode_cursor(sort, row):
+    """Opaque keyset cursor: the sort value and id of the last row on a page"""
+    key = [row['id']] if sort == 'id' else [row[sort], row['id']]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor or one from another sort"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Malformed cursor: {e}')
+    types = (int,) if sort == 'id' else (str, int)
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(isinstance(part, kind) and not isinstance(part, bool) for part, kind in zip(key, types))):
+        raise ValueError('Cursor does not match the sort order')
+    return key
+
+
+def parse_timestamp(value):
+    """ISO date or datetime -> the UTC 'YYYY-MM-DD HH:MM:SS' form SQLite's CURRENT_TIMESTAMP stores.
+
+    A value with an offset (or 'Z') is converted to UTC; one without is taken as UTC.
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def application_list_query(limit, cursor=None, sort='id', order='desc', filters=None, fields=None):
+    """SELECT and parameters for one keyset page of applications (``limit + 1`` rows are fetched).
+
+    Every filter is an equality or range on an indexed column, so a page
+    costs an index seek plus ``limit`` rows however large the table grows:
+
+    - ``status``, ``email`` and ``postcode`` (a full postcode, or an outward
+      code such as 'TW14' for the district) use their (column, rowid) indexes
+      for the id sort and their (column, updated_at) indexes otherwise.
+    - ``created_after``/``created_before`` become id bounds, found through the
+      created_at index: ids and created_at both grow with every insert.
+    - ``updated_after``/``updated_before`` range over the updated_at index.
+
+    A date range is only walked in index order by its own sort (created with
+    ``sort=id``, updated with ``sort=updated_at``); across sorts it is still
+    applied, but the page is sorted from every matching row.
+    """
+    fields = fields or LIST_COLUMNS
+    where, params = list_filter_clauses(filters)
+
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    if cursor is not None:
+        key = decode_cursor(sort, cursor)
+        comparison = '<' if order == 'desc' else '>'
+        where.append(f'id {comparison} ?' if sort == 'id' else f'({sort}, id) {comparison} (?, ?)')
+        params.extend(key)
+
+    # id and the sort key are always selected: the next cursor is built from them
+    columns = ', '.join(dict.fromkeys(['id', sort] + list(fields)))
+    order_by = f'id {direction}' if sort == 'id' else f'{sort} {direction}, id {direction}'
+    sql = f"SELECT {columns} FROM applications{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {order_by} LIMIT ?"
+    params.append(limit + 1)
+    return sql, params
+
+
+def list_filter_clauses(filters):
+    """WHERE clauses and parameters for the listing filters (see application_list_query)"""
+    filters = filters or {}
+    where = []
+    params = []
+
+    if filters.get('status'):
+        where.append('status = ?')
+        params.append(filters['status'])
+    if filters.get('email'):
+        where.append('applicant_email = ?')
+        params.append(filters['email'].strip().lower())
+    postcode = normalize_postcode(filters.get('postcode'))
+    if postcode:
+        where.append('postcode = ?' if ' ' in postcode else 'postcode_district = ?')
+        params.append(postcode)
+
+    first_created = 'SELECT id FROM applications WHERE created_at >= ? ORDER BY created_at, id LIMIT 1'
+    if filters.get('created_after'):
+        where.append(f'id >= ({first_created})')
+        params.append(parse_timestamp(filters['created_after']))
+    if filters.get('created_before'):
+        where.append(f'id < COALESCE(({first_created}), {MAX_ROWID})')
+        params.append(parse_timestamp(filters['created_before']))
+    if filters.get('updated_after'):
+        where.append('updated_at >= ?')
+        params.append(parse_timestamp(filters['updated_after']))
+    if filters.get('updated_before'):
+        where.append('updated_at < ?')
+        params.append(parse_timestamp(filters['updated_before']))
+    return where, params
+
+
+def list_applications(conn, limit, cursor=None, sort='id', order='desc', filters=None, fields=None):
+    """One page of applications with only the requested fields; returns (applications, next_cursor)"""
+    sql, params = application_list_query(limit, cursor, sort, order, filters, fields)
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+
+    applications = []
+    for row in rows[:limit]:
+        item = dict(row)
+        for field in JSON_SECTIONS:
+            if field in item:
+                item[field] = json.loads(item[field]) if item[field] else {}
+        applications.append(item)
+    return applications, next_cursor
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for free text: every word must match, each as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    never interpreted. Returns None when the text has no words.
+    """
+    terms = re.findall(r'\w+', text or '')[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_applications(conn, text, limit=20, offset=0, status=None):
+    """Applications matching ``text``, best bm25 match first, each with a highlighted snippet"""
+    query = fts_query(text)
+    if query is None:
+        return []
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    rows = conn.execute(f'''
+        SELECT applications.id, applications.status, applications.postcode, applications.applicant_email,
+               applications.updated_at,
+               snippet(applications_fts, -1, ?, ?, '...', ?) AS snippet,
+               bm25(applications_fts, {weights}) AS score
+        FROM applications_fts
+        JOIN applications ON applications.id = applications_fts.rowid
+        WHERE applications_fts MATCH ? AND (? IS NULL OR applications.status = ?)
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    ''', (SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS, query, status, status, limit, offset)).fetchall()
+    results = [dict(row) for row in rows]
+    for result in results:
+        # Fields missing from a section leave runs of separators in the indexed text
+        result['snippet'] = highlight_snippet(' '.join(result['snippet'].split()))
+    return results
+
+
+def highlight_snippet(snippet):
+    """HTML-escape an FTS snippet, then turn its match markers into <mark> tags"""
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
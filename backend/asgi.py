@@ -0,0 +1,355 @@
+"""ASGI variant of the API: async views for the email- and database-heavy routes.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+Same URL contract as the Flask app. The routes below are served natively by
+Quart: SQLite work is offloaded to a bounded thread pool so a slow query
+never blocks the event loop, and outbound email is delivered over one
+aiosmtplib session by AsyncEmailDeliveryWorker. Every other route (and CORS
+preflights) falls through to the unchanged Flask app, run in threads by
+a2wsgi.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from a2wsgi import WSGIMiddleware
+from quart import Blueprint, Quart, current_app, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from app import CORS_ORIGINS, CORS_EXPOSE_HEADERS, create_app, startup
+from applications import (if_match_version, insert_application, application_version, fetch_application,
+                          update_application, patch_section, list_load_items, add_load_item, delete_load_item,
+                          NOT_FOUND as APPLICATION_NOT_FOUND, CONFLICT as VERSION_CONFLICT)
+from auth import AUTH_REQUIRED, InvalidToken, is_admin, is_metrics_token, parse_bearer, token_signer
+from db import DATA_DIR, DB_POOL_SIZE, pool
+from login import login_activity_log, request_otp, check_otp, end_session, queue_confirmation_email
+from mailer import AsyncEmailDeliveryWorker
+from metrics import METRICS_ENABLED, add_process_gauges, end_request, start_request
+from schema import JSON_SECTIONS, MIGRATIONS, schema_version
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Threads for blocking work (SQLite, DNS checks); more than the pool would only queue on it
+ASGI_BLOCKING_THREADS = int(os.environ.get('ASGI_BLOCKING_THREADS', str(DB_POOL_SIZE)))
+# Threads a2wsgi runs the Flask fallback routes on
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '10'))
+STARTUP_LOCK_FILE = os.path.join(DATA_DIR, '.startup.lock')
+
+blocking_executor = ThreadPoolExecutor(ASGI_BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+delivery_worker = AsyncEmailDeliveryWorker()
+
+api = Blueprint('async_api', __name__)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the bounded executor, in a copy of the caller's context.
+
+    run_in_executor does not carry contextvars across, so without the copy
+    the request's metrics (query counts and time) would miss the work.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        blocking_executor, context.run, partial(fn, *args, **kwargs))
+
+
+def _with_connection(fn, *args):
+    with pool.connection() as conn:
+        return fn(conn, *args)
+
+
+async def run_db(fn, *args):
+    """``fn(conn, *args)`` with a pooled connection, off the event loop"""
+    return await run_blocking(_with_connection, fn, *args)
+
+
+def locked_startup():
+    """startup() under a file lock: uvicorn workers start side by side, unlike gunicorn's preload"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(STARTUP_LOCK_FILE, 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        startup()
+
+
+def require_auth(view):
+    """Async counterpart of auth.require_auth (the revocation lookup runs off the event loop)"""
+    @wraps(view)
+    async def wrapped(*args, **kwargs):
+        if not AUTH_REQUIRED:
+            return await view(*args, **kwargs)
+        token = parse_bearer(request.headers.get('Authorization'))
+        if not token:
+            return jsonify({'error': 'Authentication required'}), 401
+        try:
+            g.auth = await run_blocking(token_signer.verify, token)
+        except InvalidToken as e:
+            return jsonify({'error': str(e)}), 401
+        g.user_email = g.auth['sub']
+        return await view(*args, **kwargs)
+    return wrapped
+
+
+def require_admin(view):
+    """Async counterpart of auth.require_admin"""
+    @wraps(view)
+    async def wrapped(*args, **kwargs):
+        if AUTH_REQUIRED and not is_admin(g.user_email):
+            return jsonify({'error': 'Administrator access required'}), 403
+        return await view(*args, **kwargs)
+    return require_auth(wrapped)
+
+
+def require_metrics_access(view):
+    """Async counterpart of auth.require_metrics_access"""
+    admin_view = require_admin(view)
+
+    @wraps(view)
+    async def wrapped(*args, **kwargs):
+        if is_metrics_token(parse_bearer(request.headers.get('Authorization'))):
+            return await view(*args, **kwargs)
+        return await admin_view(*args, **kwargs)
+    return wrapped
+
+
+def version_conflict(current_version, expected=None):
+    """412 when the If-Match version is stale, 409 when an unconditional write kept losing races"""
+    response = jsonify({
+        'error': 'Application was modified by another request',
+        'version': current_version
+    })
+    response.set_etag(str(current_version))
+    return response, 409 if expected is None else 412
+
+
+@api.route('/api/applications', methods=['POST'])
+@require_auth
+async def create_application():
+    application_id = await run_db(insert_application, await request.get_json())
+    return jsonify({'id': application_id, 'message': 'Application created successfully'})
+
+
+@api.route('/api/applications/<int:app_id>', methods=['GET', 'PUT'])
+@require_auth
+async def handle_application(app_id):
+    if request.method == 'GET':
+        # Answer conditional requests before loading and parsing the JSON sections
+        if request.if_none_match:
+            version = await run_db(application_version, app_id)
+            if version is not None and request.if_none_match.contains(str(version)):
+                response = current_app.response_class('', status=304)
+                response.set_etag(str(version))
+                return response
+
+        app_dict = await run_db(fetch_application, app_id)
+        if not app_dict:
+            return jsonify({'error': 'Application not found'}), 404
+
+        response = jsonify(app_dict)
+        response.set_etag(str(app_dict['version']))
+        return response
+
+    expected = if_match_version(request.if_match)
+    updated, version = await run_db(update_application, app_id, await request.get_json(), expected)
+    if not updated and version is not None:
+        return version_conflict(version, expected)
+
+    response = jsonify({'message': 'Application updated successfully'})
+    if version is not None:
+        response.set_etag(str(version))
+    return response
+
+
+@api.route('/api/applications/<int:app_id>/<section>', methods=['PATCH'])
+@require_auth
+async def patch_application_section(app_id, section):
+    """Merge-patch a single JSON section (RFC 7386) with optimistic concurrency"""
+    if section not in JSON_SECTIONS:
+        return jsonify({'error': f'Unknown section: {section}'}), 404
+
+    patch = await request.get_json(silent=True)
+    if not isinstance(patch, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+
+    expected = if_match_version(request.if_match)
+    outcome, version = await run_db(patch_section, app_id, section, patch, expected)
+    if outcome == APPLICATION_NOT_FOUND:
+        return jsonify({'error': 'Application not found'}), 404
+    if outcome == VERSION_CONFLICT:
+        return version_conflict(version, expected)
+
+    response = jsonify({'message': 'Application section updated successfully', 'section': section, 'version': version})
+    response.set_etag(str(version))
+    return response
+
+
+@api.route('/api/load-items/<int:app_id>', methods=['GET', 'POST', 'DELETE'])
+@require_auth
+async def handle_load_items(app_id):
+    if request.method == 'GET':
+        return jsonify(await run_db(list_load_items, app_id))
+
+    if request.method == 'POST':
+        try:
+            item_id = await run_db(add_load_item, app_id, await request.get_json())
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': 'quantity and load_per_installation must be finite numbers'}), 400
+        if item_id is None:
+            return jsonify({'error': 'Application not found'}), 404
+        return jsonify({'message': 'Load item added successfully'})
+
+    await run_db(delete_load_item, app_id, request.args.get('item_id'))
+    return jsonify({'message': 'Load item deleted successfully'})
+
+
+async def login_response(fn, *args, **kwargs):
+    """Run a login.py handler off the loop and serialise its (body, status, headers)"""
+    body, status, headers = await run_blocking(fn, *args, **kwargs)
+    return jsonify(body), status, headers
+
+
+@api.route('/api/send-otp', methods=['POST'])
+async def send_otp():
+    """Send OTP to user's email"""
+    # Queue without waking the threaded worker; the async one drains the queue here
+    response = await login_response(request_otp, await request.get_json(silent=True), request.remote_addr,
+                                    request.headers.get('User-Agent', 'Unknown'), wake=False)
+    delivery_worker.wake()
+    return response
+
+
+@api.route('/api/verify-otp', methods=['POST'])
+async def verify_otp():
+    """Verify OTP and authenticate user"""
+    return await login_response(check_otp, await request.get_json(silent=True), request.remote_addr,
+                                request.headers.get('User-Agent', 'Unknown'))
+
+
+@api.route('/api/logout', methods=['POST'])
+async def logout():
+    """Revoke the presented session token"""
+    return await login_response(end_session, parse_bearer(request.headers.get('Authorization')),
+                                request.remote_addr, request.headers.get('User-Agent', 'Unknown'))
+
+
+@api.route('/api/send-confirmation-email', methods=['POST'])
+async def send_confirmation_email():
+    """Send confirmation email for submitted application"""
+    response = await login_response(queue_confirmation_email, await request.get_json(silent=True), wake=False)
+    delivery_worker.wake()
+    return response
+
+
+@api.route('/api/email-queue/stats', methods=['GET'])
+@require_metrics_access
+async def get_email_queue_stats():
+    """Outbound email queue depth and delivery counters (admin endpoint)"""
+    return jsonify(await run_blocking(delivery_worker.stats))
+
+
+@api.route('/api/health/live', methods=['GET'])
+async def liveness():
+    """Liveness probe: the worker is up and serving requests"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+
+@api.route('/api/health/ready', methods=['GET'])
+async def readiness():
+    """Readiness probe: the database is reachable and fully migrated (503 otherwise)"""
+    checks = {}
+    ready = True
+    try:
+        version = await run_db(schema_version)
+        checks['database'] = 'ok'
+        checks['schema_version'] = version
+        if version < len(MIGRATIONS):
+            checks['database'] = f'schema at version {version}, expected {len(MIGRATIONS)}'
+            ready = False
+    except Exception as e:
+        checks['database'] = str(e)
+        ready = False
+    checks['email_worker'] = delivery_worker.running
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+
+def add_cors_headers(response):
+    """Mirror Flask-CORS for native routes; preflights are answered by the Flask app"""
+    origin = request.headers.get('Origin')
+    if origin in CORS_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Expose-Headers'] = ', '.join(CORS_EXPOSE_HEADERS)
+        response.vary.add('Origin')
+    return response
+
+
+async def start_request_metrics():
+    # Hooks must be coroutines: Quart runs plain functions in a thread, out of the request's context
+    start_request(profile=False)
+
+
+async def end_request_metrics(response):
+    end_request(request.method, request.url_rule.rule if request.url_rule else 'unmatched', response.status_code)
+    return response
+
+
+def smtp_gauges():
+    return [
+        ('smtp_connections_total', 'SMTP sessions opened by the delivery worker', 'counter',
+         [({}, delivery_worker.connects)]),
+        ('smtp_sessions_open', 'Delivery workers holding an SMTP session', 'gauge',
+         [({}, int(delivery_worker.connected))]),
+    ]
+
+
+def create_async_app():
+    quart_app = Quart(__name__, static_folder=None)
+    quart_app.register_blueprint(api)
+    quart_app.after_request(add_cors_headers)
+    if METRICS_ENABLED:
+        quart_app.before_request(start_request_metrics)
+        quart_app.after_request(end_request_metrics)
+        add_process_gauges(smtp_gauges)
+
+    @quart_app.before_serving
+    async def start_background_work():
+        await run_blocking(locked_startup)
+        delivery_worker.start()
+
+    @quart_app.after_serving
+    async def stop_background_work():
+        await delivery_worker.stop()
+        login_activity_log.stop()
+
+    return quart_app
+
+
+class Dispatcher:
+    """Send requests Quart has a route for to Quart and everything else to the Flask app"""
+
+    def __init__(self, native, fallback):
+        self.native = native
+        self.fallback = fallback
+        self._urls = native.url_map.bind('localhost')
+
+    def is_native(self, scope):
+        if scope['type'] != 'http':
+            return True  # lifespan events drive Quart's before/after_serving
+        if scope['method'] == 'OPTIONS':
+            return False
+        try:
+            self._urls.match(scope['path'], scope['method'])
+        except HTTPException:
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        target = self.native if self.is_native(scope) else self.fallback
+        await target(scope, receive, send)
+
+
+app = Dispatcher(create_async_app(), WSGIMiddleware(create_app(), workers=ASGI_WSGI_THREADS))
@@ -0,0 +1,232 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, jsonify, request
+
+from db import DATA_DIR, pool
+
+# Token configuration (override through the environment)
+AUTH_TOKEN_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_TTL_SECONDS', str(8 * 60 * 60)))
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '1') == '1'
+# Comma-separated emails allowed on the admin routes
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+# Static bearer token for monitoring (Prometheus) on the metrics and stats routes; unset disables it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+REVOKED_TOKEN_CACHE_SIZE = int(os.environ.get('REVOKED_TOKEN_CACHE_SIZE', '10000'))
+REVOKED_TOKEN_SWEEP_SECONDS = float(os.environ.get('REVOKED_TOKEN_SWEEP_SECONDS', '600'))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get('VERIFIED_TOKEN_CACHE_SIZE', '10000'))
+SECRET_KEY_FILE = os.path.join(DATA_DIR, 'secret_key')
+
+
+class InvalidToken(Exception):
+    """Raised when a token is malformed, forged, expired or revoked"""
+
+
+def load_secret_key():
+    """Signing key from SECRET_KEY, else a random key persisted in the data directory.
+
+    Persisting the generated key means every worker process (and restarts)
+    agree on it without any configuration.
+    """
+    configured = os.environ.get('SECRET_KEY')
+    if configured:
+        return configured.encode('utf-8')
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(SECRET_KEY_FILE, 'rb') as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class RevokedTokens:
+    """Revoked token ids in the shared database, each kept until the token would expire.
+
+    A logout in one worker process holds in every other. Ids found revoked
+    are cached in a bounded per-process LRU so a revoked token that keeps
+    coming back skips the query; falling out of the cache only costs a
+    lookup, never the revocation. Expired ids are swept on revocation.
+    """
+
+    def __init__(self, max_size=REVOKED_TOKEN_CACHE_SIZE, sweep_interval=REVOKED_TOKEN_SWEEP_SECONDS):
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _cache(self, token_id, expires_at):
+        with self._lock:
+            self._entries[token_id] = expires_at
+            self._entries.move_to_end(token_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def add(self, token_id, expires_at):
+        now = time.time()
+        with pool.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)',
+                         (token_id, expires_at))
+            conn.commit()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = now
+                conn.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (now,))
+                conn.commit()
+        self._cache(token_id, expires_at)
+
+    def __contains__(self, token_id):
+        expires_at = self._entries.get(token_id)
+        if expires_at is None:
+            with pool.connection() as conn:
+                row = conn.execute('SELECT expires_at FROM revoked_tokens WHERE jti = ?', (token_id,)).fetchone()
+            if row is None:
+                return False
+            expires_at = row['expires_at']
+            self._cache(token_id, expires_at)
+        return expires_at > time.time()
+
+    def __len__(self):
+        with pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM revoked_tokens WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+
+
+class TokenSigner:
+    """Stateless HMAC-SHA256 session tokens: ``base64url(payload).base64url(signature)``.
+
+    Verification is a constant-time signature comparison plus an expiry
+    check and a primary-key lookup in the shared revocation table.
+    """
+
+    def __init__(self, secret_key, ttl=AUTH_TOKEN_TTL_SECONDS, cache_size=VERIFIED_TOKEN_CACHE_SIZE):
+        self._key = secret_key
+        self.ttl = ttl
+        self.revoked = RevokedTokens()
+        # Tokens whose signature already checked out; a wizard session sends
+        # the same token on every call, so repeats skip the HMAC and decode.
+        self._verified = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def _sign(self, payload_part):
+        return hmac.new(self._key, payload_part, hashlib.sha256).digest()
+
+    def issue(self, subject):
+        now = int(time.time())
+        payload = {'sub': subject, 'iat': now, 'exp': now + self.ttl, 'jti': secrets.token_urlsafe(12)}
+        payload_part = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).encode('ascii')
+        return f"{payload_part.decode('ascii')}.{_b64encode(self._sign(payload_part))}"
+
+    def verify(self, token):
+        """Return the token payload or raise InvalidToken"""
+        payload = self._verified.get(token)
+        if payload is None:
+            payload = self._verify_signature(token)
+            with self._lock:
+                self._verified[token] = payload
+                if len(self._verified) > self._cache_size:
+                    self._verified.popitem(last=False)
+        if payload['exp'] <= time.time():
+            raise InvalidToken('Token has expired')
+        if payload['jti'] in self.revoked:
+            raise InvalidToken('Token has been revoked')
+        return payload
+
+    def _verify_signature(self, token):
+        try:
+            payload_part, signature_part = token.split('.')
+            signature = _b64decode(signature_part)
+            expected = self._sign(payload_part.encode('ascii'))
+        except (ValueError, AttributeError):
+            raise InvalidToken('Malformed token')
+        if not hmac.compare_digest(signature, expected):
+            raise InvalidToken('Invalid token signature')
+
+        return json.loads(_b64decode(payload_part))
+
+    def revoke(self, payload):
+        self.revoked.add(payload['jti'], payload['exp'])
+
+
+token_signer = TokenSigner(load_secret_key())
+
+
+def parse_bearer(header):
+    """Token from an ``Authorization: Bearer <token>`` header value, else None"""
+    scheme, _, token = (header or '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+
+def bearer_token():
+    return parse_bearer(request.headers.get('Authorization'))
+
+
+def require_auth(view):
+    """Reject the request with 401 unless it carries a valid bearer token.
+
+    The token payload is available as ``g.auth`` and the user's email as
+    ``g.user_email``. Set AUTH_REQUIRED=0 to disable the check in development.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not AUTH_REQUIRED:
+            return view(*args, **kwargs)
+        token = bearer_token()
+        if not token:
+            return jsonify({'error': 'Authentication required'}), 401
+        try:
+            g.auth = token_signer.verify(token)
+        except InvalidToken as e:
+            return jsonify({'error': str(e)}), 401
+        g.user_email = g.auth['sub']
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def is_admin(email):
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+
+def is_metrics_token(token):
+    return bool(METRICS_TOKEN and token) and hmac.compare_digest(token.encode('utf-8'), METRICS_TOKEN.encode('utf-8'))
+
+
+def require_admin(view):
+    """require_auth, plus the user's email must be listed in ADMIN_EMAILS (403 otherwise)"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if AUTH_REQUIRED and not is_admin(g.user_email):
+            return jsonify({'error': 'Administrator access required'}), 403
+        return view(*args, **kwargs)
+    return require_auth(wrapped)
+
+
+def require_metrics_access(view):
+    """An admin session, or the METRICS_TOKEN a monitoring system is configured with"""
+    admin_view = require_admin(view)
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if is_metrics_token(bearer_token()):
+            return view(*args, **kwargs)
+        return admin_view(*args, **kwargs)
+    return wrapped
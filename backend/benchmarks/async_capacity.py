@@ -0,0 +1,206 @@
+"""Compare concurrent-connection capacity of the threaded (gunicorn) and async (uvicorn asgi:app) servers.
+
+    python -m benchmarks.async_capacity --connections 50,200,500 --duration 10
+
+Each server is started on a temporary database (see load_test.start_server)
+with the same number of worker processes. At every concurrency level the
+client holds that many keep-alive connections open, each sending requests
+back to back, and reports throughput, latency percentiles and errors
+(refused, reset or timed-out connections) per route.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmarks.load_test import (mint_token, percentile, request_json, sample_application,
+                                  start_server, gunicorn_command)
+
+ROUTES = ('application_get', 'application_patch', 'confirmation_email')
+SEED_APPLICATIONS = 50
+REQUEST_TIMEOUT = 30
+
+
+def uvicorn_command(workers):
+    def command(port):
+        return ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    return command
+
+
+SERVERS = {
+    'threaded': lambda args: gunicorn_command,
+    'async': lambda args: uvicorn_command(args.workers),
+}
+
+
+def build_request(route, i, app_ids, host, token):
+    """Raw HTTP/1.1 keep-alive request bytes for one request of the given route"""
+    app_id = app_ids[i % len(app_ids)] if app_ids else 1
+    if route == 'application_get':
+        method, path, body = 'GET', f'/api/applications/{app_id}', None
+    elif route == 'application_patch':
+        method, path, body = 'PATCH', f'/api/applications/{app_id}/site_address', {'addressLine2': f'Unit {i}'}
+    elif route == 'confirmation_email':
+        method, path, body = 'POST', '/api/send-confirmation-email', {
+            'email': f'capacity{i}@example.com', 'applicationNumber': f'CAP-{i}', 'applicationId': app_id
+        }
+    else:
+        raise ValueError(f'Unknown route: {route}')
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    headers = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: keep-alive',
+               f'Content-Length: {len(payload)}']
+    if body is not None:
+        headers.append('Content-Type: application/json')
+    if token:
+        headers.append(f'Authorization: Bearer {token}')
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode('ascii') + payload
+
+
+async def read_response(reader):
+    """Status code of one response, consuming its body (Content-Length framed)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed')
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def connection(url, route, deadline, token, app_ids, offset, samples, errors):
+    parts = urlsplit(url)
+    host = f'{parts.hostname}:{parts.port}'
+    i = offset
+    writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(parts.hostname, parts.port), REQUEST_TIMEOUT)
+            started = time.perf_counter()
+            writer.write(build_request(route, i, app_ids, host, token))
+            status = await asyncio.wait_for(read_response(reader), REQUEST_TIMEOUT)
+            samples.append((time.perf_counter() - started, status))
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            errors[type(e).__name__] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+        i += 1
+    if writer is not None:
+        writer.close()
+
+
+def run_client(url, route, duration, connections, token, app_ids, offset):
+    """One client process holding ``connections`` keep-alive connections for ``duration`` seconds"""
+    samples = []
+    errors = Counter()
+
+    async def main():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            connection(url, route, deadline, token, app_ids, offset + n * 1_000_000, samples, errors)
+            for n in range(connections)
+        ))
+
+    asyncio.run(main())
+    return samples, dict(errors)
+
+
+def measure(executor, processes, url, route, duration, connections, token, app_ids):
+    per_process = [connections // processes + (n < connections % processes) for n in range(processes)]
+    started = time.perf_counter()
+    futures = [
+        executor.submit(run_client, url, route, duration, count, token, app_ids, n * 100_000_000)
+        for n, count in enumerate(per_process) if count
+    ]
+    samples = []
+    errors = Counter()
+    for future in futures:
+        client_samples, client_errors = future.result()
+        samples.extend(client_samples)
+        errors.update(client_errors)
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        'requests': len(samples),
+        'requests_per_second': round(len(samples) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        'status_codes': dict(Counter(str(status) for _, status in samples)),
+        'errors': dict(errors)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', default=','.join(SERVERS))
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--connections', default='50,200,500', help='comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per route and level')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                        help='client processes the connections are spread over')
+    args = parser.parse_args()
+
+    servers = [name for name in args.servers.split(',') if name]
+    routes = [route for route in args.routes.split(',') if route]
+    levels = [int(level) for level in args.connections.split(',') if level]
+    unknown = (set(servers) - set(SERVERS)) | (set(routes) - set(ROUTES))
+    if unknown:
+        parser.error(f"unknown servers or routes: {', '.join(sorted(unknown))}")
+
+    secret_key = secrets.token_hex(32)
+    token = mint_token(secret_key)
+    report = {}
+    with ProcessPoolExecutor(args.processes) as executor:
+        for name in servers:
+            url, server, sink = start_server(args, secret_key, SERVERS[name](args))
+            try:
+                app_ids = []
+                for i in range(SEED_APPLICATIONS):
+                    status, body = request_json(url, 'POST', '/api/applications', sample_application(i), token)
+                    if status == 200:
+                        app_ids.append(body['id'])
+                report[name] = {
+                    route: {
+                        str(level): measure(executor, args.processes, url, route, args.duration, level,
+                                            token, app_ids)
+                        for level in levels
+                    }
+                    for route in routes
+                }
+            finally:
+                server.terminate()
+                server.wait(30)
+                if sink:
+                    sink.stop()
+
+    print(json.dumps({
+        'workers': args.workers,
+        'gunicorn_threads': args.threads,
+        'client_processes': args.processes,
+        'duration_per_level': args.duration,
+        'results': report
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
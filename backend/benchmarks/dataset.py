@@ -0,0 +1,475 @@
+"""Generate a synthetic dataset shaped like ``Test Data C&Q.xlsx``: applications, load items, a login log and quotes.
+
+    python -m benchmarks.dataset --data-dir /tmp/cq-bench --applications 100000 --load-items 5
+
+The spreadsheet at the repository root holds four sample applications, one
+form field per row. It is read with zipfile and ElementTree, so no
+spreadsheet library is needed. Its values seed the vocabulary and formats of
+every generated field: title and name lists, ``First.L@company.co.uk``
+emails, ``07`` mobiles, ``SM2 6TJ`` postcodes, and the load table's
+connection type, phases, heating and kVA. Those are widened with the other
+options the forms offer.
+
+The generated data is:
+- ``--quotes`` quote files, derived from the sample quotes in quotations/ and
+  spread over more postcode districts.
+- ``--applications`` rows with ``--load-items`` load items each, on average.
+  Every section is filled in, map shapes are drawn, and quoted or accepted
+  applications get a selected quote.
+- ``--log-lines`` lines of login activity in the login log's JSON-lines
+  format, oldest first.
+
+The same ``--seed`` always produces the same data, so benchmark runs can be
+compared.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from benchmarks.geometry import synthetic_click_quote
+from benchmarks.search import COMPANY_WORDS, FIRST_NAMES, LAST_NAMES, PROJECT_VALUES, STREETS, TOWNS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+WORKBOOK_PATH = os.path.join(REPO_DIR, 'Test Data C&Q.xlsx')
+SAMPLE_QUOTES_DIR = os.path.join(REPO_DIR, 'quotations')
+DATASET_SUMMARY = 'dataset.json'
+
+SHEET_NAMESPACE = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+CELL_REFERENCE = re.compile(r'^([A-Z]+)(\d+)$')
+
+# (section, normalised row label) -> (application section, key); load table rows map onto load_items columns
+SHEET_FIELDS = {
+    ("applicant's details", 'are you applying on behalf of a company or as an individual'):
+        ('applicant_details', 'applicationType'),
+    ("applicant's details", 'company name'): ('applicant_details', 'companyName'),
+    ("applicant's details", 'title'): ('applicant_details', 'title'),
+    ("applicant's details", 'first name'): ('applicant_details', 'firstName'),
+    ("applicant's details", 'last name'): ('applicant_details', 'lastName'),
+    ("applicant's details", 'email'): ('applicant_details', 'email'),
+    ("applicant's details", 'mobile'): ('applicant_details', 'mobile'),
+    ("applicant's details", 'street'): ('applicant_details', 'street'),
+    ("applicant's details", 'street 2'): ('applicant_details', 'street2'),
+    ("applicant's details", 'street 3'): ('applicant_details', 'street3'),
+    ("applicant's details", 'city'): ('applicant_details', 'city'),
+    ("applicant's details", 'postcode'): ('applicant_details', 'postcode'),
+    ("applicant's details", 'state'): ('applicant_details', 'state'),
+    ("applicant's details", 'country'): ('applicant_details', 'country'),
+    ('general information', 'are yo a customer of our highways services team'):
+        ('general_information', 'highwaysServices'),
+    ('general information', 'which of the following you require'): ('general_information', 'quoteType'),
+    ('general information', 'which services you are looking for'): ('general_information', 'serviceType'),
+    ('general information', 'what is the main use of the property'): ('general_information', 'propertyUse'),
+    ('general information', 'how many meters do you need at the property'): ('general_information', 'metersNeeded'),
+    ('site address', 'street'): ('site_address', 'street'),
+    ('site address', 'street 2'): ('site_address', 'street2'),
+    ('site address', 'street 3'): ('site_address', 'street3'),
+    ('site address', 'city'): ('site_address', 'city'),
+    ('site address', 'postcode'): ('site_address', 'postcode'),
+    ('site address', 'country'): ('site_address', 'country'),
+    ('load details', 'type of connection'): ('load_items', 'connection_type'),
+    ('load details', 'how many phases is the connection'): ('load_items', 'phases'),
+    ('load details', 'if a property, how will it be heated'): ('load_items', 'heating_type'),
+    ('load details', 'how many are you connecting'): ('load_items', 'quantity'),
+    ('load details', 'load per installation type (kva)'): ('load_items', 'load_per_installation'),
+    ('other contacts', 'do you have an authorised representative'): ('other_contact', 'authorisedRepresentative'),
+    ('other contacts', 'principal contractor details'): ('other_contact', 'principalContractorDetails'),
+    ('other contacts', 'principal designer details'): ('other_contact', 'principalDesignerDetails'),
+    ('project details', 'what type of connection would you like'): ('project_details', 'connectionType'),
+    ('project details', 'what level of security of supply would you like'): ('project_details', 'securityOfSupply'),
+    ('project details', 'are there any motors or disturbing loads'): ('project_details', 'motorsOrDisturbingLoads'),
+    ('project details', 'are you planning to install low carbon technologies'):
+        ('project_details', 'lowCarbonTechnologies'),
+}
+
+# The forms' other options, next to the single answer every sample set gives
+OTHER_CHOICES = {
+    'applicationType': ['Individual'],
+    'title': ['Ms.', 'Mrs.', 'Dr.'],
+    'highwaysServices': ['Yes'],
+    'quoteType': ['Budget Estimate'],
+    'serviceType': ['Alteration', 'Disconnection'],
+    'propertyUse': ['Domestic', 'Mixed'],
+    'metersNeeded': ['One meter'],
+    'connection_type': ['Supply', 'Other'],
+    'phases': ['Single'],
+    'heating_type': ['Gas', 'Oil', 'Other'],
+    'authorisedRepresentative': ['Yes'],
+    'principalContractorDetails': ['Yes'],
+    'principalDesignerDetails': ['Yes'],
+    **PROJECT_VALUES,
+    'motorsOrDisturbingLoads': ['Yes'],
+}
+STATUSES = ['draft'] * 5 + ['submitted'] * 3 + ['quoted'] * 2 + ['accepted'] * 2
+ACTIVITIES = [
+    ('OTP_SENT', 'SUCCESS', lambda rng: {'otp_length': 6}),
+    ('LOGIN_SUCCESS', 'SUCCESS', lambda rng: {'token_length': 180}),
+    ('LOGIN_ATTEMPT', 'FAILED', lambda rng: {'error': rng.choice(['Invalid OTP', 'OTP expired',
+                                                                  'OTP not found or expired'])}),
+    ('LOGOUT', 'SUCCESS', lambda rng: {}),
+    ('OTP_REQUEST', 'RATE_LIMITED', lambda rng: {'rule': 'otp_per_email', 'retry_after': rng.randrange(1, 600)}),
+]
+ACTIVITY_WEIGHTS = [40, 30, 15, 10, 5]
+USER_AGENTS = ['Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36',
+               'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Version/17.4 Safari/605.1.15',
+               'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+               'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0']
+
+
+def configure_environment(data_dir):
+    """Point the backend at ``data_dir``; call before importing any backend module"""
+    paths = {
+        'DATA_DIR': data_dir,
+        'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+        'LOG_DIR': os.path.join(data_dir, 'logs'),
+        'QUOTATIONS_DIR': os.path.join(data_dir, 'quotations'),
+    }
+    os.environ.update(paths)
+    os.environ.setdefault('LOGIN_LOG_CONSOLE', '0')
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return paths
+
+
+def normalise_label(text):
+    return ' '.join(text.replace('\xa0', ' ').split()).rstrip(' *?').lower()
+
+
+def read_workbook(path=WORKBOOK_PATH):
+    """Rows of the first sheet as {column letter: text}, keyed by row number"""
+    with zipfile.ZipFile(path) as workbook:
+        shared = []
+        if 'xl/sharedStrings.xml' in workbook.namelist():
+            for item in ET.fromstring(workbook.read('xl/sharedStrings.xml')).findall('m:si', SHEET_NAMESPACE):
+                shared.append(''.join(text.text or '' for text in item.iter(f"{{{SHEET_NAMESPACE['m']}}}t")))
+        sheet = ET.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+
+    rows = {}
+    for row in sheet.iter(f"{{{SHEET_NAMESPACE['m']}}}row"):
+        cells = {}
+        for cell in row.findall('m:c', SHEET_NAMESPACE):
+            column, _ = CELL_REFERENCE.match(cell.get('r')).groups()
+            value = cell.find('m:v', SHEET_NAMESPACE)
+            if cell.get('t') == 's' and value is not None:
+                cells[column] = shared[int(value.text)]
+            elif cell.get('t') == 'inlineStr':
+                cells[column] = ''.join(text.text or '' for text in cell.iter(f"{{{SHEET_NAMESPACE['m']}}}t"))
+            elif value is not None:
+                cells[column] = value.text
+        rows[int(row.get('r'))] = cells
+    return rows
+
+
+def field_shapes(path=WORKBOOK_PATH):
+    """{(application section, key): [sample values]} from the workbook.
+
+    A row with a label in column A and no values is a section heading, unless
+    the label is a known field left blank in every set. The other rows are
+    fields whose values (one per sample set) sit in the remaining columns.
+    """
+    shapes = {}
+    section = None
+    rows = read_workbook(path)
+    for number in sorted(rows):
+        cells = rows[number]
+        label = cells.get('A')
+        values = [value.strip() for column, value in sorted(cells.items()) if column != 'A' and value.strip()]
+        if not label:
+            continue
+        target = SHEET_FIELDS.get((section, normalise_label(label)))
+        if not values and target:
+            continue
+        if not values or values[0].startswith('Set '):
+            if normalise_label(label) != 'commercial load table':
+                section = normalise_label(label)
+            continue
+        if target:
+            shapes[target] = values
+    return shapes
+
+
+def choices(shapes, section, key, fallback=()):
+    """The spreadsheet's values for a field plus the forms' other options"""
+    values = list(dict.fromkeys(shapes.get((section, key), []) + OTHER_CHOICES.get(key, [])))
+    return values or list(fallback)
+
+
+class Vocabulary:
+    """Value pools for one dataset, drawn from the workbook and the benchmark word lists"""
+
+    def __init__(self, shapes, districts):
+        self.shapes = shapes
+        applicant = lambda key: shapes.get(('applicant_details', key), [])
+        self.first_names = list(dict.fromkeys(applicant('firstName') + FIRST_NAMES))
+        self.last_names = list(dict.fromkeys(applicant('lastName') + LAST_NAMES))
+        self.companies = applicant('companyName') or ['Smart Connections']
+        self.streets = list(dict.fromkeys(applicant('street2') + applicant('street3') + STREETS))
+        # Correspondence towns from the workbook (postcode district from its postcodes) and the search word list
+        towns = list(zip(applicant('city'), [postcode.split()[0] for postcode in applicant('postcode')]))
+        self.towns = list(dict.fromkeys(towns + TOWNS))
+        self.site_districts = districts
+        self.states = applicant('state') + ['Middlesex', 'Berkshire', 'Kent', '']
+
+    def pick(self, rng, section, key, fallback=()):
+        return rng.choice(choices(self.shapes, section, key, fallback))
+
+
+def postcode(rng, district):
+    return f'{district} {rng.randrange(10)}{rng.choice("ABDEFGHJLNPQRSTUWXYZ")}{rng.choice("ABDEFGHJLNPQRSTUWXYZ")}'
+
+
+def generate_quotes(directory, count, rng, districts):
+    """Write ``count`` quote files modelled on the sample quotes; returns the quotes"""
+    os.makedirs(directory, exist_ok=True)
+    templates = []
+    for name in sorted(os.listdir(SAMPLE_QUOTES_DIR)):
+        if name.endswith('.json'):
+            with open(os.path.join(SAMPLE_QUOTES_DIR, name)) as f:
+                templates.append(json.load(f))
+
+    quotes = []
+    issued = datetime(2025, 1, 1)
+    for n in range(count):
+        template = templates[n % len(templates)]
+        district = districts[n % len(districts)]
+        base_kva = float(re.match(r'[\d.]+', template['loadRequirement']).group())
+        kva = round(base_kva * rng.uniform(0.25, 3), -1) or 10
+        scale = (kva / base_kva) ** 0.7 * rng.uniform(0.85, 1.15)
+        breakdown = {component: round(amount * scale) for component, amount in template['breakdown'].items()}
+        quote_date = issued + timedelta(days=rng.randrange(300))
+        quote = {
+            **template,
+            'qid': 10_000 + n,
+            'quoteId': f'{district}-{n + 1:04d}',
+            'postcode': postcode(rng, district),
+            'customerName': f"{' '.join(rng.sample(COMPANY_WORDS, 2))} Ltd",
+            'loadRequirement': f'{kva:g} kVA',
+            'estimatedCost': sum(breakdown.values()),
+            'breakdown': breakdown,
+            'quoteDate': quote_date.date().isoformat(),
+            'validUntil': (quote_date + timedelta(days=90)).date().isoformat(),
+        }
+        with open(os.path.join(directory, f'{district.lower()}_quote_{n + 1:04d}.json'), 'w') as f:
+            json.dump(quote, f, indent=2)
+        quotes.append(quote)
+    return quotes
+
+
+def synthetic_application(rng, i, vocabulary, quotes_by_district, created_at):
+    """One application with every section filled in, as the frontend would save it"""
+    first, last = rng.choice(vocabulary.first_names), rng.choice(vocabulary.last_names)
+    company = rng.choice(vocabulary.companies) if rng.random() < 0.3 else f"{' '.join(rng.sample(COMPANY_WORDS, 2))}"
+    domain = re.sub(r'[^a-z0-9]', '', company.lower())
+    town, district = rng.choice(vocabulary.towns)
+    site_district = rng.choice(vocabulary.site_districts)
+    status = rng.choice(STATUSES)
+    pick = vocabulary.pick
+
+    click_quote = synthetic_click_quote(rng)
+    if status in ('quoted', 'accepted') and quotes_by_district.get(site_district):
+        click_quote['selectedQuote'] = rng.choice(quotes_by_district[site_district])
+
+    return {
+        'applicant_details': {
+            'applicationType': pick(rng, 'applicant_details', 'applicationType'),
+            'companyName': company,
+            'title': pick(rng, 'applicant_details', 'title'),
+            'firstName': first,
+            'lastName': last,
+            'email': f'{first.lower()}.{last[0].lower()}{i}@{domain}.co.uk',
+            'mobile': f'07{rng.randrange(10 ** 9):09d}',
+            'street': str(rng.randrange(1, 300)),
+            'street2': rng.choice(vocabulary.streets),
+            'street3': rng.choice(vocabulary.streets) if rng.random() < 0.3 else '',
+            'city': town,
+            'postcode': postcode(rng, district),
+            'state': rng.choice(vocabulary.states),
+            'country': 'United Kingdom',
+        },
+        'general_information': {key: pick(rng, 'general_information', key)
+                                for key in ('highwaysServices', 'quoteType', 'serviceType', 'propertyUse',
+                                            'metersNeeded')},
+        'site_address': {
+            'street': f'{rng.randrange(1, 300)} {rng.choice(vocabulary.streets)}',
+            'street2': '', 'street3': '',
+            'city': rng.choice([name for name, code in vocabulary.towns if code == site_district] or [town]),
+            'postcode': postcode(rng, site_district),
+            'country': 'United Kingdom',
+        },
+        'load_details': {},
+        'other_contact': {key: pick(rng, 'other_contact', key)
+                          for key in ('authorisedRepresentative', 'principalContractorDetails',
+                                      'principalDesignerDetails')},
+        'click_quote_data': click_quote,
+        'project_details': {key: pick(rng, 'project_details', key)
+                            for key in ('connectionType', 'securityOfSupply', 'motorsOrDisturbingLoads',
+                                        'lowCarbonTechnologies')},
+        'auto_quote_eligibility': {'eligible': rng.choice(['Yes', 'No'])},
+        'upload_docs': {},
+        'summary': {'status': status, 'submittedAt': created_at},
+    }
+
+
+def synthetic_load_item(rng, vocabulary):
+    phases = vocabulary.pick(rng, 'load_items', 'phases')
+    if rng.random() < 0.5:
+        # Commercial rows like the workbook's: a few large installations
+        quantity = rng.randrange(1, 5)
+        load = float(rng.choice(vocabulary.shapes.get(('load_items', 'load_per_installation'), ['200'])))
+        load = round(load * rng.uniform(0.25, 1.5), 1)
+    else:
+        quantity = rng.randrange(1, 40)
+        load = rng.choice([7.5, 11.0, 15.0, 22.0])
+    return {
+        'connection_type': vocabulary.pick(rng, 'load_items', 'connection_type'),
+        'phases': phases,
+        'heating_type': vocabulary.pick(rng, 'load_items', 'heating_type'),
+        'bedrooms': str(rng.randrange(1, 6)),
+        'quantity': quantity,
+        'load_per_installation': load,
+        'summed_load': round(quantity * load, 1),
+    }
+
+
+def populate(conn, count, load_items, rng, vocabulary, quotes_by_district, batch_size=2000):
+    """Insert ``count`` applications and about ``load_items`` load items each; returns the load item count"""
+    from schema import JSON_SECTIONS, hot_fields
+
+    application_sql = f'''
+        INSERT INTO applications ({', '.join(JSON_SECTIONS)}, postcode, postcode_district, applicant_email,
+                                  status, created_at, updated_at)
+        VALUES ({', '.join('?' * (len(JSON_SECTIONS) + 6))})
+    '''
+    item_sql = '''
+        INSERT INTO load_items (application_id, connection_type, phases, heating_type, bedrooms, quantity,
+                                load_per_installation, summed_load)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    # Spread creation over the past year, oldest first, as a live table would be
+    now = time.time()
+    span = 365 * 86400
+    items_written = 0
+    for start in range(0, count, batch_size):
+        rows = []
+        for i in range(start, min(count, start + batch_size)):
+            created = now - span + span * i / max(1, count)
+            created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(created))
+            updated_at = time.strftime('%Y-%m-%d %H:%M:%S',
+                                       time.gmtime(min(now, created + rng.expovariate(1 / 86400))))
+            data = synthetic_application(rng, i, vocabulary, quotes_by_district, created_at)
+            fields = hot_fields(data['applicant_details'], data['site_address'], data['summary'])
+            rows.append((*[json.dumps(data[section]) for section in JSON_SECTIONS], fields['postcode'],
+                         fields['postcode_district'], fields['applicant_email'], fields['status'],
+                         created_at, updated_at))
+        first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM applications').fetchone()[0]
+        conn.executemany(application_sql, rows)
+
+        items = []
+        for app_id in range(first_id, first_id + len(rows)):
+            # Poisson-ish around the requested mean, at least one item
+            count_items = max(1, round(rng.expovariate(1 / load_items))) if load_items else 0
+            for _ in range(count_items):
+                item = synthetic_load_item(rng, vocabulary)
+                items.append((app_id, item['connection_type'], item['phases'], item['heating_type'],
+                              item['bedrooms'], item['quantity'], item['load_per_installation'],
+                              item['summed_load']))
+        conn.executemany(item_sql, items)
+        conn.commit()
+        items_written += len(items)
+    return items_written
+
+
+def write_login_log(path, lines, rng, emails, days=90):
+    """``lines`` login activity entries in the login log's JSON-lines format, oldest first"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    start = time.time() - days * 86400
+    step = days * 86400 / max(1, lines)
+    ips = [f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}' for _ in range(2000)]
+    with open(path, 'w', buffering=1024 * 1024) as f:
+        for n in range(lines):
+            moment = start + n * step
+            activity_type, status, details = rng.choices(ACTIVITIES, ACTIVITY_WEIGHTS)[0]
+            stamp = datetime.fromtimestamp(moment).strftime('%Y-%m-%dT%H:%M:%S')
+            f.write(json.dumps({
+                'timestamp': f'{stamp}.{int(moment * 1000) % 1000:03d}',
+                'level': 'INFO',
+                'activity_type': activity_type,
+                'email': rng.choice(emails),
+                'ip_address': rng.choice(ips),
+                'user_agent': rng.choice(USER_AGENTS),
+                'status': status,
+                'details': details(rng),
+            }, separators=(',', ':')) + '\n')
+    return os.path.getsize(path)
+
+
+def build_dataset(data_dir, applications=10_000, load_items=5, log_lines=200_000, quotes=200, seed=23):
+    """Generate every part of the dataset into ``data_dir`` (see configure_environment).
+
+    Returns a summary of what was generated, also written to dataset.json.
+    """
+    paths = configure_environment(data_dir)
+    from app import init_db
+    from db import pool
+    from geometry import rebuild_geometry_index
+    from login_logs import LOGIN_LOG_FILE
+
+    rng = random.Random(seed)
+    shapes = field_shapes()
+    summary = {'seed': seed, 'workbook_fields': len(shapes)}
+    started = time.perf_counter()
+
+    districts = list(dict.fromkeys([code for _, code in TOWNS] +
+                                   [postcode.split()[0] for postcode in shapes.get(('site_address', 'postcode'), [])]))
+    generated_quotes = generate_quotes(paths['QUOTATIONS_DIR'], quotes, rng, districts)
+    quotes_by_district = {}
+    for quote in generated_quotes:
+        quotes_by_district.setdefault(quote['postcode'].split()[0], []).append(quote)
+    summary['quotes'] = len(generated_quotes)
+
+    init_db()
+    vocabulary = Vocabulary(shapes, districts)
+    with pool.connection() as conn:
+        summary['applications'] = applications
+        summary['load_items'] = populate(conn, applications, load_items, rng, vocabulary, quotes_by_district)
+        summary['map_shapes'] = rebuild_geometry_index(conn)
+        emails = [row[0] for row in conn.execute(
+            'SELECT applicant_email FROM applications ORDER BY random() LIMIT 5000')] or ['nobody@example.com']
+        conn.execute('ANALYZE')
+        conn.commit()
+
+    summary['login_log_lines'] = log_lines
+    summary['login_log_mb'] = round(write_login_log(LOGIN_LOG_FILE, log_lines, rng, emails) / 1e6, 1)
+    summary['database_mb'] = round(os.path.getsize(paths['DATABASE_PATH']) / 1e6, 1)
+    summary['seconds'] = round(time.perf_counter() - started, 1)
+    with open(os.path.join(data_dir, DATASET_SUMMARY), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', required=True, help='directory to create the database, log and quotes in')
+    parser.add_argument('--applications', type=int, default=10_000)
+    parser.add_argument('--load-items', type=int, default=5, help='mean load items per application')
+    parser.add_argument('--log-lines', type=int, default=200_000)
+    parser.add_argument('--quotes', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=23)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.data_dir, 'applications.db')):
+        parser.error(f'{args.data_dir} already holds a database')
+    summary = build_dataset(args.data_dir, args.applications, args.load_items, args.log_lines, args.quotes,
+                            args.seed)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Measure how many OTP and confirmation emails can be rendered per second.
+
+    python -m benchmarks.email_render --seconds 2
+
+Each iteration renders the text and HTML templates and serialises the
+multipart message, i.e. everything that happens before the queue insert.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_templates import render_confirmation_email, render_otp_email  # noqa: E402
+
+
+def measure(render, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            render(count)
+            count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = {
+        'otp_per_second': measure(
+            lambda i: render_otp_email(f'user{i}@example.com', f'{i % 1000000:06d}'), args.seconds),
+        'confirmation_per_second': measure(
+            lambda i: render_confirmation_email(
+                f'user{i}@example.com', f'APP-{i}', i, '2025-10-01', '12:00'), args.seconds)
+    }
+    print(json.dumps({name: round(value, 1) for name, value in results.items()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
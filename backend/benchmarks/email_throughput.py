@@ -0,0 +1,73 @@
+"""Measure outbound email queue throughput against the local SMTP sink.
+
+    python -m benchmarks.email_throughput --messages 2000
+
+Runs entirely offline: a temporary database and an aiosmtpd sink on a free
+port stand in for production storage and the real SMTP server.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    port = free_port()
+    data_dir = tempfile.mkdtemp(prefix='email-bench-')
+    # Configure the backend before it is imported; settings are read at import time
+    os.environ.update({
+        'DATA_DIR': data_dir,
+        'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(port),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_ADDRESS': 'bench@example.com',
+        'EMAIL_PASSWORD': '',
+        'EMAIL_BATCH_SIZE': str(args.batch_size)
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from smtp_sink import start_sink
+    import app as backend
+    from email_templates import render_otp_email
+    from mailer import enqueue_email, delivery_worker
+
+    backend.init_db()
+    controller, handler = start_sink(port=port)
+    try:
+        started = time.perf_counter()
+        for i in range(args.messages):
+            enqueue_email(*render_otp_email(f'user{i}@example.com', f'{i % 1000000:06d}'))
+        enqueued = time.perf_counter()
+
+        while handler.received < args.messages:
+            time.sleep(0.01)
+        drained = time.perf_counter()
+    finally:
+        delivery_worker.stop()
+        controller.stop()
+
+    print(json.dumps({
+        'messages': args.messages,
+        'enqueue_per_second': round(args.messages / (enqueued - started), 1),
+        'delivery_per_second': round(args.messages / (drained - started), 1),
+        'smtp_connects': delivery_worker.connects
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
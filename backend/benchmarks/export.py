@@ -0,0 +1,93 @@
+"""Measure bulk export throughput and peak memory per format on a large table.
+
+    python -m benchmarks.export --rows 1000000
+
+Fills a throwaway database with ``--rows`` synthetic applications (see
+benchmarks.search) and up to three load items each, then streams every
+format through export.export_chunks in a fresh process, discarding the
+output. Peak RSS is reported next to the process's RSS before the export
+started: flat memory means the export never held the table in RAM.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.search import populate
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMATS = ('ndjson', 'csv', 'parquet')
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_export(export_format, filters):
+    sys.path.insert(0, BACKEND_DIR)
+    from export import export_chunks
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    size = 0
+    for chunk in export_chunks(export_format, filters):
+        size += len(chunk)
+    return {
+        'seconds': round(time.perf_counter() - started, 2),
+        'output_mb': round(size / 1e6, 1),
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--status', help='export only this status (default: every application)')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='export-bench-')
+    os.environ.update({'DATA_DIR': data_dir, 'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+                       'LOG_DIR': os.path.join(data_dir, 'logs'), 'LOGIN_LOG_CONSOLE': '0'})
+    sys.path.insert(0, BACKEND_DIR)
+    from app import init_db
+    from db import pool
+    from export import parquet_available
+
+    init_db()
+    with pool.connection() as conn:
+        populate(conn, args.rows)
+        # 0-3 load items per application
+        for n in range(3):
+            conn.execute('''
+                INSERT INTO load_items (application_id, connection_type, phases, heating_type,
+                                        bedrooms, quantity, load_per_installation, summed_load)
+                SELECT id, 'Domestic', '1', 'Gas', '3', 2, 7.5, 15.0 FROM applications WHERE id % 4 > ?
+            ''', (n,))
+        conn.commit()
+        load_items = conn.execute('SELECT COUNT(*) FROM load_items').fetchone()[0]
+
+    filters = {'status': args.status}
+    report = {'rows': args.rows, 'load_items': load_items, 'formats': {}}
+    for export_format in [name for name in args.formats.split(',') if name]:
+        if export_format == 'parquet' and not parquet_available():
+            report['formats'][export_format] = 'skipped: pyarrow is not installed'
+            continue
+        # A fresh process per format so each peak RSS is its own
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_export, export_format, filters).result()
+        result['applications_per_second'] = round(args.rows / result['seconds']) if not args.status else None
+        report['formats'][export_format] = result
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
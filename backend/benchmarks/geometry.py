@@ -0,0 +1,119 @@
+"""Benchmark the map-shape R*Tree index: nearby and overlapping-route queries on a large table.
+
+    python -m benchmarks.geometry --rows 300000
+
+Fills a throwaway database with ``--rows`` applications, each with a site
+boundary, substation position and cable route drawn around one of a few
+towns, then reports the index rebuild rate, p50/p99 latency of
+applications_within (250 m and 2 km) and overlapping_shapes (5 m), and
+the time one brute-force NumPy pass over every shape takes for the same
+point query, which is what each query would cost without the index.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import percentile
+from benchmarks.search import timed
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# (lat, lng) of the towns the synthetic sites cluster around
+TOWN_CENTRES = [(51.4496, -0.4099), (51.4673, -0.3613), (51.3618, -0.1945), (51.3762, -0.0982),
+                (51.4543, -0.9781), (51.5105, -0.5950), (51.3190, -0.5580), (51.4340, -0.5110)]
+TOWN_RADIUS_M = 8000
+METRES_PER_DEGREE = 111_320
+
+
+def offset(lat, lng, east_m, north_m):
+    return {'lat': lat + north_m / METRES_PER_DEGREE,
+            'lng': lng + east_m / (METRES_PER_DEGREE * math.cos(math.radians(lat)))}
+
+
+def synthetic_click_quote(rng):
+    """Site boundary, substation and a cable route heading roughly away from the site"""
+    town_lat, town_lng = rng.choice(TOWN_CENTRES)
+    angle, distance = rng.uniform(0, 2 * math.pi), TOWN_RADIUS_M * math.sqrt(rng.random())
+    centre = offset(town_lat, town_lng, distance * math.cos(angle), distance * math.sin(angle))
+    width, depth = rng.uniform(20, 120), rng.uniform(20, 120)
+    site = [offset(centre['lat'], centre['lng'], x * width / 2, y * depth / 2)
+            for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1))]
+    route = [centre]
+    heading = rng.uniform(0, 2 * math.pi)
+    for _ in range(rng.randrange(2, 7)):
+        heading += rng.uniform(-0.6, 0.6)
+        step = rng.uniform(20, 150)
+        route.append(offset(route[-1]['lat'], route[-1]['lng'], step * math.cos(heading), step * math.sin(heading)))
+    return {'siteBoundary': site, 'substationPremise': centre, 'cableRoute': route}
+
+
+def populate(conn, rows, batch_size=5000):
+    rng = random.Random(19)
+    for start in range(0, rows, batch_size):
+        conn.executemany('INSERT INTO applications (click_quote_data) VALUES (?)',
+                         [(json.dumps(synthetic_click_quote(rng)),) for _ in range(start, min(rows, start + batch_size))])
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=300_000)
+    parser.add_argument('--repeat', type=int, default=200, help='queries per scenario')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='geometry-bench-')
+    os.environ.update({'DATA_DIR': data_dir, 'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+                       'LOG_DIR': os.path.join(data_dir, 'logs'), 'LOGIN_LOG_CONSOLE': '0'})
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    from app import init_db
+    from db import pool
+    from geometry import applications_within, overlapping_shapes, rebuild_geometry_index, shape_distances
+
+    init_db()
+    report = {'rows': args.rows}
+    rng = random.Random(23)
+    with pool.connection() as conn:
+        populate(conn, args.rows)
+        started = time.perf_counter()
+        shapes = rebuild_geometry_index(conn)
+        elapsed = time.perf_counter() - started
+        report.update({'shapes': shapes, 'rebuild_seconds': round(elapsed, 1),
+                       'rebuild_shapes_per_second': round(shapes / elapsed)})
+
+        points = [offset(*rng.choice(TOWN_CENTRES), rng.uniform(-6000, 6000), rng.uniform(-6000, 6000))
+                  for _ in range(args.repeat)]
+        app_ids = [rng.randrange(1, args.rows + 1) for _ in range(args.repeat)]
+        scenarios = {
+            'nearby_250m': lambda i: applications_within(conn, points[i]['lat'], points[i]['lng'], 250, limit=500),
+            'nearby_2km': lambda i: applications_within(conn, points[i]['lat'], points[i]['lng'], 2000, limit=500),
+            'overlapping_routes_5m': lambda i: overlapping_shapes(conn, app_ids[i], 'cableRoute', 5),
+        }
+        queries = {}
+        for name, query in scenarios.items():
+            counter = iter(range(args.repeat))
+            samples, _ = timed(lambda: query(next(counter)), args.repeat)
+            results = [len(query(i) or []) for i in range(min(20, args.repeat))]
+            queries[name] = {
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                'mean_results': round(sum(results) / len(results), 1)
+            }
+        report['queries'] = queries
+
+        # Without the index every query has to measure the distance to every shape
+        everything = [(kind, np.frombuffer(blob).reshape(-1, 2)) for kind, blob
+                      in conn.execute('SELECT kind, points FROM application_geometries')]
+        point = np.array([[points[0]['lat'], points[0]['lng']]])
+        samples, _ = timed(lambda: shape_distances(('substationPremise', point), everything), 3)
+        report['full_scan_query_ms'] = round(percentile(samples, 50) * 1000, 2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
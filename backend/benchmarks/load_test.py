@@ -0,0 +1,268 @@
+"""Load-test the HTTP API and report requests/second and latency percentiles per route.
+
+    python -m benchmarks.load_test --serve --duration 10 --concurrency 16
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --secret-key "$SECRET_KEY"
+
+With --serve a gunicorn server (gunicorn.conf.py, wsgi:app) is started on a
+free port against a temporary database, with rate limiting off and email
+delivered to the local SMTP sink when aiosmtpd is installed. Against an
+existing server, pass the server's SECRET_KEY (or a --token) so the
+authenticated application routes can be exercised, and start it with
+RATE_LIMIT_ENABLED=0 to measure the OTP routes rather than the limiter.
+"""
+import argparse
+import http.client
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ('application_create', 'application_get', 'application_patch', 'send_otp', 'verify_otp')
+SEED_APPLICATIONS = 50
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def sample_application(i):
+    return {
+        'applicant_details': {'firstName': 'Load', 'lastName': f'Test {i}', 'email': f'load{i}@example.com'},
+        'site_address': {'postcode': 'TW14 0AB', 'addressLine1': f'{i} Test Street'},
+        'summary': {'status': 'draft'}
+    }
+
+
+def build_request(route, i, app_ids, email_domain):
+    """(method, path, body) for one request of the given route"""
+    app_id = app_ids[i % len(app_ids)] if app_ids else 1
+    if route == 'application_create':
+        return 'POST', '/api/applications', sample_application(i)
+    if route == 'application_get':
+        return 'GET', f'/api/applications/{app_id}', None
+    if route == 'application_patch':
+        return 'PATCH', f'/api/applications/{app_id}/site_address', {'addressLine2': f'Unit {i}'}
+    if route == 'send_otp':
+        return 'POST', '/api/send-otp', {'email': f'load{i}@{email_domain}'}
+    if route == 'verify_otp':
+        return 'POST', '/api/verify-otp', {'email': f'load{i}@{email_domain}', 'otp': '000000'}
+    raise ValueError(f'Unknown route: {route}')
+
+
+def run_client(url, route, duration, threads, token, app_ids, email_domain, offset):
+    """One client process: ``threads`` keep-alive connections firing requests for ``duration`` seconds"""
+    parts = urlsplit(url)
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    deadline = time.perf_counter() + duration
+    results = []
+    lock = threading.Lock()
+
+    def worker(thread_index):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        samples = []
+        i = offset + thread_index * 1_000_000
+        while time.perf_counter() < deadline:
+            method, path, body = build_request(route, i, app_ids, email_domain)
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                status = 0
+            samples.append((time.perf_counter() - started, status))
+        conn.close()
+        with lock:
+            results.extend(samples)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results
+
+
+def request_json(url, method, path, body=None, token=None):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    try:
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        conn.close()
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if request_json(url, 'GET', '/api/health/ready')[0] == 200:
+                return
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not become ready within {timeout}s')
+
+
+def gunicorn_command(port):
+    return ['gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+
+
+def start_server(args, secret_key, command=gunicorn_command):
+    """Start the server (gunicorn by default) and the SMTP sink when available against a temporary data directory"""
+    port = free_port()
+    data_dir = tempfile.mkdtemp(prefix='load-test-')
+    env = dict(os.environ, **{
+        'PORT': str(port),
+        'HOST': '127.0.0.1',
+        'DATA_DIR': data_dir,
+        'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+        'LOG_DIR': os.path.join(data_dir, 'logs'),
+        'SECRET_KEY': secret_key,
+        'RATE_LIMIT_ENABLED': '0',
+        'LOGIN_LOG_CONSOLE': '0',
+        'GUNICORN_WORKERS': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_ADDRESS': 'bench@example.com',
+        'EMAIL_PASSWORD': ''
+    })
+    sink = None
+    try:
+        sys.path.insert(0, BACKEND_DIR)
+        from smtp_sink import start_sink
+        smtp_port = free_port()
+        sink, _ = start_sink(port=smtp_port)
+        env.update({'SMTP_SERVER': '127.0.0.1', 'SMTP_PORT': str(smtp_port)})
+    except ImportError:
+        # Without a sink, delivery fails and is retried in the background
+        env.update({'SMTP_SERVER': '127.0.0.1', 'SMTP_PORT': str(free_port())})
+
+    server = subprocess.Popen(command(port), cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(url)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return url, server, sink
+
+
+def mint_token(secret_key):
+    # With SECRET_KEY set, importing auth does not create a key file
+    os.environ['SECRET_KEY'] = secret_key
+    sys.path.insert(0, BACKEND_DIR)
+    from auth import TokenSigner
+    return TokenSigner(secret_key.encode('utf-8')).issue('load-test@example.com')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--serve', action='store_true', help='start a gunicorn server on a temporary database')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers with --serve')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker with --serve')
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--duration', type=float, default=10, help='seconds per route')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                        help='client processes the connections are spread over')
+    parser.add_argument('--token', help='bearer token for the application routes')
+    parser.add_argument('--secret-key', default=os.environ.get('SECRET_KEY'),
+                        help="server's SECRET_KEY, used to mint a token")
+    parser.add_argument('--email-domain', default='gmail.com')
+    args = parser.parse_args()
+
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    server = sink = None
+    url = args.url
+    secret_key = args.secret_key
+    if args.serve:
+        secret_key = secret_key or secrets.token_hex(32)
+        url, server, sink = start_server(args, secret_key)
+    token = args.token or (mint_token(secret_key) if secret_key else None)
+
+    try:
+        app_ids = []
+        for i in range(SEED_APPLICATIONS):
+            status, body = request_json(url, 'POST', '/api/applications', sample_application(i), token)
+            if status == 200:
+                app_ids.append(body['id'])
+        if not app_ids:
+            print('warning: could not create applications (missing token?)', file=sys.stderr)
+
+        processes = max(1, min(args.processes, args.concurrency))
+        per_process = [args.concurrency // processes + (n < args.concurrency % processes) for n in range(processes)]
+        report = {}
+        with ProcessPoolExecutor(processes) as executor:
+            for route in routes:
+                started = time.perf_counter()
+                futures = [
+                    executor.submit(run_client, url, route, args.duration, threads, token, app_ids,
+                                    args.email_domain, n * 100_000_000)
+                    for n, threads in enumerate(per_process)
+                ]
+                samples = [sample for future in futures for sample in future.result()]
+                elapsed = time.perf_counter() - started
+                latencies = sorted(latency for latency, _ in samples)
+                report[route] = {
+                    'requests': len(samples),
+                    'requests_per_second': round(len(samples) / elapsed, 1),
+                    'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+                    'p90_ms': round(percentile(latencies, 90) * 1000, 2) if latencies else None,
+                    'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+                    'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+                    'status_codes': dict(Counter(str(status) for _, status in samples))
+                }
+    finally:
+        if server:
+            server.terminate()
+            server.wait(30)
+        if sink:
+            sink.stop()
+
+    print(json.dumps({
+        'url': url,
+        'concurrency': args.concurrency,
+        'client_processes': processes,
+        'duration_per_route': args.duration,
+        'server': {'workers': args.workers, 'threads': args.threads} if args.serve else None,
+        'routes': report
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
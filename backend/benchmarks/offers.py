@@ -0,0 +1,103 @@
+"""Measure formal offer PDF generation: pages per second serially and across a process pool.
+
+    python -m benchmarks.offers --rows 2000
+
+Fills a throwaway database with ``--rows`` accepted applications (see
+benchmarks.search), gives each one a quote from the quotations directory
+as its selected quote and 1-80 load items, so offers run from one to
+three pages. Reports the time to load the offer inputs, pages/s
+rendering and writing them in this process, pages/s for a cold batch through
+offers.generate_offers with 1 and ``--workers`` processes, and how long
+the same batch takes once every offer is cached.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.search import populate
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_quotes_and_load_items(conn, quotes):
+    rng = random.Random(21)
+    app_ids = [row[0] for row in conn.execute('SELECT id FROM applications ORDER BY id')]
+    conn.executemany('''
+        UPDATE applications SET status = 'accepted',
+               click_quote_data = json_set(COALESCE(click_quote_data, '{}'), '$.selectedQuote', json(?))
+        WHERE id = ?
+    ''', [(json.dumps(rng.choice(quotes)), app_id) for app_id in app_ids])
+    items = []
+    for app_id in app_ids:
+        for _ in range(int(rng.triangular(1, 80, 4))):
+            quantity = rng.randrange(1, 20)
+            items.append((app_id, rng.choice(['Domestic', 'Commercial', 'EV Charger']), rng.choice(['Single', 'Three']),
+                          rng.choice(['Gas', 'Electric', 'Heat pump']), quantity, 7.5, 7.5 * quantity))
+    conn.executemany('''
+        INSERT INTO load_items (application_id, connection_type, phases, heating_type, quantity,
+                                load_per_installation, summed_load)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', items)
+    conn.commit()
+    return app_ids
+
+
+def pages_per_second(pages, seconds):
+    return {'seconds': round(seconds, 2), 'pages': pages, 'pages_per_second': round(pages / seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='offers-bench-')
+    os.environ.update({'DATA_DIR': data_dir, 'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+                       'LOG_DIR': os.path.join(data_dir, 'logs'), 'LOGIN_LOG_CONSOLE': '0'})
+    sys.path.insert(0, BACKEND_DIR)
+    from app import init_db, quote_store, quote_estimator
+    from db import pool
+    from offers import OFFER_CACHE_DIR, generate_offers, load_offer_inputs, offer_key, offer_path, render_many
+
+    init_db()
+    with pool.connection() as conn:
+        populate(conn, args.rows)
+        app_ids = add_quotes_and_load_items(conn, quote_store.all())
+        started = time.perf_counter()
+        inputs = load_offer_inputs(conn, app_ids, quote_store, quote_estimator)
+        report = {'rows': args.rows, 'load_inputs_seconds': round(time.perf_counter() - started, 2)}
+
+    # The same work as one pool task, in this process: render and write every offer
+    started = time.perf_counter()
+    pages = sum(render_many([(offer_path(offer_key(offer)), offer) for offer in inputs.values()]))
+    report['serial'] = pages_per_second(pages, time.perf_counter() - started)
+
+    for workers in sorted({1, args.workers}):
+        shutil.rmtree(OFFER_CACHE_DIR, ignore_errors=True)
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            list(executor.map(time.sleep, [0.2] * workers))  # worker start-up is not part of the measurement
+            started = time.perf_counter()
+            results = generate_offers(inputs, executor)
+            elapsed = time.perf_counter() - started
+            report[f'pool_{workers}_workers'] = pages_per_second(sum(r['pages'] for r in results.values()), elapsed)
+
+            started = time.perf_counter()
+            results = generate_offers(inputs, executor)
+            report['cached_batch_seconds'] = round(time.perf_counter() - started, 3)
+            assert all(result['cached'] for result in results.values())
+
+    sizes = [entry.stat().st_size for directory in os.scandir(OFFER_CACHE_DIR) for entry in os.scandir(directory)]
+    report['mean_pdf_kb'] = round(sum(sizes) / len(sizes) / 1024, 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
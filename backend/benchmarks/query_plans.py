@@ -0,0 +1,166 @@
+"""Time application listing pages on a large table.
+
+    python -m benchmarks.query_plans --rows 1000000
+
+Builds a throwaway database with ``--rows`` synthetic applications and
+reports, as JSON, how long the first page and the pages after it take for
+each sort with and without a filter. That every sort/order/filter
+combination stays an index seek is asserted by tests/test_query_plans.py,
+which uses the helpers here (``populate``, ``plan_cases``, ``explain``,
+``plan_problems``) on a small table.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUSES = ['draft', 'submitted', 'quoted', 'accepted']
+DISTRICTS = ['TW14', 'TW3', 'SW1A', 'EC1A', 'M1', 'B33', 'LS6', 'CF10']
+FILTER_SAMPLES = {
+    'status': 'submitted',
+    'postcode': 'TW14',
+    'full_postcode': 'TW14 0AB',
+    'email': 'user42@example.com',
+    'created_after': '2024-03-01',
+    'created_before': '2024-06-01',
+    'updated_after': '2024-03-01',
+    'updated_before': '2024-06-01',
+}
+# Filters whose index only serves one sort (see applications.application_list_query)
+SORT_ONLY_FILTERS = {'created_after': 'id', 'created_before': 'id',
+                     'updated_after': 'updated_at', 'updated_before': 'updated_at'}
+
+
+def populate(conn, rows, batch_size=10000):
+    """Insert ``rows`` synthetic applications with increasing created_at"""
+    from schema import JSON_SECTIONS, hot_fields
+
+    rng = random.Random(7)
+    started = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    columns = JSON_SECTIONS + ['postcode', 'postcode_district', 'applicant_email', 'status', 'created_at', 'updated_at']
+    sql = f"INSERT INTO applications ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    for offset in range(0, rows, batch_size):
+        params = []
+        for i in range(offset, min(rows, offset + batch_size)):
+            created = started + i * 31_536_000 / rows
+            updated = created + rng.random() * 86400 * 30
+            applicant = {'firstName': 'Synthetic', 'email': f'user{rng.randrange(rows // 10 + 1)}@example.com'}
+            site = {'postcode': f'{rng.choice(DISTRICTS)} {rng.randrange(10)}{rng.choice("ABDEF")}{rng.choice("GHJLN")}'}
+            summary = {'status': rng.choice(STATUSES)}
+            fields = hot_fields(applicant, site, summary)
+            sections = {'applicant_details': applicant, 'site_address': site, 'summary': summary}
+            params.append([json.dumps(sections.get(section, {})) for section in JSON_SECTIONS] + [
+                fields['postcode'], fields['postcode_district'], fields['applicant_email'], fields['status'],
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(created)),
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(updated))
+            ])
+        conn.executemany(sql, params)
+        conn.commit()
+
+
+def filter_sets():
+    """Each filter alone plus every pair, mapped to application_list_query's filter names"""
+    names = list(FILTER_SAMPLES)
+    for size in (0, 1, 2):
+        for combo in itertools.combinations(names, size):
+            if 'postcode' in combo and 'full_postcode' in combo:
+                continue
+            yield combo
+
+
+def query_filters(combo):
+    filters = {}
+    for name in combo:
+        filters['postcode' if name == 'full_postcode' else name] = FILTER_SAMPLES[name]
+    return filters
+
+
+def plan_cases(rows):
+    """(sort, order, filter combo, cursor) for every listing query the API accepts"""
+    from applications import LIST_SORTS, encode_cursor
+
+    for sort, order, combo in itertools.product(LIST_SORTS, ('desc', 'asc'), list(filter_sets())):
+        if any(SORT_ONLY_FILTERS.get(name, sort) != sort for name in combo):
+            continue
+        cursor = encode_cursor(sort, {'id': rows // 2, 'updated_at': '2024-06-01 00:00:00'})
+        for page_cursor in (None, cursor):
+            yield sort, order, combo, page_cursor
+
+
+def explain(conn, limit, sort, order, combo, cursor):
+    """EXPLAIN QUERY PLAN rows of one listing query"""
+    from applications import application_list_query
+
+    sql, params = application_list_query(limit, cursor, sort, order, query_filters(combo))
+    return conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+
+
+def plan_problems(plan, filtered):
+    """The plan's details when it sorts in a temp B-tree or scans the table under a filter, else None.
+
+    Either means a page costs O(matching rows) instead of O(page).
+    """
+    details = [row[3] for row in plan]
+    if any('TEMP B-TREE' in detail for detail in details):
+        return details
+    if filtered and any(detail.startswith('SCAN applications') and 'INDEX' not in detail for detail in details):
+        return details
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--analyze', action='store_true', help='run ANALYZE before timing pages')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='query-plans-')
+    os.environ.update({'DATA_DIR': data_dir, 'DATABASE_PATH': os.path.join(data_dir, 'applications.db'),
+                       'LOG_DIR': os.path.join(data_dir, 'logs'), 'LOGIN_LOG_CONSOLE': '0'})
+    sys.path.insert(0, BACKEND_DIR)
+    from app import init_db
+    from applications import LIST_SORTS, list_applications
+    from db import pool
+
+    init_db()
+    with pool.connection() as conn:
+        started = time.perf_counter()
+        populate(conn, args.rows)
+        populate_seconds = time.perf_counter() - started
+        if args.analyze:
+            conn.execute('ANALYZE')
+
+        timings = {}
+        for sort in LIST_SORTS:
+            for combo in ((), ('status',), ('postcode',)):
+                filters = query_filters(combo)
+                started = time.perf_counter()
+                page, next_cursor = list_applications(conn, args.limit, None, sort, 'desc', filters)
+                first = time.perf_counter() - started
+                pages = 1
+                started = time.perf_counter()
+                while next_cursor and pages < 20:
+                    page, next_cursor = list_applications(conn, args.limit, next_cursor, sort, 'desc', filters)
+                    pages += 1
+                later = (time.perf_counter() - started) / max(pages - 1, 1)
+                timings[f"{sort}:{'+'.join(combo) or 'all'}"] = {
+                    'first_page_ms': round(first * 1000, 3),
+                    'next_pages_ms': round(later * 1000, 3),
+                    'pages': pages
+                }
+
+    print(json.dumps({
+        'rows': args.rows,
+        'populate_seconds': round(populate_seconds, 1),
+        'page_timings': timings
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
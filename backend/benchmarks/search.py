@@ -0,0 +1,163 @@
+"""Benchmark full-text application search against a LIKE scan on a large table.
+
+    python -m benchmarks.search --rows 1000000
+
+Fills a throwaway database with ``--rows`` synthetic applications (the FTS5
+triggers index each insert), then reports insert throughput with the
+triggers in place, the time to rebuild the index from scratch, the index
+size, and p50/p99 latency for a mix of rare, common, prefix and postcode
+queries through search_applications. A LIKE scan over the JSON columns for
+the rare name is timed as the baseline the index replaces.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_NAMES = ['Andrew', 'Priya', 'James', 'Olivia', 'Mohammed', 'Sophie', 'Daniel', 'Aisha', 'Thomas', 'Emily',
+               'Oliver', 'Grace', 'Harry', 'Chloe', 'Jack', 'Amelia', 'George', 'Isla', 'Noah', 'Freya']
+LAST_NAMES = ['Hamilton', 'Patel', 'Smith', 'Jones', 'Khan', 'Williams', 'Brown', 'Taylor', 'Davies', 'Evans',
+              'Wilson', 'Thomas', 'Roberts', 'Johnson', 'Walker', 'Wright', 'Robinson', 'Thompson', 'White', 'Hughes']
+COMPANY_WORDS = ['Smart', 'Connections', 'Power', 'Homes', 'Energy', 'Build', 'Developments', 'Electrical',
+                 'Solutions', 'Estates', 'Green', 'Grid', 'Capital', 'Construction', 'Services']
+STREETS = ['Field Road', 'Stanley Road', 'High Street', 'Station Road', 'Church Lane', 'Park Avenue', 'Mill Lane',
+           'Victoria Road', 'Green Lane', 'Kings Road', 'Queens Drive', 'Manor Way']
+TOWNS = [('Feltham', 'TW14'), ('Hounslow', 'TW3'), ('Sutton', 'SM2'), ('Croydon', 'CR0'), ('Reading', 'RG1'),
+         ('Slough', 'SL1'), ('Woking', 'GU21'), ('Staines', 'TW18'), ('Kingston', 'KT1'), ('Richmond', 'TW9')]
+PROJECT_VALUES = {
+    'connectionType': ['Flexible', 'Firm'],
+    'securityOfSupply': ['Single Circuit', 'Dual Circuit'],
+    'lowCarbonTechnologies': ['No', 'Heat pumps', 'Solar PV', 'EV charging', 'Battery storage'],
+}
+QUERIES = {
+    'rare_name': 'Freya Hughes',
+    'common_word': 'road',
+    'company': 'smart connections',
+    'prefix': 'ham',
+    'postcode': 'TW14 0BJ',
+    'address_fragment': '12 field',
+    'project': 'battery storage',
+}
+
+
+def synthetic_application(rng, i):
+    town, district = rng.choice(TOWNS)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        'applicant_details': {
+            'title': rng.choice(['Mr.', 'Ms.', 'Dr.']), 'firstName': first, 'lastName': last,
+            'companyName': ' '.join(rng.sample(COMPANY_WORDS, 2)) + ' Ltd',
+            'email': f'{first.lower()}.{last.lower()}{i}@example.com'
+        },
+        'site_address': {
+            'street': f'{rng.randrange(1, 300)} {rng.choice(STREETS)}', 'city': town,
+            'postcode': f'{district} {rng.randrange(10)}{rng.choice("ABDEF")}{rng.choice("GHJLN")}',
+            'country': 'United Kingdom'
+        },
+        'project_details': {key: rng.choice(values) for key, values in PROJECT_VALUES.items()},
+        'general_information': {'propertyUse': rng.choice(['Domestic', 'Commercial', 'Mixed'])},
+        'summary': {'status': rng.choice(['draft', 'submitted', 'quoted'])}
+    }
+
+
+def populate(conn, rows, batch_size=5000):
+    from schema import JSON_SECTIONS, hot_fields
+
+    rng = random.Random(11)
+    sql = '''
+        INSERT INTO applications (applicant_details, general_information, site_address,
+                                  load_details, other_contact, click_quote_data,
+                                  project_details, auto_quote_eligibility, upload_docs, summary,
+                                  postcode, postcode_district, applicant_email, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    for offset in range(0, rows, batch_size):
+        params = []
+        for i in range(offset, min(rows, offset + batch_size)):
+            data = synthetic_application(rng, i)
+            fields = hot_fields(data['applicant_details'], data['site_address'], data['summary'])
+            sections = [json.dumps(data.get(section, {})) for section in JSON_SECTIONS]
+            params.append((*sections, fields['postcode'], fields['postcode_district'],
+                           fields['applicant_email'], fields['status']))
+        conn.executemany(sql, params)
+        conn.commit()
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50, help='runs per query')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='search-bench-')
+    database_path = os.path.join(data_dir, 'applications.db')
+    os.environ.update({'DATA_DIR': data_dir, 'DATABASE_PATH': database_path,
+                       'LOG_DIR': os.path.join(data_dir, 'logs'), 'LOGIN_LOG_CONSOLE': '0'})
+    sys.path.insert(0, BACKEND_DIR)
+    from app import init_db
+    from applications import fts_query, search_applications
+    from db import pool
+    from schema import rebuild_search_index
+
+    init_db()
+    report = {'rows': args.rows}
+    with pool.connection() as conn:
+        started = time.perf_counter()
+        populate(conn, args.rows)
+        elapsed = time.perf_counter() - started
+        report['insert_rows_per_second'] = round(args.rows / elapsed)
+
+        started = time.perf_counter()
+        rebuild_search_index(conn)
+        report['rebuild_seconds'] = round(time.perf_counter() - started, 2)
+        report['database_mb'] = round(os.path.getsize(database_path) / 1e6, 1)
+        try:
+            index_bytes = conn.execute(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'applications_fts%'").fetchone()[0]
+            report['search_index_mb'] = round(index_bytes / 1e6, 1)
+        except Exception:
+            pass  # dbstat is an optional SQLite build feature
+
+        queries = {}
+        for name, text in QUERIES.items():
+            samples, results = timed(lambda: search_applications(conn, text, args.limit), args.repeat)
+            queries[name] = {
+                'q': text,
+                'results': len(results),
+                'matches': conn.execute('SELECT COUNT(*) FROM applications_fts WHERE applications_fts MATCH ?',
+                                        (fts_query(text),)).fetchone()[0],
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                'example': results[0]['snippet'] if results else None
+            }
+        report['queries'] = queries
+
+        samples, _ = timed(lambda: conn.execute('''
+            SELECT id FROM applications
+            WHERE applicant_details LIKE ? OR site_address LIKE ? OR project_details LIKE ?
+        ''', ('%Freya%Hughes%',) * 3).fetchall(), 3)
+        report['like_scan_baseline_ms'] = round(percentile(samples, 50) * 1000, 2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+"""Benchmark every /api/* route against a generated dataset and write a JSON report runs can be compared on.
+
+    python -m benchmarks.suite --applications 20000 --output before.json
+    python -m benchmarks.suite --data-dir /tmp/cq-bench --output after.json --baseline before.json
+
+The dataset comes from benchmarks.dataset: ``--applications`` applications
+with ``--load-items`` load items each, a ``--log-lines`` login log and
+``--quotes`` quote files. It is generated into ``--data-dir``, or reused if
+that directory already holds one. Without ``--data-dir`` a temporary
+directory is used. A reused directory keeps the writes of earlier runs
+(created applications, added and deleted load items), so generate a fresh
+one for strict before/after comparisons.
+
+There are two phases, both through the Flask test client in this process
+so no network or server is involved:
+- Sequential: each route's scenarios in turn, up to ``--repeat`` requests
+  or ``--budget`` seconds each.
+- Concurrent: ``--threads`` threads, each with its own client, send a mix
+  weighted towards the read routes for ``--duration`` seconds.
+
+Each scenario builds its request and any state it needs (an OTP to verify,
+an upload to finish, a load item to delete) outside the timed part. The
+report gives requests/s, p50/p99 and status codes per scenario, peak RSS
+after each phase, the git commit and the dataset summary. Routes no
+scenario covers are listed. With ``--baseline``, a table comparing p50 and
+throughput with an earlier report is printed to stderr.
+
+Rate limiting is off. The email delivery worker runs as it does in a
+server, sending to the local SMTP sink when aiosmtpd is installed. Email
+deliverability (DNS) checks are skipped unless ``--check-deliverability``
+is given, so the OTP routes measure the app rather than the resolver.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+
+from benchmarks.dataset import (DATASET_SUMMARY, Vocabulary, build_dataset, configure_environment, field_shapes,
+                                synthetic_application, synthetic_load_item)
+from benchmarks.export import peak_rss_mb
+from benchmarks.load_test import free_port, percentile
+from benchmarks.search import TOWNS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCUMENT_SIZE = 256 * 1024
+
+# ``prepare(ctx, i)`` returns the keyword arguments of the i-th request (path, json, data, headers)
+Scenario = namedtuple('Scenario', 'name method rule prepare')
+
+
+class Context:
+    """Identifiers the scenarios draw on, read from the dataset once before the run.
+
+    Samples are picked by id rather than at random so every run against the
+    same dataset sends the same requests.
+    """
+
+    def __init__(self, client, token, email_domain, seed):
+        from db import pool
+        from quotations import quote_store
+
+        self.client = client
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.email_domain = email_domain
+        self.rng = random.Random(seed)
+        self.vocabulary = Vocabulary(field_shapes(), [code for _, code in TOWNS])
+        self.lock = threading.Lock()
+        with pool.connection() as conn:
+            self.app_ids = [row[0] for row in conn.execute('SELECT id FROM applications ORDER BY id')]
+            self.accepted_ids = [row[0] for row in conn.execute('''
+                SELECT id FROM applications
+                WHERE status = 'accepted' AND json_extract(click_quote_data, '$.selectedQuote') IS NOT NULL
+                ORDER BY id LIMIT 500
+            ''')]
+            self.names = [row[0] for row in conn.execute('''
+                SELECT json_extract(applicant_details, '$.lastName') FROM applications ORDER BY id % 997, id LIMIT 200
+            ''')]
+            self.districts = [row[0] for row in conn.execute('''
+                SELECT DISTINCT postcode_district FROM applications WHERE postcode_district IS NOT NULL
+            ''')]
+            self.points = [(row[0], row[1]) for row in conn.execute('''
+                SELECT json_extract(click_quote_data, '$.substationPremise.lat'),
+                       json_extract(click_quote_data, '$.substationPremise.lng')
+                FROM applications WHERE click_quote_data IS NOT NULL ORDER BY id % 997, id LIMIT 200
+            ''')]
+            # Deletion scenarios consume existing load items from the end of the table
+            self.load_item_ids = [row[0] for row in conn.execute(
+                'SELECT id FROM load_items ORDER BY id DESC LIMIT 20000')]
+        self.quote_ids = [quote['quoteId'] for quote in quote_store.all()]
+        self.document = None
+        if not self.app_ids:
+            raise RuntimeError('The dataset has no applications')
+
+    def app_id(self, i):
+        return self.app_ids[(i * 7919) % len(self.app_ids)]
+
+    def take_load_items(self, count):
+        with self.lock:
+            taken, self.load_item_ids = self.load_item_ids[:count], self.load_item_ids[count:]
+        return taken
+
+    def request(self, method, path, **kwargs):
+        """An untimed request used to set up state; returns the response"""
+        headers = {**self.headers, **kwargs.pop('headers', {})}
+        return self.client.open(path, method=method, headers=headers, **kwargs)
+
+    def start_upload(self, app_id, size, name='Site Plan'):
+        response = self.request('POST', f'/api/applications/{app_id}/uploads',
+                                json={'name': name, 'size': size, 'filename': 'site-plan.pdf',
+                                      'content_type': 'application/pdf'})
+        return response.get_json()['id']
+
+    def upload_document(self, app_id):
+        """Upload one document end to end; returns its SHA-256"""
+        body = secrets.token_bytes(DOCUMENT_SIZE)
+        upload_id = self.start_upload(app_id, len(body))
+        response = self.request('PUT', f'/api/uploads/{upload_id}', data=body,
+                                headers={'Content-Range': f'bytes 0-{len(body) - 1}/{len(body)}'})
+        return response.get_json()['document']['sha256']
+
+
+def application_body(ctx, i):
+    from datetime import datetime
+
+    return synthetic_application(ctx.rng, 10_000_000 + i, ctx.vocabulary, {}, datetime.now().isoformat())
+
+
+def otp_for(ctx, i):
+    from otp_store import otp_store
+
+    email = f'bench.verify{i}@{ctx.email_domain}'
+    otp_store.put(email, '246810')
+    return {'path': '/api/verify-otp', 'json': {'email': email, 'otp': '246810'}}
+
+
+def logout_request(ctx, i):
+    from auth import token_signer
+
+    token = token_signer.issue(f'bench.logout{i}@example.com')
+    return {'path': '/api/logout', 'headers': {'Authorization': f'Bearer {token}'}}
+
+
+def upload_chunk(ctx, i):
+    upload_id = ctx.start_upload(ctx.app_id(i), DOCUMENT_SIZE, name=f'Document {i}')
+    return {'path': f'/api/uploads/{upload_id}', 'data': secrets.token_bytes(DOCUMENT_SIZE),
+            'headers': {'Content-Range': f'bytes 0-{DOCUMENT_SIZE - 1}/{DOCUMENT_SIZE}'}}
+
+
+def document_download(ctx, i):
+    with ctx.lock:
+        if ctx.document is None:
+            ctx.document = (ctx.app_ids[0], ctx.upload_document(ctx.app_ids[0]))
+    app_id, sha256 = ctx.document
+    return {'path': f'/api/applications/{app_id}/documents/{sha256}'}
+
+
+def application_not_modified(ctx, i):
+    app_id = ctx.app_id(i)
+    etag = ctx.request('GET', f'/api/applications/{app_id}').headers.get('ETag')
+    return {'path': f'/api/applications/{app_id}', 'headers': {'If-None-Match': etag}}
+
+
+def load_item_delete(ctx, i):
+    taken = ctx.take_load_items(1)
+    return {'path': f'/api/load-items/{ctx.app_id(i)}?item_id={taken[0] if taken else 0}'}
+
+
+def load_items_batch_delete(ctx, i):
+    return {'path': f'/api/load-items/{ctx.app_id(i)}/batch', 'json': {'item_ids': ctx.take_load_items(10)}}
+
+
+def nearby(ctx, i):
+    lat, lng = ctx.points[i % len(ctx.points)] if ctx.points else (51.45, -0.41)
+    return {'path': f'/api/applications/nearby?lat={lat}&lng={lng}&radius=500'}
+
+
+def accepted_id(ctx, i):
+    # The first pass over these renders each offer, later ones are served from the offer cache
+    return ctx.accepted_ids[i % len(ctx.accepted_ids)] if ctx.accepted_ids else ctx.app_id(i)
+
+
+def district(ctx, i):
+    return ctx.districts[i % len(ctx.districts)] if ctx.districts else 'TW14'
+
+
+SCENARIOS = [
+    Scenario('applications_create', 'POST', '/api/applications',
+             lambda ctx, i: {'path': '/api/applications', 'json': application_body(ctx, i)}),
+    Scenario('applications_list', 'GET', '/api/applications',
+             lambda ctx, i: {'path': '/api/applications?limit=50'}),
+    Scenario('applications_list_filtered', 'GET', '/api/applications',
+             lambda ctx, i: {'path': f'/api/applications?status=submitted&postcode={district(ctx, i)}'
+                                     f'&sort=updated_at&limit=50'}),
+    Scenario('applications_search', 'GET', '/api/applications/search',
+             lambda ctx, i: {'path': f'/api/applications/search?q={ctx.names[i % len(ctx.names)]}'}),
+    Scenario('applications_export', 'GET', '/api/applications/export',
+             lambda ctx, i: {'path': f'/api/applications/export?format=ndjson&status=accepted'
+                                     f'&postcode={district(ctx, i)}'}),
+    Scenario('applications_nearby', 'GET', '/api/applications/nearby', nearby),
+    Scenario('application_get', 'GET', '/api/applications/<int:app_id>',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}'}),
+    Scenario('application_get_not_modified', 'GET', '/api/applications/<int:app_id>', application_not_modified),
+    Scenario('application_put', 'PUT', '/api/applications/<int:app_id>',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}', 'json': application_body(ctx, i)}),
+    Scenario('application_patch', 'PATCH', '/api/applications/<int:app_id>/<section>',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}/site_address',
+                             'json': {'street2': f'Unit {i}'}}),
+    Scenario('application_geometry', 'GET', '/api/applications/<int:app_id>/geometry',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}/geometry'}),
+    Scenario('application_overlapping_routes', 'GET', '/api/applications/<int:app_id>/overlapping-routes',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}/overlapping-routes'}),
+    Scenario('application_estimate', 'GET', '/api/applications/<int:app_id>/estimate',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}/estimate'}),
+    Scenario('application_offer', 'GET', '/api/applications/<int:app_id>/offer.pdf',
+             lambda ctx, i: {'path': f'/api/applications/{accepted_id(ctx, i)}/offer.pdf'}),
+    Scenario('upload_start', 'POST', '/api/applications/<int:app_id>/uploads',
+             lambda ctx, i: {'path': f'/api/applications/{ctx.app_id(i)}/uploads',
+                             'json': {'name': f'Document {i}', 'size': DOCUMENT_SIZE}}),
+    Scenario('upload_status', 'GET', '/api/uploads/<upload_id>',
+             lambda ctx, i: {'path': f'/api/uploads/{ctx.start_upload(ctx.app_id(i), DOCUMENT_SIZE)}'}),
+    Scenario('upload_chunk', 'PUT', '/api/uploads/<upload_id>', upload_chunk),
+    Scenario('upload_abort', 'DELETE', '/api/uploads/<upload_id>',
+             lambda ctx, i: {'path': f'/api/uploads/{ctx.start_upload(ctx.app_id(i), DOCUMENT_SIZE)}'}),
+    Scenario('document_download', 'GET', '/api/applications/<int:app_id>/documents/<sha256>', document_download),
+    Scenario('load_items_list', 'GET', '/api/load-items/<int:app_id>',
+             lambda ctx, i: {'path': f'/api/load-items/{ctx.app_id(i)}'}),
+    Scenario('load_item_add', 'POST', '/api/load-items/<int:app_id>',
+             lambda ctx, i: {'path': f'/api/load-items/{ctx.app_id(i)}',
+                             'json': synthetic_load_item(ctx.rng, ctx.vocabulary)}),
+    Scenario('load_item_delete', 'DELETE', '/api/load-items/<int:app_id>', load_item_delete),
+    Scenario('load_items_batch_add', 'POST', '/api/load-items/<int:app_id>/batch',
+             lambda ctx, i: {'path': f'/api/load-items/{ctx.app_id(i)}/batch',
+                             'json': {'items': [synthetic_load_item(ctx.rng, ctx.vocabulary) for _ in range(10)]}}),
+    Scenario('load_items_batch_delete', 'DELETE', '/api/load-items/<int:app_id>/batch', load_items_batch_delete),
+    Scenario('quotations_list', 'GET', '/api/quotations',
+             lambda ctx, i: {'path': f'/api/quotations?postcode={district(ctx, i)}&min_kva=50'}),
+    Scenario('quotations_match', 'GET', '/api/quotations/match',
+             lambda ctx, i: {'path': f'/api/quotations/match?postcode={district(ctx, i)}&kva={50 + i % 400}'}),
+    Scenario('quotation_get', 'GET', '/api/quotations/<quote_id>',
+             lambda ctx, i: {'path': f'/api/quotations/{ctx.quote_ids[i % len(ctx.quote_ids)]}'}),
+    Scenario('estimate', 'GET', '/api/estimates',
+             lambda ctx, i: {'path': f'/api/estimates?kva={20 + i % 500}&phases=Three&postcode={district(ctx, i)}'}),
+    Scenario('estimates_batch', 'POST', '/api/estimates/batch',
+             lambda ctx, i: {'path': '/api/estimates/batch',
+                             'json': {'application_ids': [ctx.app_id(i * 50 + n) for n in range(50)], 'save': False}}),
+    Scenario('offers_batch', 'POST', '/api/offers/batch',
+             lambda ctx, i: {'path': '/api/offers/batch', 'json': {'application_ids': ctx.accepted_ids[:50]}}),
+    Scenario('send_otp', 'POST', '/api/send-otp',
+             lambda ctx, i: {'path': '/api/send-otp', 'json': {'email': f'bench{i}@{ctx.email_domain}'}}),
+    Scenario('verify_otp', 'POST', '/api/verify-otp', otp_for),
+    Scenario('logout', 'POST', '/api/logout', logout_request),
+    Scenario('send_confirmation_email', 'POST', '/api/send-confirmation-email',
+             lambda ctx, i: {'path': '/api/send-confirmation-email',
+                             'json': {'email': f'bench{i}@{ctx.email_domain}', 'applicationNumber': f'CQ-{i:06d}',
+                                      'applicationId': ctx.app_id(i), 'submittedDate': '18/10/2026',
+                                      'submittedTime': '09:30'}}),
+    Scenario('login_logs', 'GET', '/api/login-logs', lambda ctx, i: {'path': '/api/login-logs?limit=100'}),
+    Scenario('login_logs_filtered', 'GET', '/api/login-logs',
+             lambda ctx, i: {'path': '/api/login-logs?activity_type=LOGIN_ATTEMPT&status=FAILED&limit=100'}),
+    Scenario('login_failures', 'GET', '/api/login-failures', lambda ctx, i: {'path': '/api/login-failures'}),
+    Scenario('email_queue_stats', 'GET', '/api/email-queue/stats', lambda ctx, i: {'path': '/api/email-queue/stats'}),
+    Scenario('pool_stats', 'GET', '/api/db/pool-stats', lambda ctx, i: {'path': '/api/db/pool-stats'}),
+    Scenario('metrics', 'GET', '/api/metrics', lambda ctx, i: {'path': '/api/metrics'}),
+    Scenario('profiler_settings', 'GET', '/api/metrics/profiler', lambda ctx, i: {'path': '/api/metrics/profiler'}),
+    Scenario('profiler_update', 'PUT', '/api/metrics/profiler',
+             lambda ctx, i: {'path': '/api/metrics/profiler', 'json': {'enabled': False}}),
+    Scenario('health_live', 'GET', '/api/health/live', lambda ctx, i: {'path': '/api/health/live'}),
+    Scenario('health_ready', 'GET', '/api/health/ready', lambda ctx, i: {'path': '/api/health/ready'}),
+    Scenario('test', 'GET', '/api/test', lambda ctx, i: {'path': '/api/test'}),
+    # Truncates the login log, so it runs last and once
+    Scenario('login_logs_clear', 'POST', '/api/login-logs/clear', lambda ctx, i: {'path': '/api/login-logs/clear'}),
+]
+RUN_ONCE = {'login_logs_clear'}
+
+# Concurrent phase: scenario -> weight, mostly reads like the frontend's traffic
+MIX = {
+    'application_get': 20, 'applications_list': 8, 'applications_search': 8, 'application_patch': 8,
+    'application_put': 4, 'applications_create': 3, 'load_items_list': 8, 'load_item_add': 3,
+    'quotations_match': 5, 'estimate': 5, 'application_estimate': 3, 'applications_nearby': 4,
+    'application_geometry': 3, 'login_logs': 2, 'send_otp': 2, 'verify_otp': 2, 'health_ready': 3,
+    'metrics': 1,
+}
+
+
+def timed_request(client, ctx, scenario, i):
+    """Build the i-th request of a scenario, then time only the request itself; returns (seconds, status)"""
+    kwargs = scenario.prepare(ctx, i)
+    headers = {**ctx.headers, **kwargs.pop('headers', {})}
+    path = kwargs.pop('path')
+    started = time.perf_counter()
+    response = client.open(path, method=scenario.method, headers=headers, **kwargs)
+    response.get_data()
+    elapsed = time.perf_counter() - started
+    response.close()
+    return elapsed, response.status_code
+
+
+def summarise(samples, wall_seconds=None):
+    """requests/s (per wall-clock second, or per second of request time), p50/p99 and status codes"""
+    latencies = sorted(latency for latency, _ in samples)
+    busy = wall_seconds or sum(latencies)
+    return {
+        'requests': len(samples),
+        'requests_per_second': round(len(samples) / busy, 1) if busy else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else None,
+        'status_codes': dict(Counter(str(status) for _, status in samples)),
+    }
+
+
+def run_sequential(ctx, scenarios, repeat, budget):
+    report = {}
+    for scenario in scenarios:
+        count = 1 if scenario.name in RUN_ONCE else repeat
+        deadline = time.perf_counter() + budget
+        samples = []
+        for i in range(count):
+            samples.append(timed_request(ctx.client, ctx, scenario, i))
+            if time.perf_counter() > deadline:
+                break
+        report[scenario.name] = summarise(samples)
+    return report
+
+
+def run_concurrent(app, ctx, scenarios, threads, duration):
+    by_name = {scenario.name: scenario for scenario in scenarios}
+    mix = [(by_name[name], weight) for name, weight in MIX.items() if name in by_name]
+    if not mix:
+        return None
+    choices, weights = zip(*mix)
+    counter = itertools.count(1_000_000)
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        client = app.test_client()
+        rng = random.Random(seed)
+        samples = []
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(choices, weights)[0]
+            samples.append((scenario.name, *timed_request(client, ctx, scenario, next(counter))))
+        with lock:
+            results.extend(samples)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for name, latency, status in results:
+        routes.setdefault(name, []).append((latency, status))
+    return {
+        'threads': threads,
+        'duration_seconds': round(elapsed, 2),
+        'total': summarise([(latency, status) for _, latency, status in results], elapsed),
+        'routes': {name: summarise(samples, elapsed) for name, samples in sorted(routes.items())},
+    }
+
+
+def uncovered_routes(app, scenarios):
+    """/api/* (rule, method) pairs no scenario exercises"""
+    covered = {(scenario.rule, scenario.method) for scenario in scenarios}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith('/api/'):
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if (rule.rule, method) not in covered:
+                missing.append(f'{method} {rule.rule}')
+    return sorted(missing)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(report, baseline):
+    """Text table of p50 and throughput against a baseline report, one line per scenario"""
+    lines = [f"{'scenario':36} {'p50 ms':>19} {'ratio':>6} {'req/s':>21} {'ratio':>6}"]
+    rows = [(name, stats, baseline.get('sequential', {}).get(name)) for name, stats in report['sequential'].items()]
+    if report.get('concurrent') and baseline.get('concurrent'):
+        rows.append(('concurrent (total)', report['concurrent']['total'], baseline['concurrent']['total']))
+    for name, now, before in rows:
+        if not before or not now['p50_ms'] or not before['p50_ms']:
+            continue
+        p50_ratio = now['p50_ms'] / before['p50_ms']
+        rps_ratio = now['requests_per_second'] / before['requests_per_second']
+        lines.append(f"{name:36} {before['p50_ms']:>8.2f} -> {now['p50_ms']:>8.2f} {p50_ratio:>6.2f} "
+                     f"{before['requests_per_second']:>9.1f} -> {now['requests_per_second']:>9.1f} {rps_ratio:>6.2f}")
+    return '\n'.join(lines)
+
+
+def start_mail_sink():
+    """Deliver email to the local SMTP sink when aiosmtpd is installed, else to a closed port (retried quietly)"""
+    os.environ.update({'SMTP_SERVER': '127.0.0.1', 'SMTP_STARTTLS': '0', 'EMAIL_ADDRESS': 'bench@example.com',
+                       'EMAIL_PASSWORD': ''})
+    try:
+        from smtp_sink import start_sink
+    except ImportError:
+        os.environ['SMTP_PORT'] = str(free_port())
+        return None
+    port = free_port()
+    sink, _ = start_sink(port=port)
+    os.environ['SMTP_PORT'] = str(port)
+    return sink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', help='dataset directory; generated if it holds no database (default: temporary)')
+    parser.add_argument('--applications', type=int, default=10_000)
+    parser.add_argument('--load-items', type=int, default=5, help='mean load items per application')
+    parser.add_argument('--log-lines', type=int, default=200_000)
+    parser.add_argument('--quotes', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=23)
+    parser.add_argument('--repeat', type=int, default=200, help='requests per scenario in the sequential phase')
+    parser.add_argument('--budget', type=float, default=5, help='seconds per scenario in the sequential phase')
+    parser.add_argument('--threads', type=int, default=8, help='threads in the concurrent phase (0 to skip it)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of the concurrent phase')
+    parser.add_argument('--scenarios', help='comma-separated scenario names to run (default: all)')
+    parser.add_argument('--email-domain', default='gmail.com')
+    parser.add_argument('--check-deliverability', action='store_true', help='let the OTP routes look up MX records')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    names = [name for name in (args.scenarios or '').split(',') if name]
+    unknown = set(names) - {scenario.name for scenario in SCENARIOS}
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    scenarios = [scenario for scenario in SCENARIOS if not names or scenario.name in names]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='api-bench-')
+    configure_environment(data_dir)
+    os.environ.update({'RATE_LIMIT_ENABLED': '0', 'ADMIN_EMAILS': 'bench@example.com',
+                       'SECRET_KEY': os.environ.get('SECRET_KEY') or secrets.token_hex(32)})
+    sink = start_mail_sink()
+
+    started = time.perf_counter()
+    if os.path.exists(os.environ['DATABASE_PATH']):
+        with open(os.path.join(data_dir, DATASET_SUMMARY)) as f:
+            dataset = {**json.load(f), 'reused': True}
+    else:
+        dataset = build_dataset(data_dir, args.applications, args.load_items, args.log_lines, args.quotes, args.seed)
+    setup_seconds = time.perf_counter() - started
+
+    import email_validator
+    from app import create_app, startup
+    from auth import token_signer
+    from db import pool
+    from login_logs import LOGIN_LOG_FILE
+    from mailer import delivery_worker
+
+    email_validator.CHECK_DELIVERABILITY = args.check_deliverability
+    report = {
+        'meta': {
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'setup_seconds': round(setup_seconds, 1),
+        },
+        'dataset': dataset,
+        'peak_rss_mb': {'after_dataset': peak_rss_mb()},
+    }
+
+    # login_logs_clear rotates the log away; put it back afterwards so the directory can be reused
+    log_copy = f'{LOGIN_LOG_FILE}.bench'
+    if os.path.exists(LOGIN_LOG_FILE):
+        shutil.copyfile(LOGIN_LOG_FILE, log_copy)
+    try:
+        # The app logs every OTP and queued email to stdout; keep stdout for the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            startup()
+            delivery_worker.start()
+            app = create_app()
+            ctx = Context(app.test_client(), token_signer.issue('bench@example.com'), args.email_domain, args.seed)
+            report['uncovered_routes'] = uncovered_routes(app, SCENARIOS)
+
+            report['sequential'] = run_sequential(ctx, scenarios, args.repeat, args.budget)
+            report['peak_rss_mb']['after_sequential'] = peak_rss_mb()
+            if args.threads > 0:
+                report['concurrent'] = run_concurrent(app, ctx, scenarios, args.threads, args.duration)
+                report['peak_rss_mb']['after_concurrent'] = peak_rss_mb()
+            report['db_pool'] = pool.stats()
+    finally:
+        delivery_worker.stop()
+        if sink:
+            sink.stop()
+        if os.path.exists(log_copy):
+            os.replace(log_copy, LOGIN_LOG_FILE)
+
+    if report['uncovered_routes']:
+        print(f"warning: no scenario covers {', '.join(report['uncovered_routes'])}", file=sys.stderr)
+    if baseline:
+        print(compare(report, baseline), file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
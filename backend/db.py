@@ -0,0 +1,222 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g
+
+from metrics import METRICS_ENABLED, record_query
+
+# Database configuration (override through the environment)
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
+DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(DATA_DIR, 'applications.db'))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper()
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', '256'))
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the pool timeout"""
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that reports how long each statement takes to the metrics module.
+
+    The time covers executing the statement up to its first row; rows
+    fetched later from the cursor are not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            record_query(time.perf_counter() - started)
+
+
+class ConnectionPool:
+    """Thread-safe pool of WAL-mode SQLite connections.
+
+    Connections are opened lazily up to ``size`` and handed back to a LIFO
+    queue on release, so the hottest connection (and its statement cache)
+    is reused first.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 busy_timeout_ms=DB_BUSY_TIMEOUT_MS, synchronous=DB_SYNCHRONOUS,
+                 cached_statements=DB_STATEMENT_CACHE_SIZE):
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f'Invalid synchronous level: {synchronous}')
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._reset()
+        # SQLite connections must not be used across fork(); a preloaded
+        # gunicorn worker starts with an empty pool instead
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        """Open a new connection with the pool's PRAGMAs applied"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=TimedConnection if METRICS_ENABLED else sqlite3.Connection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if there is room"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._hits += 1
+                self._in_use += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+                self._misses += 1
+        if can_create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._in_use += 1
+            return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+        with self._lock:
+            self._waits += 1
+            self._wait_time += time.perf_counter() - started
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped so the pool can open a fresh one
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+            conn.close()
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that always hands the connection back"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'wait_time_ms': round(self._wait_time * 1000, 3),
+                'timeouts': self._timeouts
+            }
+
+
+pool = ConnectionPool(DATABASE_PATH)
+
+
+def get_db():
+    """Return the pooled connection bound to the current request"""
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    """Release the request's connection back to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def init_app(app):
+    """Register the pool teardown on the Flask app"""
+    app.teardown_appcontext(close_db)
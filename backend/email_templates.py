@@ -0,0 +1,101 @@
+import base64
+import os
+from collections import namedtuple
+from email.header import Header
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, StrictUndefined, select_autoescape
+
+from mailer import EMAIL_ADDRESS
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'email')
+OTP_EXPIRY_MINUTES = 10
+
+# Autoescape HTML templates only; the .txt alternatives are sent as plain text.
+# The bytecode cache lets every worker process skip re-parsing the templates.
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(enabled_extensions=('html',), default_for_string=False),
+    bytecode_cache=FileSystemBytecodeCache(),
+    undefined=StrictUndefined,
+    auto_reload=False
+)
+
+# Compiled once at import time
+OTP_HTML = _env.get_template('otp.html')
+OTP_TEXT = _env.get_template('otp.txt')
+CONFIRMATION_HTML = _env.get_template('confirmation.html')
+CONFIRMATION_TEXT = _env.get_template('confirmation.txt')
+
+
+# Static MIME skeleton, built once. Part headers are constant and the bodies
+# are base64, which can never contain the boundary delimiter line.
+BOUNDARY = '===============ukpn-alternative=='
+PART_HEADERS = {
+    subtype: (
+        f'--{BOUNDARY}\n'
+        f'Content-Type: text/{subtype}; charset="utf-8"\n'
+        'MIME-Version: 1.0\n'
+        'Content-Transfer-Encoding: base64\n\n'
+    )
+    for subtype in ('plain', 'html')
+}
+MESSAGE_HEADERS = (
+    f'Content-Type: multipart/alternative; boundary="{BOUNDARY}"\n'
+    'MIME-Version: 1.0\n'
+    f'From: {EMAIL_ADDRESS}\n'
+)
+CLOSING = f'--{BOUNDARY}--\n'
+
+RenderedEmail = namedtuple('RenderedEmail', ['recipient', 'subject', 'message'])
+
+
+def _header_value(value):
+    """Single-line header value, RFC 2047-encoded when it is not ASCII"""
+    value = ' '.join(str(value).split())
+    if value.isascii():
+        return value
+    return Header(value, 'utf-8').encode()
+
+
+def _body(text):
+    """Base64 body lines; encodebytes already ends with a newline"""
+    return base64.encodebytes(text.encode('utf-8')).decode('ascii')
+
+
+def build_message(recipient, subject, text_body, html_body):
+    """multipart/alternative message with a plain-text part and an HTML part"""
+    message = ''.join((
+        MESSAGE_HEADERS,
+        'To: ', _header_value(recipient), '\n',
+        'Subject: ', _header_value(subject), '\n\n',
+        PART_HEADERS['plain'], _body(text_body),
+        PART_HEADERS['html'], _body(html_body),
+        CLOSING
+    ))
+    return RenderedEmail(recipient, subject, message)
+
+
+def render_otp_email(recipient, otp):
+    context = {'otp': otp, 'expiry_minutes': OTP_EXPIRY_MINUTES}
+    return build_message(
+        recipient,
+        "UK Power Networks - One-Time Password",
+        OTP_TEXT.render(context),
+        OTP_HTML.render(context)
+    )
+
+
+def render_confirmation_email(recipient, application_number, application_id=None,
+                              submitted_date=None, submitted_time=None):
+    context = {
+        'application_number': application_number,
+        'application_id': application_id,
+        'submitted_date': submitted_date,
+        'submitted_time': submitted_time
+    }
+    return build_message(
+        recipient,
+        f"UK Power Networks - Application Confirmation ({application_number})",
+        CONFIRMATION_TEXT.render(context),
+        CONFIRMATION_HTML.render(context)
+    )
@@ -0,0 +1,178 @@
+import os
+import threading
+
+import numpy as np
+
+from quotations import parse_phases, postcode_area
+from schema import normalize_postcode, postcode_district
+
+# Estimator configuration (override through the environment)
+ESTIMATE_NEIGHBOURS = int(os.environ.get('ESTIMATE_NEIGHBOURS', '3'))
+ESTIMATE_CHUNK_SIZE = int(os.environ.get('ESTIMATE_CHUNK_SIZE', '4096'))
+# Cost grows sub-linearly with capacity; 1.0 would scale costs pro rata
+ESTIMATE_KVA_ELASTICITY = float(os.environ.get('ESTIMATE_KVA_ELASTICITY', '0.6'))
+TARIFF_MULTIPLIER = float(os.environ.get('TARIFF_MULTIPLIER', '1.0'))
+
+# Stay under SQLite's host-parameter limit on older builds
+SQL_IN_CHUNK_SIZE = 500
+
+# Distance penalties added on top of the log-kVA distance
+PHASE_MISMATCH_PENALTY = 1.0
+DISTRICT_MISMATCH_PENALTY = 0.25
+AREA_MISMATCH_PENALTY = 0.75
+
+
+class HistoricalQuoteTable:
+    """Column-oriented NumPy view of the historical quotes.
+
+    One row per quote with a parseable kVA; ``components`` holds the union of
+    breakdown keys and ``breakdown`` the matching cost matrix (0 when absent).
+    """
+
+    def __init__(self, quotes):
+        quotes = [quote for quote in quotes if quote.get('loadKva')]
+        self.quote_ids = [quote['quoteId'] for quote in quotes]
+        self.currency = quotes[0].get('currency', 'GBP') if quotes else 'GBP'
+        self.components = sorted({key for quote in quotes for key in (quote.get('breakdown') or {})})
+        component_index = {name: i for i, name in enumerate(self.components)}
+
+        self.codes = {}
+        self.kva = np.array([quote['loadKva'] for quote in quotes], dtype=np.float64)
+        self.log_kva = np.log1p(self.kva)
+        self.phases = np.array([quote.get('phaseCount') or 0 for quote in quotes], dtype=np.int8)
+        self.district = np.array([self.code(quote.get('postcodeDistrict')) for quote in quotes], dtype=np.int32)
+        self.area = np.array([self.code(postcode_area(quote.get('postcodeDistrict'))) for quote in quotes],
+                             dtype=np.int32)
+        self.total = np.array([quote.get('estimatedCost') or 0 for quote in quotes], dtype=np.float64)
+        self.breakdown = np.zeros((len(quotes), len(self.components)), dtype=np.float64)
+        for row, quote in enumerate(quotes):
+            for name, amount in (quote.get('breakdown') or {}).items():
+                if isinstance(amount, (int, float)):
+                    self.breakdown[row, component_index[name]] = amount
+
+    def code(self, value, add=True):
+        """Integer code for a postcode district/area; -1 for unknown values"""
+        if not value:
+            return -1
+        if value not in self.codes:
+            if not add:
+                return -1
+            self.codes[value] = len(self.codes)
+        return self.codes[value]
+
+    def __len__(self):
+        return len(self.quote_ids)
+
+
+class QuoteEstimator:
+    """Nearest-neighbour cost estimator over the historical quote table"""
+
+    def __init__(self, store, neighbours=ESTIMATE_NEIGHBOURS, elasticity=ESTIMATE_KVA_ELASTICITY,
+                 chunk_size=ESTIMATE_CHUNK_SIZE):
+        self.store = store
+        self.neighbours = neighbours
+        self.elasticity = elasticity
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._table = None
+        self._generation = None
+
+    def table(self):
+        """Historical table, rebuilt whenever the quote store reloads"""
+        self.store.maybe_refresh()
+        with self._lock:
+            if self._table is None or self._generation != self.store.generation:
+                self._table = HistoricalQuoteTable(self.store.all())
+                self._generation = self.store.generation
+            return self._table
+
+    def _estimate_chunk(self, table, kva, phases, district, area, tariff):
+        """Vectorised k-NN over one chunk of queries (Q) against the table (H)"""
+        distance = np.abs(np.log1p(kva)[:, None] - table.log_kva[None, :])
+        distance += PHASE_MISMATCH_PENALTY * ((phases[:, None] != table.phases[None, :]) & (phases[:, None] > 0))
+        same_district = (district[:, None] == table.district[None, :]) & (district[:, None] >= 0)
+        same_area = (area[:, None] == table.area[None, :]) & (area[:, None] >= 0)
+        distance += np.where(same_district, 0.0,
+                             np.where(same_area, DISTRICT_MISMATCH_PENALTY, AREA_MISMATCH_PENALTY))
+
+        k = min(self.neighbours, len(table))
+        if k < len(table):
+            nearest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.tile(np.arange(len(table)), (len(kva), 1))
+        nearest_distance = np.take_along_axis(distance, nearest, axis=1)
+        weights = 1.0 / (nearest_distance + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        # Scale each comparable's costs to the requested capacity
+        scale = (kva[:, None] / table.kva[nearest]) ** self.elasticity
+        factors = weights * scale * tariff
+        totals = (factors * table.total[nearest]).sum(axis=1)
+        breakdown = np.einsum('qk,qkc->qc', factors, table.breakdown[nearest])
+        return totals, breakdown, nearest
+
+    def estimate_many(self, requests, tariff_multiplier=None):
+        """Estimate quotes for a list of dicts with ``load_kva``, ``phases`` and ``postcode``.
+
+        Returns one result dict per request (None when it has no load).
+        """
+        table = self.table()
+        tariff = TARIFF_MULTIPLIER if tariff_multiplier is None else tariff_multiplier
+        results = [None] * len(requests)
+        if not len(table):
+            return results
+
+        kva = np.array([float(request.get('load_kva') or 0) for request in requests], dtype=np.float64)
+        phases = np.array([parse_phases(request.get('phases')) or 0 for request in requests], dtype=np.int8)
+        districts = [postcode_district(normalize_postcode(request.get('postcode'))) for request in requests]
+        district = np.array([table.code(value, add=False) for value in districts], dtype=np.int32)
+        area = np.array([table.code(postcode_area(value), add=False) for value in districts], dtype=np.int32)
+        valid = np.flatnonzero(kva > 0)
+
+        for start in range(0, len(valid), self.chunk_size):
+            rows = valid[start:start + self.chunk_size]
+            totals, breakdown, nearest = self._estimate_chunk(
+                table, kva[rows], phases[rows], district[rows], area[rows], tariff)
+            totals = np.round(totals, 2)
+            breakdown = np.round(breakdown, 2)
+            for i, row in enumerate(rows):
+                results[row] = {
+                    'estimatedCost': float(totals[i]),
+                    'currency': table.currency,
+                    'breakdown': {name: float(amount) for name, amount
+                                  in zip(table.components, breakdown[i]) if amount},
+                    'loadKva': float(kva[row]),
+                    'phases': int(phases[row]) or None,
+                    'postcodeDistrict': districts[row],
+                    'comparableQuotes': [table.quote_ids[j] for j in nearest[i]],
+                    'tariffMultiplier': tariff
+                }
+        return results
+
+    def estimate(self, load_kva, phases=None, postcode=None, tariff_multiplier=None):
+        return self.estimate_many([{'load_kva': load_kva, 'phases': phases, 'postcode': postcode}],
+                                  tariff_multiplier)[0]
+
+
+def application_load_features(conn, app_ids):
+    """Total kVA, phase count and postcode per application, in one aggregate query per chunk"""
+    features = {}
+    app_ids = list(app_ids)
+    for start in range(0, len(app_ids), SQL_IN_CHUNK_SIZE):
+        chunk = app_ids[start:start + SQL_IN_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT a.id, a.postcode,
+                   COALESCE(SUM(li.summed_load), 0) AS load_kva,
+                   MAX(CASE WHEN lower(li.phases) LIKE 'three%' OR li.phases LIKE '3%' THEN 3
+                            WHEN li.phases IS NULL OR li.phases = '' THEN 0
+                            ELSE 1 END) AS phases
+            FROM applications a
+            LEFT JOIN load_items li ON li.application_id = a.id
+            WHERE a.id IN ({placeholders})
+            GROUP BY a.id
+        ''', chunk).fetchall()
+        for row in rows:
+            features[row['id']] = {'load_kva': row['load_kva'], 'phases': row['phases'] or None,
+                                   'postcode': row['postcode']}
+    return features
@@ -0,0 +1,231 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+
+from applications import LIST_COLUMNS, LIST_FIELDS, list_applications, list_filter_clauses
+from db import pool
+from schema import JSON_SECTIONS
+
+# Export configuration (override through the environment)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '20000'))
+
+LOAD_ITEM_COLUMNS = ['id', 'connection_type', 'phases', 'heating_type', 'bedrooms',
+                     'quantity', 'load_per_installation', 'summed_load']
+INTEGER_COLUMNS = {'id', 'version', 'quantity'}
+FLOAT_COLUMNS = {'estimated_cost', 'load_per_installation', 'summed_load'}
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def load_items_by_application(conn, app_ids):
+    """{application_id: [load item, ...]} for one batch of applications"""
+    grouped = {app_id: [] for app_id in app_ids}
+    placeholders = ', '.join('?' * len(app_ids))
+    for row in conn.execute(f'''
+        SELECT * FROM load_items WHERE application_id IN ({placeholders}) ORDER BY application_id, id
+    ''', app_ids):
+        item = dict(row)
+        grouped[item.pop('application_id')].append(item)
+    return grouped
+
+
+def iter_application_batches(filters=None, batch_size=EXPORT_BATCH_SIZE):
+    """Applications in id order, ``batch_size`` at a time, each with its load_items.
+
+    Every batch is one keyset page read on a pooled connection that is
+    returned straight away, so memory stays at one batch and a slow client
+    never holds a read transaction open across the whole export.
+    """
+    cursor = None
+    while True:
+        with pool.connection() as conn:
+            applications, cursor = list_applications(conn, batch_size, cursor, 'id', 'asc', filters, LIST_FIELDS)
+            items = load_items_by_application(conn, [application['id'] for application in applications])
+        for application in applications:
+            application['load_items'] = items[application['id']]
+        if applications:
+            yield applications
+        if cursor is None:
+            return
+
+
+def section_keys(filters=None):
+    """Top-level keys used by each JSON section of the selected applications, in one table scan.
+
+    CSV and Parquet need their columns before the first row is written.
+    """
+    where, params = list_filter_clauses(filters)
+    value = f"CASE sections.name {' '.join(f'WHEN {section!r} THEN applications.{section}' for section in JSON_SECTIONS)} END"
+    names = ' UNION ALL '.join(f'SELECT {section!r} AS name' for section in JSON_SECTIONS)
+    with pool.connection() as conn:
+        rows = conn.execute(f'''
+            SELECT DISTINCT sections.name, entry.key
+            FROM applications
+            CROSS JOIN ({names}) AS sections
+            CROSS JOIN json_each(CASE WHEN json_valid({value}) THEN {value} END) AS entry
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+        ''', params).fetchall()
+    keys = {section: [] for section in JSON_SECTIONS}
+    for section, key in rows:
+        keys[section].append(key)
+    return {section: sorted(found) for section, found in keys.items()}
+
+
+def flat_columns(keys):
+    return LIST_COLUMNS + [f'{section}.{key}' for section in JSON_SECTIONS for key in keys[section]]
+
+
+def flat_value(value):
+    """Strings as-is; numbers, booleans, objects and lists as JSON text"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def flatten(application, keys):
+    """One application as a list of values in flat_columns order"""
+    row = [application.get(column) for column in LIST_COLUMNS]
+    for section in JSON_SECTIONS:
+        values = application.get(section) or {}
+        row.extend(flat_value(values.get(key)) if isinstance(values, dict) else None for key in keys[section])
+    return row
+
+
+def ndjson_chunks(batches):
+    """One JSON object per line: the application, its parsed sections and its load_items"""
+    for batch in batches:
+        yield ''.join(json.dumps(application) + '\n' for application in batch)
+
+
+def csv_chunks(batches, keys):
+    """One CSV row per load item (application columns repeated); one row for applications without any"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(flat_columns(keys) + [f'load_item.{column}' for column in LOAD_ITEM_COLUMNS])
+    no_items = [None] * len(LOAD_ITEM_COLUMNS)
+    for batch in batches:
+        for application in batch:
+            row = flatten(application, keys)
+            for item in application['load_items']:
+                writer.writerow(row + [item.get(column) for column in LOAD_ITEM_COLUMNS])
+            if not application['load_items']:
+                writer.writerow(row + no_items)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class ChunkSink:
+    """Write-only file object that hands back what was written since the last take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(batches, keys, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """Parquet file bytes, one row group per ``row_group_size`` applications.
+
+    The JSON sections are flattened into ``section.key`` string columns and
+    load items are a list<struct> column, so each application stays one row.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def arrow_type(column):
+        if column in INTEGER_COLUMNS:
+            return pa.int64()
+        if column in FLOAT_COLUMNS:
+            return pa.float64()
+        return pa.string()
+
+    columns = flat_columns(keys)
+    load_item_type = pa.struct([(column, arrow_type(column)) for column in LOAD_ITEM_COLUMNS])
+    schema = pa.schema([(column, arrow_type(column)) for column in LIST_COLUMNS] +
+                       [(column, pa.string()) for column in columns[len(LIST_COLUMNS):]] +
+                       [('load_items', pa.list_(load_item_type))])
+
+    def typed(column, value):
+        # load_items columns are loosely typed in SQLite (e.g. a quantity sent as "2")
+        try:
+            if column in INTEGER_COLUMNS:
+                return int(value) if value not in (None, '') else None
+            if column in FLOAT_COLUMNS:
+                return float(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            return None
+        return value if value is None or isinstance(value, str) else str(value)
+
+    def write(applications):
+        rows = [flatten(application, keys) for application in applications]
+        data = {column: [row[index] for row in rows] for index, column in enumerate(columns)}
+        data['load_items'] = [
+            [{column: typed(column, item.get(column)) for column in LOAD_ITEM_COLUMNS}
+             for item in application['load_items']]
+            for application in applications
+        ]
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        if len(pending) >= row_group_size:
+            write(pending)
+            pending = []
+            yield sink.take()
+    if pending:
+        write(pending)
+    writer.close()
+    yield sink.take()
+
+
+def export_chunks(export_format, filters=None, batch_size=EXPORT_BATCH_SIZE):
+    """Generator of str (ndjson, csv) or bytes (parquet) chunks for the selected applications.
+
+    Column discovery for csv and parquet runs before this returns, so bad
+    filters fail before a response starts streaming.
+    """
+    list_filter_clauses(filters)
+    batches = iter_application_batches(filters, batch_size)
+    if export_format == 'ndjson':
+        return ndjson_chunks(batches)
+    keys = section_keys(filters)
+    if export_format == 'csv':
+        return csv_chunks(batches, keys)
+    if export_format == 'parquet':
+        return parquet_chunks(batches, keys)
+    raise ValueError(f'Unknown export format: {export_format}')
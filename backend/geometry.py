@@ -0,0 +1,366 @@
+import json
+import math
+import os
+
+import numpy as np
+
+# Geometry configuration (override through the environment)
+GEOMETRY_BATCH_SIZE = int(os.environ.get('GEOMETRY_BATCH_SIZE', '1000'))
+MAX_NEARBY_RADIUS_M = float(os.environ.get('MAX_NEARBY_RADIUS_M', '50000'))
+MAX_NEARBY_LIMIT = 500
+OVERLAP_TOLERANCE_M = float(os.environ.get('OVERLAP_TOLERANCE_M', '5'))
+MAX_OVERLAP_TOLERANCE_M = 100.0
+
+# Same sphere as google.maps.geometry.spherical, so lengths match the map labels
+EARTH_RADIUS_M = 6378137.0
+
+# click_quote_data key -> (minimum points, closed ring)
+SHAPES = {
+    'siteBoundary': (3, True),
+    'substationPremise': (1, False),
+    'cableRoute': (2, False),
+}
+
+
+def parse_points(value):
+    """(n, 2) float array of [lat, lng] from a {lat, lng} dict or a list of them.
+
+    Raises ValueError for anything that is not a finite, in-range coordinate.
+    """
+    points = [value] if isinstance(value, dict) else value
+    if not isinstance(points, list):
+        raise ValueError('expected a list of {lat, lng} points')
+    try:
+        coords = np.array([[point['lat'], point['lng']] for point in points], dtype=np.float64)
+    except (TypeError, KeyError, ValueError):
+        raise ValueError('every point needs numeric lat and lng')
+    coords = coords.reshape(-1, 2)
+    if not np.isfinite(coords).all() or (np.abs(coords[:, 0]) > 90).any() or (np.abs(coords[:, 1]) > 180).any():
+        raise ValueError('coordinates out of range')
+    return coords
+
+
+def shapes_from_click_quote(data):
+    """({kind: points}, {kind: problem}) for the shapes drawn on the map"""
+    shapes, problems = {}, {}
+    if not isinstance(data, dict):
+        return shapes, problems
+    for kind, (minimum, _) in SHAPES.items():
+        if data.get(kind) is None:
+            continue
+        try:
+            points = parse_points(data[kind])
+        except ValueError as e:
+            problems[kind] = str(e)
+            continue
+        if len(points) < minimum:
+            problems[kind] = f'needs at least {minimum} points'
+            continue
+        shapes[kind] = points
+    return shapes, problems
+
+
+def segment_ends(points, closed):
+    """Start and end points of every edge; a closed ring gets its closing edge, a point one empty edge"""
+    if closed:
+        return points, np.roll(points, -1, axis=0)
+    if len(points) == 1:
+        return points, points
+    return points[:-1], points[1:]
+
+
+def _edge_index(shapes):
+    """Concatenated points of many (kind, points) shapes with the start/end point index and owner of every edge.
+
+    Also returns the index of each shape's first point.
+    """
+    counts = np.array([len(points) for _, points in shapes])
+    closed = np.array([SHAPES[kind][1] for kind, _ in shapes])
+    first = np.cumsum(counts) - counts
+    # A ring has one edge per point, a line one fewer, a single point one empty edge
+    edges = np.where(closed, counts, np.maximum(counts - 1, 1))
+    owner = np.repeat(np.arange(len(shapes)), edges)
+    local = np.arange(edges.sum()) - np.repeat(np.cumsum(edges) - edges, edges)
+    start = first[owner] + local
+    end = np.where(local + 1 < counts[owner], start + 1, first[owner])
+    return np.concatenate([points for _, points in shapes]), start, end, owner, first
+
+
+def haversine(start, end):
+    """Great-circle distances in metres between matching rows of two [lat, lng] arrays"""
+    lat1, lng1 = np.radians(start[:, 0]), np.radians(start[:, 1])
+    lat2, lng2 = np.radians(end[:, 0]), np.radians(end[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def edge_area_terms(start, end):
+    """Per-edge terms whose sum over a closed ring is twice its spherical area divided by R squared"""
+    lat1, lat2 = np.radians(start[:, 0]), np.radians(end[:, 0])
+    # Wrap longitude steps across the antimeridian
+    step = (np.radians(end[:, 1] - start[:, 1]) + np.pi) % (2 * np.pi) - np.pi
+    return step * (2 + np.sin(lat1) + np.sin(lat2))
+
+
+def ring_area(points):
+    """Area in square metres of a closed [lat, lng] ring on the sphere"""
+    start, end = segment_ends(points, True)
+    return float(abs(edge_area_terms(start, end).sum())) * EARTH_RADIUS_M ** 2 / 2
+
+
+def measure(points, closed):
+    """Length (perimeter for rings), area and per-edge lengths and midpoints of one shape"""
+    start, end = segment_ends(points, closed)
+    lengths = haversine(start, end) if len(points) > 1 else np.zeros(0)
+    midpoints = (start + end) / 2
+    return {
+        'length_m': round(float(lengths.sum()), 2),
+        'area_m2': round(ring_area(points), 2) if closed else None,
+        'segments': [{'length_m': round(float(length), 2), 'midpoint': {'lat': float(lat), 'lng': float(lng)}}
+                     for length, (lat, lng) in zip(lengths, midpoints)]
+    }
+
+
+def measure_click_quote(data):
+    """Server-side measurements of every shape in click_quote_data, plus any shapes that failed validation"""
+    shapes, problems = shapes_from_click_quote(data)
+    result = {kind: measure(points, SHAPES[kind][1]) for kind, points in shapes.items()}
+    result['problems'] = problems
+    return result
+
+
+def create_geometry_index(conn):
+    """Shape table and the R*Tree over each shape's bounding box"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS application_geometries (
+            id INTEGER PRIMARY KEY,
+            application_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            points BLOB NOT NULL,
+            length_m REAL NOT NULL,
+            area_m2 REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_application_geometries_application_id
+        ON application_geometries (application_id)
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS application_geometries_rtree
+        USING rtree(id, min_lat, max_lat, min_lng, max_lng)
+    ''')
+
+
+def _geometry_rows(shapes):
+    """Index rows for a list of (application_id, kind, points), measured in one vectorised pass"""
+    if not shapes:
+        return []
+    points, start, end, owner, first = _edge_index([(kind, shape) for _, kind, shape in shapes])
+    lengths = np.bincount(owner, weights=haversine(points[start], points[end]), minlength=len(shapes))
+    areas = np.abs(np.bincount(owner, weights=edge_area_terms(points[start], points[end]),
+                               minlength=len(shapes))) * EARTH_RADIUS_M ** 2 / 2
+    bounds = [np.minimum.reduceat(points[:, 0], first), np.maximum.reduceat(points[:, 0], first),
+              np.minimum.reduceat(points[:, 1], first), np.maximum.reduceat(points[:, 1], first)]
+    return [
+        (app_id, kind, shape.tobytes(), float(lengths[i]), float(areas[i]) if SHAPES[kind][1] else None,
+         *(float(bound[i]) for bound in bounds))
+        for i, (app_id, kind, shape) in enumerate(shapes)
+    ]
+
+
+def _application_shapes(app_id, click_quote_data):
+    shapes, _ = shapes_from_click_quote(click_quote_data)
+    return [(app_id, kind, points) for kind, points in shapes.items()]
+
+
+def _insert_geometries(conn, rows):
+    if not rows:
+        return
+    first_id = conn.execute('SELECT coalesce(max(id), 0) + 1 FROM application_geometries').fetchone()[0]
+    conn.executemany('''
+        INSERT INTO application_geometries (id, application_id, kind, points, length_m, area_m2)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(first_id + i, *row[:5]) for i, row in enumerate(rows)])
+    conn.executemany('INSERT INTO application_geometries_rtree VALUES (?, ?, ?, ?, ?)',
+                     [(first_id + i, *row[5:]) for i, row in enumerate(rows)])
+
+
+def index_application_geometry(conn, app_id, click_quote_data):
+    """Replace the indexed shapes of one application; the caller commits.
+
+    Shapes that fail validation are left out of the index rather than
+    failing the save, since the map stores half-drawn shapes too.
+    """
+    conn.execute('''
+        DELETE FROM application_geometries_rtree
+        WHERE id IN (SELECT id FROM application_geometries WHERE application_id = ?)
+    ''', (app_id,))
+    conn.execute('DELETE FROM application_geometries WHERE application_id = ?', (app_id,))
+    _insert_geometries(conn, _geometry_rows(_application_shapes(app_id, click_quote_data)))
+
+
+def rebuild_geometry_index(conn, batch_size=GEOMETRY_BATCH_SIZE):
+    """Re-index every application's map shapes; returns the number of shapes indexed"""
+    conn.execute('DELETE FROM application_geometries_rtree')
+    conn.execute('DELETE FROM application_geometries')
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, click_quote_data FROM applications WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        shapes = []
+        for app_id, data in rows:
+            try:
+                shapes.extend(_application_shapes(app_id, json.loads(data) if data else {}))
+            except ValueError:
+                continue
+        _insert_geometries(conn, _geometry_rows(shapes))
+        indexed += len(shapes)
+        conn.commit()
+        last_id = rows[-1][0]
+    return indexed
+
+
+def _bounding_box(min_lat, max_lat, min_lng, max_lng, margin_m):
+    """Bounds grown by margin_m metres on every side, for the R*Tree prefilter"""
+    dlat = math.degrees(margin_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(min(max(abs(min_lat), abs(max_lat)) + dlat, 90.0)))
+    dlng = 180.0 if cos_lat < 1e-9 else min(180.0, dlat / cos_lat)
+    return min_lat - dlat, max_lat + dlat, min_lng - dlng, max_lng + dlng
+
+
+def _candidates(conn, bounds, kinds, exclude=None):
+    """Indexed shapes whose bounding box meets ``bounds``: (ids, kinds, lengths, [points, ...])"""
+    min_lat, max_lat, min_lng, max_lng = bounds
+    kind_clause = f"AND g.kind IN ({', '.join('?' * len(kinds))})" if kinds else ''
+    return conn.execute(f'''
+        SELECT g.application_id, g.kind, g.length_m, g.points
+        FROM application_geometries_rtree AS r
+        JOIN application_geometries AS g ON g.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+              {kind_clause} AND g.application_id IS NOT ?
+    ''', (min_lat, max_lat, min_lng, max_lng, *kinds, exclude)).fetchall()
+
+
+def _project(points, origin):
+    """Local east/north metres around ``origin``; accurate to well under 1% across tens of kilometres"""
+    lat0 = math.radians(origin[0])
+    y = np.radians(points[..., 0] - origin[0]) * EARTH_RADIUS_M
+    x = np.radians((points[..., 1] - origin[1] + 180) % 360 - 180) * EARTH_RADIUS_M * math.cos(lat0)
+    return np.stack([x, y], axis=-1)
+
+
+def _point_segment_distance(p, a, b):
+    """Distance from points p to segments a-b, broadcasting over leading dimensions"""
+    ab = b - a
+    length2 = (ab ** 2).sum(axis=-1)
+    t = np.where(length2 > 0, ((p - a) * ab).sum(axis=-1) / np.where(length2 > 0, length2, 1), 0)
+    closest = a + np.clip(t, 0, 1)[..., None] * ab
+    return np.sqrt(((p - closest) ** 2).sum(axis=-1))
+
+
+def _cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def _segments_cross(a1, a2, b1, b2):
+    d1, d2 = _cross(b1, b2, a1), _cross(b1, b2, a2)
+    d3, d4 = _cross(a1, a2, b1), _cross(a1, a2, b2)
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+def _inside_rings(points, start, end, offsets):
+    """(points, rings) bool matrix: ray casting over concatenated ring edges starting at ``offsets``"""
+    px, py = points[:, None, 0], points[:, None, 1]
+    straddles = (start[None, :, 1] > py) != (end[None, :, 1] > py)
+    dy = np.where(straddles, end[None, :, 1] - start[None, :, 1], 1)
+    x_cross = start[None, :, 0] + (py - start[None, :, 1]) * (end[None, :, 0] - start[None, :, 0]) / dy
+    crossings = np.add.reduceat((straddles & (px < x_cross)).astype(np.int64), offsets, axis=1)
+    return crossings % 2 == 1
+
+
+def _edges(shapes, origin):
+    """Projected edges of many shapes concatenated, with the index of the shape each belongs to"""
+    points, start, end, owner, _ = _edge_index(shapes)
+    points = _project(points, origin)
+    return points[start], points[end], owner
+
+
+def shape_distances(shape, others, origin=None):
+    """Minimum distance in metres from one (kind, points) shape to each of ``others``; 0 when they touch.
+
+    All edge pairs are compared in one vectorised pass, so the cost is one
+    NumPy call per query rather than one per edge.
+    """
+    if not others:
+        return np.zeros(0)
+    kind, points = shape
+    origin = points[0] if origin is None else origin
+    a_start, a_end = segment_ends(_project(points, origin), SHAPES[kind][1])
+    b_start, b_end, owner = _edges(others, origin)
+
+    a1, a2 = a_start[:, None, :], a_end[:, None, :]
+    b1, b2 = b_start[None, :, :], b_end[None, :, :]
+    pair = np.minimum.reduce([
+        _point_segment_distance(a1, b1, b2), _point_segment_distance(a2, b1, b2),
+        _point_segment_distance(b1, a1, a2), _point_segment_distance(b2, a1, a2),
+    ])
+    pair = np.where(_segments_cross(a1, a2, b1, b2), 0.0, pair)
+    distances = np.full(len(others), np.inf)
+    np.minimum.at(distances, owner, pair.min(axis=0))
+
+    # One shape entirely inside a ring never crosses its edges
+    offsets = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+    rings = np.array([SHAPES[other_kind][1] for other_kind, _ in others])
+    if rings.any():
+        distances[rings & _inside_rings(a_start[:1], b_start, b_end, offsets)[0]] = 0.0
+    if SHAPES[kind][1]:
+        firsts = b_start[offsets]
+        distances[_inside_rings(firsts, a_start, a_end, np.zeros(1, dtype=np.int64))[:, 0]] = 0.0
+    return distances
+
+
+def _parse_kinds(kinds):
+    kinds = list(kinds or SHAPES)
+    unknown = set(kinds) - set(SHAPES)
+    if unknown:
+        raise ValueError(f"Unknown shape kind(s): {', '.join(sorted(unknown))}")
+    return kinds
+
+
+def applications_within(conn, lat, lng, radius_m, kinds=None, limit=100):
+    """Shapes within radius_m metres of a point, nearest first: [{application_id, kind, distance_m}, ...]"""
+    kinds = _parse_kinds(kinds)
+    point = parse_points({'lat': lat, 'lng': lng})
+    rows = _candidates(conn, _bounding_box(lat, lat, lng, lng, radius_m), kinds)
+    shapes = [(kind, np.frombuffer(points).reshape(-1, 2)) for _, kind, _, points in rows]
+    distances = shape_distances(('substationPremise', point), shapes)
+    order = np.argsort(distances, kind='stable')
+    return [{'application_id': rows[i][0], 'kind': rows[i][1], 'distance_m': round(float(distances[i]), 2)}
+            for i in order[:limit] if distances[i] <= radius_m]
+
+
+def overlapping_shapes(conn, app_id, kind='cableRoute', tolerance_m=OVERLAP_TOLERANCE_M, limit=100):
+    """Other applications' shapes of the same kind within tolerance_m of this application's shape.
+
+    Returns None when the application has no indexed shape of that kind.
+    """
+    _parse_kinds([kind])
+    row = conn.execute('''
+        SELECT g.points, r.min_lat, r.max_lat, r.min_lng, r.max_lng
+        FROM application_geometries AS g JOIN application_geometries_rtree AS r ON r.id = g.id
+        WHERE g.application_id = ? AND g.kind = ?
+    ''', (app_id, kind)).fetchone()
+    if not row:
+        return None
+    points = np.frombuffer(row[0]).reshape(-1, 2)
+    rows = _candidates(conn, _bounding_box(*row[1:], tolerance_m), [kind], exclude=app_id)
+    shapes = [(other_kind, np.frombuffer(other).reshape(-1, 2)) for _, other_kind, _, other in rows]
+    distances = shape_distances((kind, points), shapes)
+    order = np.argsort(distances, kind='stable')
+    return [{'application_id': rows[i][0], 'distance_m': round(float(distances[i]), 2),
+             'length_m': round(rows[i][2], 2)}
+            for i in order[:limit] if distances[i] <= tolerance_m]
@@ -0,0 +1,53 @@
+"""gunicorn settings for the backend (override through the environment).
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is preloaded in the master process, which migrates the database and
+loads the quote files once before forking; each worker then starts its own
+email delivery thread. SQLite is single-writer, so a handful of workers with
+a few threads each is usually the sweet spot.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+# Read by the app (preloaded after this file) to share per-worker state, e.g. rate limits
+os.environ['WEB_CONCURRENCY'] = str(workers)
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Recycle workers after this many requests (0 disables)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+accesslog = '-' if os.environ.get('GUNICORN_ACCESS_LOG', '0') == '1' else None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Run the one-time startup work in the master, before any worker forks"""
+    from app import startup
+    from db import pool
+
+    startup()
+    # Workers open their own connections; the master does not need these
+    pool.close_all()
+
+
+def post_worker_init(worker):
+    from mailer import delivery_worker
+
+    delivery_worker.start()
+
+
+def worker_exit(server, worker):
+    """Finish in-flight email batches and flush queued login activity"""
+    from app import login_activity_log
+    from mailer import delivery_worker
+
+    delivery_worker.stop()
+    login_activity_log.stop()
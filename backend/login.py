@@ -0,0 +1,189 @@
+"""OTP login, logout and confirmation email handling shared by app.py and asgi.py.
+
+The functions take what the view read from the request and return
+(body, status, headers) for it to serialise, so the Flask and Quart routes
+stay thin wrappers over one implementation. Everything here blocks (SQLite,
+DNS lookups, the outbound queue): asgi.py calls it through run_blocking.
+"""
+import secrets
+import string
+import time
+
+from email_validator import validate_email, EmailNotValidError
+
+from auth import InvalidToken, token_signer
+from email_templates import render_otp_email, render_confirmation_email
+from login_logs import LoginActivityLogger
+from mailer import enqueue_email
+from metrics import EMAIL_ENQUEUE_SECONDS
+from otp_store import otp_store, NOT_FOUND, EXPIRED, BLOCKED, INVALID
+from rate_limit import rate_limiter, RATE_LIMIT_ENABLED
+
+# Login activity log: JSON lines written by a background listener thread
+login_activity_log = LoginActivityLogger()
+
+
+def log_login_activity(activity_type, email, ip_address, user_agent, status, details=None):
+    """Log login-related activities"""
+    login_activity_log.log(activity_type, email, ip_address, user_agent, status, details)
+
+
+def generate_otp():
+    """Generate a 6-digit OTP"""
+    return ''.join(secrets.choice(string.digits) for _ in range(6))
+
+
+def queue_email(template, recipient, subject, message, wake=True):
+    """Put a rendered message on the outbound queue, timing the enqueue per template"""
+    started = time.perf_counter()
+    email_id = enqueue_email(recipient, subject, message, wake=wake)
+    EMAIL_ENQUEUE_SECONDS.observe(time.perf_counter() - started, template)
+    return email_id
+
+
+def rate_limited(activity_type, email, ip_address, user_agent, hits, guards=()):
+    """429 result when any rate limit is exceeded, else None (and the hits are counted)"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    exceeded = rate_limiter.allow(hits, guards)
+    if exceeded is None:
+        return None
+    rule, retry_after = exceeded
+    log_login_activity(activity_type, email, ip_address, user_agent, 'RATE_LIMITED', {'rule': rule, 'retry_after': retry_after})
+    return ({'error': 'Too many requests, please try again later', 'retry_after': retry_after}, 429,
+            {'Retry-After': str(retry_after)})
+
+
+def request_otp(data, ip_address, user_agent, wake=True):
+    """Generate, store and email a one-time passcode (POST /api/send-otp)"""
+    email = ''
+    try:
+        email = (data or {}).get('email', '').strip().lower()
+
+        # Throttle before validation and OTP generation so floods never reach SMTP
+        hits = [('send_otp_global', '*'), ('send_otp_ip', ip_address)]
+        if email:
+            hits.append(('send_otp_email', email))
+        limited = rate_limited('OTP_REQUEST', email, ip_address, user_agent, hits)
+        if limited:
+            return limited
+
+        if not email:
+            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Email is required'})
+            return {'error': 'Email is required'}, 400, {}
+
+        try:
+            email = validate_email(email).email
+        except EmailNotValidError:
+            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Invalid email address'})
+            return {'error': 'Invalid email address'}, 400, {}
+
+        # Store OTP with expiration time (10 minutes)
+        otp = generate_otp()
+        otp_store.put(email, otp, ip_address, user_agent)
+
+        try:
+            email_id = queue_email('otp', *render_otp_email(email, otp), wake=wake)
+        except Exception as e:
+            print(f"Error queueing email: {e}")
+            log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'FAILED', {'error': 'Failed to send email'})
+            return {'error': 'Failed to send OTP email'}, 500, {}
+
+        print(f"Email queued for {email} (queue id {email_id})")
+        log_login_activity('OTP_SENT', email, ip_address, user_agent, 'SUCCESS', {'otp_length': len(otp)})
+        return {'message': 'OTP sent successfully'}, 200, {}
+
+    except Exception as e:
+        log_login_activity('OTP_REQUEST', email, ip_address, user_agent, 'ERROR', {'error': str(e)})
+        print(f"Error in send_otp: {e}")
+        return {'error': f'Internal server error: {str(e)}'}, 500, {}
+
+
+def check_otp(data, ip_address, user_agent):
+    """Consume a passcode and issue a session token (POST /api/verify-otp)"""
+    email = ''
+    try:
+        data = data or {}
+        email = data.get('email', '').strip().lower()
+        otp = data.get('otp', '').strip()
+
+        hits = [('verify_otp_global', '*'), ('verify_otp_ip', ip_address)]
+        if email:
+            hits.append(('verify_otp_email', email))
+        limited = rate_limited('LOGIN_ATTEMPT', email, ip_address, user_agent, hits,
+                               guards=[('login_failures_ip', ip_address)])
+        if limited:
+            return limited
+
+        if not email or not otp:
+            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'Missing email or OTP'})
+            return {'error': 'Email and OTP are required'}, 400, {}
+
+        # Check expiry and attempt limit and consume the OTP in one atomic step
+        outcome, attempts = otp_store.verify(email, otp)
+        if outcome in (NOT_FOUND, EXPIRED, BLOCKED, INVALID):
+            rate_limiter.record('login_failures_ip', ip_address)
+
+        if outcome == NOT_FOUND:
+            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'OTP not found or expired'})
+            return {'error': 'OTP not found or expired'}, 400, {}
+
+        if outcome == EXPIRED:
+            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'OTP expired'})
+            return {'error': 'OTP has expired'}, 400, {}
+
+        if outcome == BLOCKED:
+            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'BLOCKED', {'error': 'Too many failed attempts', 'attempts': attempts})
+            return {'error': 'Too many failed attempts'}, 400, {}
+
+        if outcome == INVALID:
+            log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'FAILED', {'error': 'Invalid OTP', 'attempt': attempts})
+            return {'error': 'Invalid OTP'}, 400, {}
+
+        # Issue a signed, expiring session token
+        token = token_signer.issue(email)
+        log_login_activity('LOGIN_SUCCESS', email, ip_address, user_agent, 'SUCCESS', {'token_length': len(token)})
+        return {
+            'message': 'Authentication successful',
+            'token': token,
+            'email': email,
+            'expires_in': token_signer.ttl
+        }, 200, {}
+
+    except Exception as e:
+        log_login_activity('LOGIN_ATTEMPT', email, ip_address, user_agent, 'ERROR', {'error': str(e)})
+        return {'error': 'Internal server error'}, 500, {}
+
+
+def end_session(token, ip_address, user_agent):
+    """Revoke the presented session token (POST /api/logout)"""
+    if not token:
+        return {'error': 'Authentication required'}, 401, {}
+    try:
+        payload = token_signer.verify(token)
+    except InvalidToken as e:
+        return {'error': str(e)}, 401, {}
+
+    token_signer.revoke(payload)
+    log_login_activity('LOGOUT', payload['sub'], ip_address, user_agent, 'SUCCESS')
+    return {'message': 'Logged out successfully'}, 200, {}
+
+
+def queue_confirmation_email(data, wake=True):
+    """Email the applicant that their application was submitted (POST /api/send-confirmation-email)"""
+    try:
+        data = data or {}
+        email = data.get('email')
+        if not email:
+            return {'error': 'Email is required'}, 400, {}
+
+        msg = render_confirmation_email(email, data.get('applicationNumber'), data.get('applicationId'),
+                                        data.get('submittedDate'), data.get('submittedTime'))
+        email_id = queue_email('confirmation', *msg, wake=wake)
+
+        print(f"Confirmation email queued for {email} (queue id {email_id})")
+        return {'message': 'Confirmation email queued successfully', 'queue_id': email_id}, 200, {}
+
+    except Exception as e:
+        print(f"Error sending confirmation email: {e}")
+        return {'error': 'Failed to send confirmation email'}, 500, {}
@@ -0,0 +1,455 @@
+import atexit
+import bisect
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines run a single process
+    fcntl = None
+
+# Login activity log location and query tuning (override through the environment)
+LOG_DIR = os.environ.get('LOG_DIR', os.path.join(os.path.dirname(__file__), 'logs'))
+LOGIN_LOG_FILE = os.path.join(LOG_DIR, 'login_activities.log')
+# Rotate when the file exceeds this size or is older than LOGIN_LOG_ROTATE_SECONDS (0 disables)
+LOGIN_LOG_MAX_BYTES = int(os.environ.get('LOGIN_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOGIN_LOG_ROTATE_SECONDS = int(os.environ.get('LOGIN_LOG_ROTATE_SECONDS', str(24 * 60 * 60)))
+LOGIN_LOG_BACKUP_COUNT = int(os.environ.get('LOGIN_LOG_BACKUP_COUNT', '14'))
+LOGIN_LOG_CONSOLE = os.environ.get('LOGIN_LOG_CONSOLE', '1') == '1'
+# One index entry per this many lines
+LOG_INDEX_INTERVAL = int(os.environ.get('LOG_INDEX_INTERVAL', '1000'))
+LOG_READ_BLOCK_SIZE = 64 * 1024
+MAX_LOG_QUERY_LIMIT = 1000
+
+# Every line is a JSON object whose first key is a sortable
+# '%Y-%m-%dT%H:%M:%S.mmm' timestamp, so it can be read without parsing
+JSON_TIMESTAMP_PREFIX = b'{"timestamp":"'
+TIMESTAMP_LENGTH = 23
+INDEX_VERSION = 2
+
+LOG_FIELDS = ('activity_type', 'email', 'ip_address', 'user_agent', 'status', 'details')
+
+
+class JSONLineFormatter(logging.Formatter):
+    """One JSON object per line from the record's ``activity`` dict"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S')
+        entry = {'timestamp': f'{timestamp}.{int(record.msecs):03d}', 'level': record.levelname}
+        activity = getattr(record, 'activity', None)
+        if activity is None:
+            entry['message'] = record.getMessage()
+        else:
+            entry.update(activity)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _gzip_rotator(source, destination):
+    with open(source, 'rb') as f_in, gzip.open(destination, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """Size- and age-based rotation; backups are gzipped as ``<file>.N.gz``.
+
+    Safe with several worker processes appending to the same file: rotation
+    is serialised with a lock file, and a handler whose file was rotated by
+    another process reopens the new file instead of rotating again.
+    """
+
+    def __init__(self, filename, max_bytes=LOGIN_LOG_MAX_BYTES, rotate_seconds=LOGIN_LOG_ROTATE_SECONDS,
+                 backup_count=LOGIN_LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.namer = _gzip_namer
+        self.rotator = _gzip_rotator
+        self.lock_path = self.baseFilename + '.lock'
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self):
+        """Rotation deadline counted from the file's first record.
+
+        Not the mtime: every append moves that forward, so a busy log that
+        outlives restarts would never rotate by age.
+        """
+        if not self.rotate_seconds:
+            return None
+        return self._started_at() + self.rotate_seconds
+
+    def _started_at(self):
+        """Time of the first record in the current file, or now if it is empty or unreadable"""
+        try:
+            with open(self.baseFilename, 'rb') as f:
+                first_line = f.readline()
+            return datetime.strptime(line_timestamp(first_line), '%Y-%m-%dT%H:%M:%S.%f').timestamp()
+        except (OSError, ValueError):
+            return time.time()
+
+    def _rotated_elsewhere(self):
+        """True when the path no longer points at the file this handler has open"""
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        opened = os.fstat(self.stream.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
+
+    def _reopen(self):
+        self.stream.close()
+        self.stream = self._open()
+        self.rollover_at = self._next_rollover()
+
+    def emit(self, record):
+        if self._rotated_elsewhere():
+            self._reopen()
+        super().emit(record)
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited for the lock
+            if self._rotated_elsewhere():
+                self._reopen()
+                return
+            super().doRollover()
+        if self.rotate_seconds:
+            self.rollover_at = time.time() + self.rotate_seconds
+
+    def rotate_now(self):
+        """Rotate immediately; returns the compressed backup path, or None if there was nothing to rotate"""
+        self.acquire()
+        try:
+            if not os.path.exists(self.baseFilename) or not os.path.getsize(self.baseFilename):
+                return None
+            if self._rotated_elsewhere():
+                self._reopen()
+            self.doRollover()
+            return self.rotation_filename(f'{self.baseFilename}.1')
+        finally:
+            self.release()
+
+
+class LoginActivityLogger:
+    """Structured login activity logging that keeps disk I/O off the request thread.
+
+    Request handlers only put records on an in-memory queue; a QueueListener
+    thread formats them as JSON lines into the rotating file (and, optionally,
+    a console summary).
+    """
+
+    def __init__(self, path=LOGIN_LOG_FILE, console=LOGIN_LOG_CONSOLE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file_handler = CompressingRotatingFileHandler(path)
+        self.file_handler.setFormatter(JSONLineFormatter())
+        handlers = [self.file_handler]
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter('[LOGIN LOG] %(message)s'))
+            handlers.append(console_handler)
+
+        self.handlers = handlers
+        self.logger = logging.getLogger('login_activities')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self._setup_queue()
+        self.start()
+        atexit.register(self.stop)
+        # The listener thread does not survive fork(); give each worker its own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _setup_queue(self):
+        self.queue = queue.SimpleQueue()
+        self.logger.handlers = [QueueHandler(self.queue)]
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._running = False
+
+    def _after_fork(self):
+        self._setup_queue()
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if not self._running:
+                self.listener.start()
+                self._running = True
+
+    def stop(self):
+        """Drain the queue and stop the listener thread"""
+        with self._lock:
+            if self._running:
+                self.listener.stop()
+                self._running = False
+
+    def log(self, activity_type, email, ip_address, user_agent, status, details=None):
+        activity = {
+            'activity_type': activity_type.upper(),
+            'email': email,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'status': status,
+            'details': details or {}
+        }
+        summary = f"{activity['activity_type']} | Email: {email} | IP: {ip_address} | Status: {status}"
+        if details:
+            summary += f" | Details: {details}"
+        self.logger.info(summary, extra={'activity': activity})
+
+    def rotate(self):
+        """Flush queued records, then rotate the file; returns the backup path or None"""
+        self.stop()
+        try:
+            return self.file_handler.rotate_now()
+        finally:
+            self.start()
+
+
+def line_timestamp(line):
+    """Sortable timestamp of a raw log line without decoding the whole line"""
+    if line.startswith(JSON_TIMESTAMP_PREFIX):
+        start = len(JSON_TIMESTAMP_PREFIX)
+        return line[start:start + TIMESTAMP_LENGTH].decode('utf-8', 'replace')
+    # Lines written before the switch to JSON: '%Y-%m-%d %H:%M:%S,mmm - ...'
+    return line[:TIMESTAMP_LENGTH].decode('utf-8', 'replace').replace(' ', 'T', 1).replace(',', '.')
+
+
+def parse_line(line):
+    """Parse a log line into its fields; None if it does not parse"""
+    line = line.rstrip('\r\n')
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        for name in LOG_FIELDS:
+            entry.setdefault(name, None)
+        return entry
+    return parse_legacy_line(line)
+
+
+def parse_legacy_line(line):
+    """Split an old 'timestamp - level - message' line into the same fields"""
+    parts = line.split(' - ', 2)
+    if len(parts) < 3:
+        return None
+    timestamp, level, message = parts
+    entry = {'timestamp': timestamp.replace(' ', 'T', 1).replace(',', '.'), 'level': level}
+    entry.update(dict.fromkeys(LOG_FIELDS))
+
+    # Message format: 'ACTIVITY | Email: x | IP: y | Status: z[ | Details: {...}]'
+    fields = message.split(' | ', 4)
+    entry['activity_type'] = fields[0]
+    for field in fields[1:]:
+        name, _, value = field.partition(': ')
+        if name == 'Email':
+            entry['email'] = value
+        elif name == 'IP':
+            entry['ip_address'] = value
+        elif name == 'Status':
+            entry['status'] = value
+        elif name == 'Details':
+            entry['details'] = value
+    return entry
+
+
+def normalize_timestamp(value):
+    """Accept '2024-01-31 09:00' as well as ISO-8601 ('2024-01-31T09:00')"""
+    if not value:
+        return None
+    return value.replace(' ', 'T', 1).rstrip('Z')
+
+
+def matches(entry, filters):
+    for name, expected in filters.items():
+        value = entry.get(name)
+        if value is None or value.lower() != expected:
+            return False
+    return True
+
+
+def iter_lines_forward(f, start, end):
+    """Yield (offset, line) for complete lines in [start, end)"""
+    f.seek(start)
+    offset = start
+    while offset < end:
+        line = f.readline()
+        if not line.endswith(b'\n'):
+            break
+        yield offset, line
+        offset += len(line)
+
+
+def iter_lines_backward(f, end, block_size=LOG_READ_BLOCK_SIZE):
+    """Yield (offset, line) newest first, reading fixed-size blocks back from ``end``.
+
+    ``end`` must sit on a line boundary; memory use is bounded by the block
+    size plus the longest line.
+    """
+    position = end
+    remainder = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + remainder).split(b'\n')
+        remainder = lines[0]
+        offset = position + len(remainder) + 1
+        complete = []
+        for line in lines[1:]:
+            complete.append((offset, line))
+            offset += len(line) + 1
+        for offset, line in reversed(complete):
+            if line:
+                yield offset, line
+    if remainder:
+        yield 0, remainder
+
+
+class LoginLogIndex:
+    """Persisted sparse index over the login log: every Nth line's timestamp and byte offset.
+
+    The index is stored next to the log as JSON and extended incrementally,
+    so each query only scans lines appended since the previous one. It is
+    rebuilt when the log is replaced or truncated.
+    """
+
+    def __init__(self, path=LOGIN_LOG_FILE, interval=LOG_INDEX_INTERVAL):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _empty(self, inode=None):
+        return {'version': INDEX_VERSION, 'inode': inode, 'interval': self.interval, 'indexed_size': 0, 'line_count': 0,
+                'timestamps': [], 'offsets': []}
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                state = json.load(f)
+            if state.get('version') == INDEX_VERSION and state.get('interval') == self.interval:
+                return state
+        except (OSError, ValueError):
+            pass
+        return self._empty()
+
+    def _save(self, state):
+        temp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(temp_path, self.index_path)
+
+    def refresh(self):
+        """Bring the index up to date with the log; returns a snapshot of it"""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._state = self._empty()
+                return self._state
+            state = self._state or self._load()
+            if state['inode'] != stat.st_ino or stat.st_size < state['indexed_size']:
+                state = self._empty(stat.st_ino)
+
+            indexed_size = state['indexed_size']
+            if stat.st_size > indexed_size:
+                with open(self.path, 'rb') as f:
+                    for offset, line in iter_lines_forward(f, indexed_size, stat.st_size):
+                        if state['line_count'] % self.interval == 0:
+                            state['timestamps'].append(line_timestamp(line))
+                            state['offsets'].append(offset)
+                        state['line_count'] += 1
+                        state['indexed_size'] = offset + len(line)
+                if state['indexed_size'] != indexed_size:
+                    self._save(state)
+            self._state = state
+            # Copy the lists too: later refreshes append to them in place
+            return {**state, 'timestamps': list(state['timestamps']), 'offsets': list(state['offsets'])}
+
+    def start_offset(self, state, since):
+        """Offset of an indexed line at or before the first line >= ``since``"""
+        position = bisect.bisect_left(state['timestamps'], since) - 1
+        return state['offsets'][position] if position >= 0 else 0
+
+    def end_offset(self, state, until):
+        """Offset of an indexed line after the last line <= ``until``"""
+        position = bisect.bisect_right(state['timestamps'], until)
+        return state['offsets'][position] if position < len(state['offsets']) else state['indexed_size']
+
+
+login_log_index = LoginLogIndex()
+
+
+def query_login_logs(limit=100, cursor=None, order='desc', since=None, until=None, filters=None,
+                     index=login_log_index):
+    """One page of parsed log entries plus the cursor for the next page.
+
+    ``order='desc'`` tails the log from EOF (newest first); ``'asc'`` scans
+    forward from ``since``. ``cursor`` is the byte offset returned as
+    ``next_cursor`` by the previous page. Filters match case-insensitively
+    on activity_type, status, email and ip_address.
+    """
+    state = index.refresh()
+    since = normalize_timestamp(since)
+    until = normalize_timestamp(until)
+    filters = {name: str(value).lower() for name, value in (filters or {}).items() if value}
+    entries = []
+    next_cursor = None
+    if not state['indexed_size']:
+        return entries, next_cursor, state
+
+    with open(index.path, 'rb') as f:
+        if order == 'asc':
+            start = cursor if cursor is not None else (index.start_offset(state, since) if since else 0)
+            lines = iter_lines_forward(f, start, state['indexed_size'])
+        else:
+            end = cursor if cursor is not None else (index.end_offset(state, until) if until else
+                                                     state['indexed_size'])
+            lines = iter_lines_backward(f, min(end, state['indexed_size']))
+
+        for offset, line in lines:
+            entry = parse_line(line.decode('utf-8', 'replace'))
+            if entry is None:
+                continue
+            timestamp = entry['timestamp']
+            if order == 'asc':
+                if since and timestamp < since:
+                    continue
+                if until and timestamp[:len(until)] > until:
+                    break
+            else:
+                if until and timestamp[:len(until)] > until:
+                    continue
+                if since and timestamp < since:
+                    break
+            if not matches(entry, filters):
+                continue
+            if len(entries) == limit:
+                # The next page resumes at this line: forward from its start,
+                # or backward from just past its newline
+                next_cursor = offset if order == 'asc' else offset + len(line) + 1
+                break
+            entries.append(entry)
+    return entries, next_cursor, state
@@ -0,0 +1,481 @@
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+
+from db import pool
+from metrics import SMTP_SEND_SECONDS
+
+# Email configuration (override through the environment)
+# Sender credentials have no defaults; set EMAIL_PASSWORD= (empty) for a server without login
+EMAIL_ADDRESS = os.environ.get('EMAIL_ADDRESS')
+EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+SMTP_SERVER = os.environ.get('SMTP_SERVER', "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+
+# Delivery worker tuning
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '5'))
+EMAIL_RETRY_MAX_SECONDS = float(os.environ.get('EMAIL_RETRY_MAX_SECONDS', '900'))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+# Close the SMTP session after this long without traffic
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', '60'))
+# Rows left in 'sending' this long (e.g. after a crash) are picked up again. Each
+# row's claim is renewed just before it is sent, so this only has to outlast one
+# message: connect, STARTTLS, login and the SMTP commands of up to two attempts
+EMAIL_CLAIM_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_CLAIM_TIMEOUT_SECONDS',
+                                                   str(max(300.0, 16 * SMTP_TIMEOUT))))
+
+
+class EmailNotConfigured(RuntimeError):
+    """EMAIL_ADDRESS or EMAIL_PASSWORD is missing from the environment"""
+
+
+def require_email_settings():
+    missing = [name for name, value in (('EMAIL_ADDRESS', EMAIL_ADDRESS), ('EMAIL_PASSWORD', EMAIL_PASSWORD))
+               if value is None]
+    if missing:
+        raise EmailNotConfigured(f"{' and '.join(missing)} must be set in the environment to send email")
+
+
+# Failures that mean the SMTP session itself is unusable
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                     smtplib.SMTPAuthenticationError, EmailNotConfigured, OSError)
+
+
+def enqueue_email(recipient, subject, message, wake=True):
+    """Persist a serialised message in the outbound queue and wake the delivery worker.
+
+    Returns the queue row id. Pass ``wake=False`` when another worker (such
+    as the asyncio one) drains the queue. Raises EmailNotConfigured when the
+    sender credentials are not set, rather than queueing mail that cannot go.
+    """
+    require_email_settings()
+    with pool.connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO outbound_emails (recipient, subject, message, next_attempt_at)
+            VALUES (?, ?, ?, ?)
+        ''', (recipient, subject, message, time.time()))
+        conn.commit()
+        email_id = cursor.lastrowid
+    if wake:
+        delivery_worker.wake()
+    return email_id
+
+
+def retry_delay(attempts):
+    """Exponential backoff for the given number of failed attempts"""
+    return min(EMAIL_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), EMAIL_RETRY_MAX_SECONDS)
+
+
+def claim_batch(conn, batch_size):
+    """Mark up to ``batch_size`` due rows as 'sending' and return them as dicts.
+
+    Runs inside ``BEGIN IMMEDIATE`` so several worker processes can share
+    the queue without sending a message twice. Each row carries the
+    ``claimed_at`` stamp that renew_claim and record_results check.
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''
+            SELECT id, recipient, message, attempts FROM outbound_emails
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'sending' AND claimed_at < ?)
+            ORDER BY id LIMIT ?
+        ''', (now, now - EMAIL_CLAIM_TIMEOUT_SECONDS, batch_size)).fetchall()
+        conn.executemany(
+            "UPDATE outbound_emails SET status = 'sending', claimed_at = ? WHERE id = ?",
+            [(now, row['id']) for row in rows]
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return [dict(row, claimed_at=now) for row in rows]
+
+
+def renew_claim(conn, row):
+    """Re-stamp a claimed row just before sending it.
+
+    Returns False when the claim timed out and another worker has taken the
+    row over since; the caller must then skip it.
+    """
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE outbound_emails SET claimed_at = ? WHERE id = ? AND status = 'sending' AND claimed_at = ?
+    ''', (now, row['id'], row['claimed_at']))
+    conn.commit()
+    if cursor.rowcount != 1:
+        return False
+    row['claimed_at'] = now
+    return True
+
+
+def record_results(conn, rows, errors):
+    """Mark rows sent, or schedule a retry (or give up) for those with an entry in ``errors``.
+
+    Rows another worker has claimed since are left alone. Returns the number
+    of rows that failed permanently.
+    """
+    sent = []
+    retries = []
+    for row in rows:
+        error = errors.get(row['id'])
+        if error is None:
+            sent.append((row['id'], row['claimed_at']))
+            continue
+        attempts = row['attempts'] + 1
+        status = 'failed' if attempts >= EMAIL_MAX_ATTEMPTS else 'pending'
+        retries.append((status, attempts, time.time() + retry_delay(attempts), str(error),
+                        row['id'], row['claimed_at']))
+
+    conn.executemany('''
+        UPDATE outbound_emails SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+        WHERE id = ? AND claimed_at = ?
+    ''', sent)
+    conn.executemany('''
+        UPDATE outbound_emails SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+        WHERE id = ? AND claimed_at = ?
+    ''', retries)
+    conn.commit()
+    return sum(1 for retry in retries if retry[0] == 'failed')
+
+
+def queue_counts():
+    with pool.connection() as conn:
+        return dict(conn.execute('SELECT status, COUNT(*) FROM outbound_emails GROUP BY status').fetchall())
+
+
+class EmailDeliveryWorker:
+    """Background thread that drains outbound_emails over one SMTP session.
+
+    Rows are claimed in batches inside ``BEGIN IMMEDIATE`` so several worker
+    processes can share the queue without sending a message twice.
+    """
+
+    def __init__(self, batch_size=EMAIL_BATCH_SIZE, poll_seconds=EMAIL_POLL_SECONDS):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._smtp = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.connects = 0
+
+    def start(self):
+        """Start the worker thread once per process (threads do not survive fork)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._smtp = None
+            self._thread = threading.Thread(target=self._run, name='email-delivery', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._close_smtp()
+
+    def wake(self):
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delivered = self.deliver_batch()
+            except Exception as e:
+                print(f"Email delivery worker error: {e}")
+                delivered = 0
+            if delivered:
+                continue
+            if self._smtp and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+                self._close_smtp()
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def _connect_smtp(self):
+        require_email_settings()
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if EMAIL_PASSWORD:
+            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self.connects += 1
+        return server
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _send(self, recipient, message):
+        """Send over the persistent session, reconnecting once if it dropped"""
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = self._connect_smtp()
+            try:
+                self._smtp.sendmail(EMAIL_ADDRESS, recipient, message)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def deliver_batch(self):
+        """Claim and send one batch; returns the number of rows processed.
+
+        A pooled connection is only held for the claim, each renewal and the
+        final bookkeeping, never across an SMTP round trip.
+        """
+        with pool.connection() as conn:
+            rows = claim_batch(conn, self.batch_size)
+        if not rows:
+            return 0
+
+        owned = []
+        errors = {}
+        session_error = None
+        for row in rows:
+            if session_error is not None:
+                owned.append(row)
+                errors[row['id']] = session_error
+                continue
+            with pool.connection() as conn:
+                if not renew_claim(conn, row):
+                    continue
+            owned.append(row)
+            started = time.perf_counter()
+            try:
+                self._send(row['recipient'], row['message'])
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, 'sent')
+            except Exception as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, 'error')
+                print(f"Error sending email to {row['recipient']}: {e}")
+                errors[row['id']] = e
+                if isinstance(e, CONNECTION_ERRORS):
+                    # The session is unusable; back off the rest of the batch too
+                    self._close_smtp()
+                    session_error = e
+
+        with pool.connection() as conn:
+            self.failed += record_results(conn, owned, errors)
+        self.sent += len(owned) - len(errors)
+        return len(rows)
+
+    @property
+    def connected(self):
+        """Whether an SMTP session is currently open"""
+        return self._smtp is not None
+
+    @property
+    def running(self):
+        """Whether the worker is draining the queue; needs no database connection"""
+        return bool(self._thread and self._thread.is_alive())
+
+    def stats(self):
+        return {
+            'queue': queue_counts(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'smtp_connects': self.connects,
+            'running': self.running
+        }
+
+
+class AsyncEmailDeliveryWorker:
+    """asyncio task that drains outbound_emails over one aiosmtplib session.
+
+    Used by the ASGI variant (asgi.py) in place of EmailDeliveryWorker: SMTP
+    I/O runs on the event loop and the short SQLite claim/record steps run
+    in the default executor. Shares the queue semantics (batch claims,
+    retries with backoff) with the threaded worker.
+    """
+
+    def __init__(self, batch_size=EMAIL_BATCH_SIZE, poll_seconds=EMAIL_POLL_SECONDS):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._smtp = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.connects = 0
+
+    def start(self):
+        """Start the delivery task on the running event loop"""
+        import asyncio
+
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+            self._task = None
+        await self._close_smtp()
+
+    def wake(self):
+        """Safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        import asyncio
+
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Email delivery worker error: {e}")
+                delivered = 0
+            if delivered:
+                continue
+            if self._smtp and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+                await self._close_smtp()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _connect_smtp(self):
+        import aiosmtplib
+
+        require_email_settings()
+        server = aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT, timeout=SMTP_TIMEOUT,
+                                 start_tls=SMTP_STARTTLS)
+        await server.connect()
+        if EMAIL_PASSWORD:
+            await server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self.connects += 1
+        return server
+
+    async def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                await self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    async def _send(self, recipient, message):
+        """Send over the persistent session, reconnecting once if it dropped"""
+        import aiosmtplib
+
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = await self._connect_smtp()
+            try:
+                await self._smtp.sendmail(EMAIL_ADDRESS, [recipient], message)
+                self._last_used = time.monotonic()
+                return
+            except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+                self._smtp = None
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _claim(batch_size):
+        with pool.connection() as conn:
+            return claim_batch(conn, batch_size)
+
+    @staticmethod
+    def _renew(row):
+        with pool.connection() as conn:
+            return renew_claim(conn, row)
+
+    @staticmethod
+    def _record(rows, errors):
+        with pool.connection() as conn:
+            return record_results(conn, rows, errors)
+
+    async def deliver_batch(self):
+        """Claim and send one batch; returns the number of rows processed"""
+        import aiosmtplib
+
+        loop = self._loop
+        rows = await loop.run_in_executor(None, self._claim, self.batch_size)
+        if not rows:
+            return 0
+
+        owned = []
+        errors = {}
+        session_error = None
+        for row in rows:
+            if session_error is not None:
+                owned.append(row)
+                errors[row['id']] = session_error
+                continue
+            if not await loop.run_in_executor(None, self._renew, row):
+                continue
+            owned.append(row)
+            started = time.perf_counter()
+            try:
+                await self._send(row['recipient'], row['message'])
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, 'sent')
+            except Exception as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, 'error')
+                print(f"Error sending email to {row['recipient']}: {e}")
+                errors[row['id']] = e
+                if isinstance(e, (aiosmtplib.SMTPConnectError, aiosmtplib.SMTPServerDisconnected,
+                                  aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPTimeoutError,
+                                  EmailNotConfigured, OSError)):
+                    # The session is unusable; back off the rest of the batch too
+                    await self._close_smtp()
+                    session_error = e
+
+        self.failed += await loop.run_in_executor(None, self._record, owned, errors)
+        self.sent += len(owned) - len(errors)
+        return len(rows)
+
+    @property
+    def connected(self):
+        """Whether an SMTP session is currently open"""
+        return self._smtp is not None
+
+    @property
+    def running(self):
+        """Whether the worker is draining the queue; needs no database connection"""
+        return bool(self._task and not self._task.done())
+
+    def stats(self):
+        return {
+            'queue': queue_counts(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'smtp_connects': self.connects,
+            'running': self.running
+        }
+
+
+delivery_worker = EmailDeliveryWorker()
@@ -0,0 +1,509 @@
+import bisect
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as SampleCounter
+
+from login_logs import LOG_DIR
+
+# Metrics configuration (override through the environment)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(
+    os.environ.get('DATA_DIR', os.path.join(os.path.dirname(__file__), 'data')), 'metrics'))
+# How often each worker process publishes its series for /api/metrics to merge
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+
+# Sampling profiler for slow requests; also switchable at runtime through set_profiler()
+PROFILE_SLOW_REQUESTS = os.environ.get('PROFILE_SLOW_REQUESTS', '0') == '1'
+PROFILE_THRESHOLD_MS = float(os.environ.get('PROFILE_THRESHOLD_MS', '500'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(LOG_DIR, 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+SMTP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PROFILER_SETTINGS_FILE = os.path.join(METRICS_DIR, 'profiler.json')
+SNAPSHOT_PATTERN = re.compile(r'^(\d+)\.json$')
+
+_lock = threading.Lock()
+
+
+class Counter:
+    """Monotonic counter per label set"""
+    type = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def dump(self):
+        with _lock:
+            series = [[list(key), value] for key, value in self.series.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels), 'series': series}
+
+
+class Histogram(Counter):
+    """Bucketed observations per label set; buckets are cumulated only when rendered"""
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.series.get(label_values)
+            if counts is None:
+                # One slot per bucket, one for +Inf, then the running sum
+                counts = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def dump(self):
+        with _lock:
+            series = [[list(key), list(counts)] for key, counts in self.series.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels), 'series': series,
+                'buckets': list(self.buckets)}
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to build the response, by route',
+                            ('method', 'route', 'status'))
+REQUEST_QUERIES = Histogram('http_request_sqlite_queries', 'SQLite statements executed per request',
+                            ('method', 'route'), QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram('http_request_sqlite_seconds', 'Time spent in SQLite per request',
+                                  ('method', 'route'))
+SQLITE_QUERIES = Counter('sqlite_queries_total', 'SQLite statements executed, background work included')
+SQLITE_SECONDS = Counter('sqlite_query_seconds_total', 'Time spent executing SQLite statements')
+EMAIL_ENQUEUE_SECONDS = Histogram('email_enqueue_seconds', 'Time to write an outbound email to the delivery queue',
+                                  ('template',))
+SMTP_SEND_SECONDS = Histogram('smtp_send_seconds', 'Time to hand one message to the SMTP server',
+                              ('outcome',), SMTP_BUCKETS)
+SLOW_REQUEST_PROFILES = Counter('slow_request_profiles_total', 'Stack profiles written for slow requests')
+METRICS = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, SQLITE_QUERIES, SQLITE_SECONDS,
+           EMAIL_ENQUEUE_SECONDS, SMTP_SEND_SECONDS, SLOW_REQUEST_PROFILES)
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'query_seconds', 'profiled')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.profiled = False
+
+
+_request = contextvars.ContextVar('request_stats', default=None)
+_in_flight = 0
+_publisher_pid = None
+_process_gauges = []
+
+
+def record_query(seconds):
+    """Called by db.TimedConnection for every statement"""
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+    SQLITE_QUERIES.inc()
+    SQLITE_SECONDS.inc(amount=seconds)
+
+
+def add_process_gauges(collect):
+    """Register ``collect() -> [(name, help, type, [(labels dict, value)])]`` for per-process state.
+
+    The values are published with the rest of the process's series and
+    summed across worker processes.
+    """
+    _process_gauges.append(collect)
+
+
+def _sanitise(text):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', text).strip('_')[:80]
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests and keeps the samples of the slow ones.
+
+    Every request is sampled while the profiler is on, since whether it is
+    slow is only known at the end. A request that took longer than the
+    threshold has its samples written as collapsed stacks (one
+    ``frame;frame;frame count`` line per distinct stack, root first), the
+    input flamegraph.pl and speedscope take.
+    """
+
+    def __init__(self, enabled=PROFILE_SLOW_REQUESTS, threshold_ms=PROFILE_THRESHOLD_MS,
+                 interval_ms=PROFILE_INTERVAL_MS, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._active = {}
+        self._busy = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._labels = {}
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._active = {}
+            self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+            self._thread.start()
+
+    def start_request(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = SampleCounter()
+        self._busy.set()
+
+    def finish_request(self, label, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._busy.clear()
+        if samples and elapsed * 1000 >= self.threshold_ms:
+            try:
+                self._write(label, elapsed, samples)
+            except OSError as e:
+                print(f"Could not write request profile: {e}")
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+        return label
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        samples[self._collapse(frame)] += 1
+            del frames
+
+    def _write(self, label, elapsed, samples):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{_sanitise(label)}-{round(elapsed * 1000)}ms.folded"
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        SLOW_REQUEST_PROFILES.inc()
+        print(f"Slow request {label} took {elapsed * 1000:.0f} ms; stack samples written to {path}")
+
+        profiles = sorted(entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.folded'))
+        for old in profiles[:max(0, len(profiles) - self.max_files)]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+
+profiler = SlowRequestProfiler()
+_profiler_settings_mtime = None
+
+
+def set_profiler(enabled, threshold_ms=None):
+    """Switch slow-request profiling for every worker process (picked up within METRICS_FLUSH_SECONDS)"""
+    settings = {'enabled': bool(enabled),
+                'threshold_ms': profiler.threshold_ms if threshold_ms is None else float(threshold_ms)}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_atomic(PROFILER_SETTINGS_FILE, settings)
+    _apply_profiler_settings(settings)
+    return profiler_settings()
+
+
+def profiler_settings():
+    return {'enabled': profiler.enabled, 'threshold_ms': profiler.threshold_ms,
+            'interval_ms': profiler.interval * 1000, 'directory': profiler.directory}
+
+
+def _apply_profiler_settings(settings):
+    profiler.enabled = settings['enabled']
+    profiler.threshold_ms = settings['threshold_ms']
+
+
+def _load_profiler_settings():
+    global _profiler_settings_mtime
+    try:
+        mtime = os.stat(PROFILER_SETTINGS_FILE).st_mtime
+    except FileNotFoundError:
+        return
+    if mtime != _profiler_settings_mtime:
+        _profiler_settings_mtime = mtime
+        try:
+            with open(PROFILER_SETTINGS_FILE) as f:
+                _apply_profiler_settings(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring profiler settings: {e}")
+
+
+def start_request(profile=True):
+    """Begin timing the current request and attributing SQLite work to it.
+
+    Pass ``profile=False`` where requests do not own their thread (the
+    asyncio event loop), since the profiler samples by thread.
+    """
+    global _in_flight
+    if _publisher_pid != os.getpid():
+        _start_publisher()
+    stats = RequestStats()
+    _request.set(stats)
+    with _lock:
+        _in_flight += 1
+    if profile and profiler.enabled:
+        stats.profiled = True
+        profiler.start_request()
+
+
+def end_request(method, route, status):
+    """Record the current request started by start_request(); a no-op if there is none"""
+    global _in_flight
+    stats = _request.get()
+    if stats is None:
+        return
+    _request.set(None)
+    elapsed = time.perf_counter() - stats.started
+    REQUEST_SECONDS.observe(elapsed, method, route, str(status))
+    REQUEST_QUERIES.observe(stats.queries, method, route)
+    REQUEST_QUERY_SECONDS.observe(stats.query_seconds, method, route)
+    with _lock:
+        _in_flight -= 1
+    if stats.profiled:
+        profiler.finish_request(f'{method} {route}', elapsed)
+
+
+def _route():
+    from flask import request
+
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def init_app(app):
+    """Time every Flask request and count the SQLite statements it runs"""
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        start_request()
+
+    @app.after_request
+    def end_request_metrics(response):
+        from flask import request
+
+        end_request(request.method, _route(), response.status_code)
+        return response
+
+    @app.teardown_request
+    def abandon_request_metrics(exception=None):
+        # Requests that never reached after_request (an error while building the response)
+        from flask import request
+
+        if _request.get() is not None:
+            end_request(request.method, _route(), 500)
+
+
+def _write_atomic(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def snapshot():
+    """Every series of this process, JSON-serialisable"""
+    metrics = {metric.name: metric.dump() for metric in METRICS}
+    gauges = [('http_requests_in_flight', 'Requests being handled right now', 'gauge', [({}, _in_flight)])]
+    for collect in _process_gauges:
+        try:
+            gauges.extend(collect())
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+    for name, help_text, metric_type, samples in gauges:
+        labels = sorted({key for sample_labels, _ in samples for key in sample_labels})
+        metric = metrics.setdefault(name, {'type': metric_type, 'help': help_text, 'labels': labels, 'series': []})
+        # Two collectors reporting the same gauge (say, both email workers) add up in merge()
+        metric['series'].extend([[str(sample_labels.get(key, '')) for key in metric['labels']], value]
+                                for sample_labels, value in samples)
+    return {'pid': os.getpid(), 'metrics': metrics}
+
+
+def publish():
+    """Write this process's snapshot for the other workers' /api/metrics and pick up profiler settings"""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_atomic(os.path.join(METRICS_DIR, f'{os.getpid()}.json'), snapshot())
+        _load_profiler_settings()
+    except OSError as e:
+        print(f"Could not publish metrics: {e}")
+
+
+def _publish_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        publish()
+
+
+def _start_publisher():
+    """Publish this process's snapshot every METRICS_FLUSH_SECONDS, busy or idle (once per process)"""
+    global _publisher_pid
+    with _lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(target=_publish_forever, name='metrics-publisher', daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect_snapshots():
+    """This process's snapshot plus the latest one from every other live worker"""
+    publish()
+    snapshots = []
+    for entry in os.scandir(METRICS_DIR):
+        match = SNAPSHOT_PATTERN.match(entry.name)
+        if not match:
+            continue
+        if not _alive(int(match.group(1))):
+            # An exited worker: its counters leave with it, which Prometheus treats as a reset
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(entry.path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def merge(snapshots):
+    """Sum every series across processes; histograms bucket by bucket"""
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap['metrics'].items():
+            target = merged.setdefault(name, {**metric, 'series': {}})
+            for label_values, value in metric['series']:
+                key = tuple(label_values)
+                current = target['series'].get(key)
+                if current is None:
+                    target['series'][key] = value
+                elif isinstance(value, list):
+                    target['series'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['series'][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(metrics):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric['series']):
+            value = metric['series'][key]
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_labels(metric['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f"{name}_bucket{_labels(metric['labels'], key, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(metric['labels'], key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def render_metrics(global_gauges=()):
+    """Exposition of every worker's series plus ``global_gauges`` read once at scrape time"""
+    merged = merge(collect_snapshots())
+    for name, help_text, metric_type, samples in global_gauges:
+        labels = sorted({key for sample_labels, _ in samples for key in sample_labels})
+        merged[name] = {'type': metric_type, 'help': help_text, 'labels': labels,
+                        'series': {tuple(str(sample_labels.get(key, '')) for key in labels): value
+                                   for sample_labels, value in samples}}
+    return render(merged)
+
+
+def clear_snapshots():
+    """Forget published snapshots (at startup, so a recycled pid cannot revive an old worker's series)"""
+    if os.path.isdir(METRICS_DIR):
+        for entry in os.scandir(METRICS_DIR):
+            if SNAPSHOT_PATTERN.match(entry.name):
+                os.remove(entry.path)
+
+
+def _reset_after_fork():
+    """A forked worker starts from zero rather than with a copy of the master's series"""
+    global _lock, _in_flight
+    _lock = threading.Lock()
+    for metric in METRICS:
+        metric.series = {}
+    _in_flight = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
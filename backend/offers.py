@@ -0,0 +1,525 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+
+from db import DATA_DIR
+from estimator import SQL_IN_CHUNK_SIZE, application_load_features
+from quotations import parse_kva
+
+# Offer document configuration (override through the environment)
+OFFER_CACHE_DIR = os.environ.get('OFFER_CACHE_DIR', os.path.join(DATA_DIR, 'offers'))
+OFFER_WORKERS = int(os.environ.get('OFFER_WORKERS', str(os.cpu_count() or 1)))
+OFFER_VALIDITY_DAYS = int(os.environ.get('OFFER_VALIDITY_DAYS', '90'))
+OFFER_ISSUER = os.environ.get('OFFER_ISSUER', 'UK Power Networks')
+OFFER_BATCH_SIZE = int(os.environ.get('OFFER_BATCH_SIZE', '200'))
+# The cache keeps offers used within the age limit, least recently used evicted first past the size limit
+OFFER_CACHE_MAX_MB = float(os.environ.get('OFFER_CACHE_MAX_MB', '1024'))
+OFFER_CACHE_MAX_AGE_DAYS = float(os.environ.get('OFFER_CACHE_MAX_AGE_DAYS', '30'))
+OFFER_CACHE_SWEEP_SECONDS = int(os.environ.get('OFFER_CACHE_SWEEP_SECONDS', '600'))
+
+# Bump whenever the layout changes so cached documents are regenerated
+OFFER_TEMPLATE_VERSION = 1
+
+# A4 in points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+LINE_HEIGHT = 14
+
+# Helvetica advance widths (1/1000 em) for the characters amounts are made of;
+# anything else is only ever left-aligned
+AMOUNT_WIDTHS = {',': 278, '.': 278, ' ': 278, '-': 333}
+DIGIT_WIDTH = 556
+
+
+def _camel_words(key):
+    """'testingAndCommissioning' -> 'Testing and commissioning'"""
+    words = re.sub(r'(?<=[a-z0-9])(?=[A-Z])', ' ', str(key)).lower()
+    return words[:1].upper() + words[1:]
+
+
+def _join(*parts, separator=' '):
+    return separator.join(str(part).strip() for part in parts if part not in (None, '') and str(part).strip())
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def offer_inputs(application, load_items, quote):
+    """Everything the offer document shows, and nothing else.
+
+    The cache key is a hash of this dict, so edits to fields the offer does
+    not print (status, map drawings, ...) keep serving the cached file. The
+    offer date is the day the offer was first issued (``offer_issued_at``),
+    not the last edit, for the same reason.
+    """
+    applicant = application.get('applicant_details') or {}
+    site = application.get('site_address') or {}
+    offer_date = str(application.get('offer_issued_at') or application.get('created_at') or '')[:10]
+    valid_until = quote.get('validUntil')
+    if not valid_until and offer_date:
+        valid_until = (date.fromisoformat(offer_date) + timedelta(days=OFFER_VALIDITY_DAYS)).isoformat()
+    breakdown = quote.get('breakdown') or {}
+    return {
+        'applicationId': application['id'],
+        'reference': f"CQ-{application['id']:06d}",
+        'offerDate': offer_date,
+        'validUntil': valid_until,
+        'applicant': {
+            'name': _join(applicant.get('title'), applicant.get('firstName'), applicant.get('lastName')),
+            'company': applicant.get('companyName'),
+            'email': applicant.get('email'),
+            'address': _join(applicant.get('street'), applicant.get('city'), applicant.get('postcode'),
+                             separator=', '),
+        },
+        'siteAddress': _join(site.get('street'), site.get('street2'), site.get('street3'), site.get('city'),
+                             site.get('postcode'), separator=', '),
+        'quote': {
+            'quoteId': quote.get('quoteId'),
+            'currency': quote.get('currency', 'GBP'),
+            'total': _number(quote.get('estimatedCost')),
+            'breakdown': [[_camel_words(name), _number(amount)] for name, amount in sorted(breakdown.items())
+                          if _number(amount) is not None],
+            'loadKva': _number(quote.get('loadKva')) or parse_kva(quote.get('loadRequirement')),
+            'connectionType': quote.get('connectionType'),
+            'terms': [[_camel_words(name), str(text)] for name, text in sorted((quote.get('terms') or {}).items())],
+        },
+        'loadItems': [[item.get('connection_type'), item.get('phases'), item.get('heating_type'),
+                       item.get('quantity'), _number(item.get('summed_load'))] for item in load_items],
+    }
+
+
+def offer_quote(click_quote_data, quote_store):
+    """The stored quote the applicant picked on the Click & Quote page, or None.
+
+    Only the ``quoteId`` of the client's selection is used: prices always
+    come from the quote store, never from what the client saved.
+    """
+    selected = click_quote_data.get('selectedQuote') if isinstance(click_quote_data, dict) else None
+    if not isinstance(selected, dict) or not selected.get('quoteId'):
+        return None
+    return quote_store.get(selected['quoteId'])
+
+
+def load_offer_inputs(conn, app_ids, quote_store, estimator, issue=False):
+    """Offer inputs for many applications, a chunk of rows and load items per query.
+
+    An application without a known selected quote is priced by the
+    estimator from its load items; one with neither is left out of the
+    result. With ``issue`` the offers are being issued, so applications
+    without an offer date get today's (see issue_offers); otherwise an
+    unissued offer is dated by the application's creation.
+    """
+    inputs = {}
+    app_ids = list(app_ids)
+    for start in range(0, len(app_ids), SQL_IN_CHUNK_SIZE):
+        chunk = app_ids[start:start + SQL_IN_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT id, applicant_details, site_address, click_quote_data, created_at, offer_issued_at
+            FROM applications WHERE id IN ({placeholders})
+        ''', chunk).fetchall()
+        issued = issue_offers(conn, [row['id'] for row in rows if not row['offer_issued_at']]) if issue else {}
+        load_items = {}
+        for item in conn.execute(f'''
+            SELECT * FROM load_items WHERE application_id IN ({placeholders}) ORDER BY id
+        ''', chunk):
+            load_items.setdefault(item['application_id'], []).append(dict(item))
+
+        applications = {}
+        quotes = {}
+        for row in rows:
+            application = dict(row)
+            application['offer_issued_at'] = application['offer_issued_at'] or issued.get(row['id'])
+            for field in ('applicant_details', 'site_address', 'click_quote_data'):
+                application[field] = json.loads(application[field]) if application[field] else {}
+            applications[row['id']] = application
+            quotes[row['id']] = offer_quote(application['click_quote_data'], quote_store)
+
+        unpriced = [app_id for app_id, quote in quotes.items() if quote is None]
+        if unpriced:
+            features = application_load_features(conn, unpriced)
+            estimates = estimator.estimate_many([features[app_id] for app_id in unpriced])
+            quotes.update(zip(unpriced, estimates))
+
+        for app_id, application in applications.items():
+            if quotes[app_id]:
+                inputs[app_id] = offer_inputs(application, load_items.get(app_id, []), quotes[app_id])
+    return inputs
+
+
+def issue_offers(conn, app_ids):
+    """Stamp today's date as the offer date of applications that have none; returns {id: date}.
+
+    Only unset dates are written, so when two workers race the first one's
+    date is the one every later offer prints.
+    """
+    if not app_ids:
+        return {}
+    placeholders = ','.join('?' * len(app_ids))
+    conn.execute(f'''
+        UPDATE applications SET offer_issued_at = ? WHERE id IN ({placeholders}) AND offer_issued_at IS NULL
+    ''', [date.today().isoformat(), *app_ids])
+    conn.commit()
+    return {row['id']: row['offer_issued_at'] for row in conn.execute(f'''
+        SELECT id, offer_issued_at FROM applications WHERE id IN ({placeholders})
+    ''', app_ids)}
+
+
+def offer_key(inputs):
+    canonical = json.dumps({'template': OFFER_TEMPLATE_VERSION, 'inputs': inputs}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def offer_path(key):
+    return os.path.join(OFFER_CACHE_DIR, key[:2], f'{key}.pdf')
+
+
+def format_money(amount, currency='GBP'):
+    if amount is None:
+        return '-'
+    symbol = {'GBP': '£', 'EUR': '€'}.get(currency, f'{currency} ')
+    return f'{symbol}{amount:,.2f}'
+
+
+class PDFPage:
+    """Content stream of one page, drawn top-down with a moving cursor"""
+
+    def __init__(self):
+        self.ops = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def text(self, x, y, value, size=10, bold=False):
+        encoded = str(value).encode('cp1252', 'replace')
+        escaped = encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+        font = b'/F2' if bold else b'/F1'
+        self.ops.append(b'BT %s %d Tf %.2f %.2f Td (%s) Tj ET' % (font, size, x, y, escaped))
+
+    def text_right(self, right, y, value, size=10, bold=False):
+        width = sum(AMOUNT_WIDTHS.get(char, DIGIT_WIDTH) for char in str(value)) * size / 1000
+        self.text(right - width, y, value, size, bold)
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.ops.append(b'%.2f w %.2f %.2f m %.2f %.2f l S' % (width, x1, y1, x2, y2))
+
+    def shade(self, x, y, w, h, grey=0.92):
+        self.ops.append(b'%.2f g %.2f %.2f %.2f %.2f re f 0 g' % (grey, x, y, w, h))
+
+    def content(self):
+        return zlib.compress(b'\n'.join(self.ops))
+
+
+class OfferDocument:
+    """Flows offer sections onto as many A4 pages as they need"""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.page = PDFPage()
+        self.pages.append(self.page)
+        if len(self.pages) > 1:
+            self.page.text(MARGIN, self.page.y, f"Formal connection offer {self.inputs['reference']} (continued)",
+                           9, bold=True)
+            self.page.y -= 2 * LINE_HEIGHT
+
+    def need(self, height):
+        if self.page.y - height < MARGIN + 2 * LINE_HEIGHT:
+            self.new_page()
+
+    def heading(self, title):
+        self.need(3 * LINE_HEIGHT)
+        self.page.y -= 6
+        self.page.text(MARGIN, self.page.y, title, 12, bold=True)
+        self.page.y -= 4
+        self.page.line(MARGIN, self.page.y, PAGE_WIDTH - MARGIN, self.page.y)
+        self.page.y -= LINE_HEIGHT
+
+    def field(self, label, value):
+        if value in (None, ''):
+            return
+        self.need(LINE_HEIGHT)
+        self.page.text(MARGIN, self.page.y, label, bold=True)
+        self.page.text(MARGIN + 140, self.page.y, value)
+        self.page.y -= LINE_HEIGHT
+
+    def table(self, columns, rows, right_align=()):
+        """``columns`` is [(title, x offset)]; a shaded header row is repeated on each new page"""
+        def header():
+            self.page.shade(MARGIN, self.page.y - 4, PAGE_WIDTH - 2 * MARGIN, LINE_HEIGHT)
+            for index, (title, x) in enumerate(columns):
+                self.cell(index, title, x, right_align, bold=True)
+            self.page.y -= LINE_HEIGHT
+
+        self.need(2 * LINE_HEIGHT)
+        header()
+        for row in rows:
+            if self.page.y - LINE_HEIGHT < MARGIN + 2 * LINE_HEIGHT:
+                self.new_page()
+                header()
+            for index, (value, (_, x)) in enumerate(zip(row, columns)):
+                self.cell(index, value, x, right_align)
+            self.page.y -= LINE_HEIGHT
+
+    def cell(self, index, value, x, right_align, bold=False):
+        if index in right_align:
+            self.page.text_right(PAGE_WIDTH - MARGIN - 4 if x is None else MARGIN + x, self.page.y, value, bold=bold)
+        else:
+            self.page.text(MARGIN + 4 + x, self.page.y, '' if value is None else value, bold=bold)
+
+    def render(self):
+        inputs = self.inputs
+        quote = inputs['quote']
+        currency = quote['currency']
+
+        self.page.text(MARGIN, self.page.y, OFFER_ISSUER, 9)
+        self.page.y -= 2 * LINE_HEIGHT
+        self.page.text(MARGIN, self.page.y, 'Formal Connection Offer', 20, bold=True)
+        self.page.y -= 2 * LINE_HEIGHT
+        self.field('Offer reference', inputs['reference'])
+        self.field('Quote', quote['quoteId'])
+        self.field('Date of offer', inputs['offerDate'])
+        self.field('Valid until', inputs['validUntil'])
+
+        applicant = inputs['applicant']
+        self.heading('Customer')
+        self.field('Name', applicant['name'])
+        self.field('Company', applicant['company'])
+        self.field('Email', applicant['email'])
+        self.field('Address', applicant['address'])
+
+        self.heading('Connection')
+        self.field('Site address', inputs['siteAddress'])
+        self.field('Connection type', quote['connectionType'])
+        if quote['loadKva']:
+            self.field('Capacity', f"{quote['loadKva']:,.1f} kVA")
+        if inputs['loadItems']:
+            self.page.y -= 4
+            self.table([('Connection type', 0), ('Phases', 150), ('Heating', 230), ('Quantity', 380),
+                        ('Load (kVA)', None)],
+                       [[kind, phases, heating, quantity, '-' if load is None else f'{load:,.2f}']
+                        for kind, phases, heating, quantity, load in inputs['loadItems']],
+                       right_align=(4,))
+
+        self.heading('Charges')
+        self.table([('Item', 0), ('Amount', None)],
+                   [[label, format_money(amount, currency)] for label, amount in quote['breakdown']],
+                   right_align=(1,))
+        self.need(2 * LINE_HEIGHT)
+        self.page.line(PAGE_WIDTH - MARGIN - 150, self.page.y + LINE_HEIGHT - 3, PAGE_WIDTH - MARGIN,
+                       self.page.y + LINE_HEIGHT - 3)
+        self.page.text(MARGIN + 4, self.page.y, 'Total', bold=True)
+        self.page.text_right(PAGE_WIDTH - MARGIN - 4, self.page.y, format_money(quote['total'], currency), bold=True)
+        self.page.y -= LINE_HEIGHT
+
+        if quote['terms']:
+            self.heading('Terms')
+            for label, text in quote['terms']:
+                self.field(label, text)
+
+        self.heading('Acceptance')
+        self.need(4 * LINE_HEIGHT)
+        self.page.text(MARGIN, self.page.y, 'To accept this offer, sign and return it before the date above.', 9)
+        self.page.y -= 3 * LINE_HEIGHT
+        for x, label in ((MARGIN, 'Signature'), (MARGIN + 260, 'Date')):
+            self.page.line(x, self.page.y, x + 200, self.page.y)
+            self.page.text(x, self.page.y - 11, label, 8)
+
+        for number, page in enumerate(self.pages, start=1):
+            page.text_right(PAGE_WIDTH - MARGIN, MARGIN - 20, f'{number} / {len(self.pages)}', 8)
+            page.text(MARGIN, MARGIN - 20, inputs['reference'], 8)
+        return write_pdf([page.content() for page in self.pages], f"Formal connection offer {inputs['reference']}")
+
+
+def write_pdf(contents, title):
+    """A PDF 1.4 file from compressed page content streams, using the standard Helvetica fonts"""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, once the page object numbers are known
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    escaped_title = title.encode('cp1252', 'replace').replace(b'(', b'\\(').replace(b')', b'\\)')
+    objects.append(b'<< /Title (%s) /Producer (Click & Quote) >>' % escaped_title)
+    page_numbers = []
+    for content in contents:
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+                       b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, len(objects)))
+        page_numbers.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % number for number in page_numbers)
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_numbers))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render_offer(inputs):
+    """(pdf bytes, page count) for one offer"""
+    document = OfferDocument(inputs)
+    return document.render(), len(document.pages)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def render_to_cache(path, inputs):
+    """Render one offer into the cache; returns its page count (runs in pool workers too)"""
+    pdf, pages = render_offer(inputs)
+    _write_atomic(path, pdf)
+    return pages
+
+
+def render_many(jobs):
+    """Pool task: render a list of (path, inputs), returning the page counts"""
+    return [render_to_cache(path, inputs) for path, inputs in jobs]
+
+
+def _touch(path):
+    """Mark a cached offer as used now; False if it is not in the cache"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+_last_sweep = 0.0
+
+
+def prune_offer_cache(max_bytes=None, max_age_seconds=None, now=None):
+    """Delete cached offers unused for longer than the age limit, then the least recently used
+    ones until the cache fits the size limit; returns the number of files removed.
+
+    A file's modification time is its last use (see _touch). An edit that
+    changes the printed content leaves the old offer behind, so this is what
+    keeps the directory bounded.
+    """
+    global _last_sweep
+    max_bytes = OFFER_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_age_seconds = OFFER_CACHE_MAX_AGE_DAYS * 86400 if max_age_seconds is None else max_age_seconds
+    now = time.time() if now is None else now
+    _last_sweep = now
+
+    files = []
+    try:
+        directories = [entry.path for entry in os.scandir(OFFER_CACHE_DIR) if entry.is_dir()]
+    except FileNotFoundError:
+        return 0
+    for directory in directories:
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if now - mtime <= max_age_seconds and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+
+def maybe_prune_offer_cache():
+    """Prune at most once per OFFER_CACHE_SWEEP_SECONDS in each process"""
+    if time.time() - _last_sweep >= OFFER_CACHE_SWEEP_SECONDS:
+        prune_offer_cache()
+
+
+def cached_offer(inputs):
+    """(key, path) of the offer for these inputs, rendering it first on a cache miss"""
+    key = offer_key(inputs)
+    path = offer_path(key)
+    if not _touch(path):
+        render_to_cache(path, inputs)
+        maybe_prune_offer_cache()
+    return key, path
+
+
+_executor = None
+
+
+def offer_executor():
+    """Process pool for batch rendering, created on first use in each server process"""
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the server process has threads (pool, mail worker) that fork would copy mid-state
+        _executor = ProcessPoolExecutor(OFFER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def generate_offers(inputs_by_id, executor=None):
+    """Render every offer not already cached, in parallel; returns {application_id: result}.
+
+    Each result has the cache ``key``, whether it was ``cached`` and, for
+    fresh renders, the number of ``pages``. If a worker dies the pool is
+    discarded and the rest of the batch is rendered in this process.
+    """
+    global _executor
+    results = {}
+    pending = {}
+    for app_id, inputs in inputs_by_id.items():
+        key = offer_key(inputs)
+        results[app_id] = {'key': key, 'cached': _touch(offer_path(key))}
+        if not results[app_id]['cached']:
+            pending[app_id] = offer_path(key)
+    if not pending:
+        return results
+
+    try:
+        pool = executor or offer_executor()
+        # A few tasks per worker: enough to balance uneven page counts, few enough to keep IPC cheap
+        jobs = list(pending.items())
+        size = max(1, -(-len(jobs) // (4 * (getattr(pool, '_max_workers', None) or OFFER_WORKERS))))
+        chunks = [jobs[start:start + size] for start in range(0, len(jobs), size)]
+        futures = [(chunk, pool.submit(render_many, [(path, inputs_by_id[app_id]) for app_id, path in chunk]))
+                   for chunk in chunks]
+        for chunk, future in futures:
+            for (app_id, _), pages in zip(chunk, future.result()):
+                results[app_id]['pages'] = pages
+    except BrokenProcessPool as e:
+        print(f"Offer worker pool failed, rendering in-process: {e}")
+        if executor is None:
+            _executor = None
+        for app_id, path in pending.items():
+            if 'pages' not in results[app_id]:
+                results[app_id]['pages'] = render_to_cache(path, inputs_by_id[app_id])
+    maybe_prune_offer_cache()
+    return results
@@ -0,0 +1,180 @@
+import hashlib
+import heapq
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+from db import pool
+
+# OTP store configuration (override through the environment)
+OTP_STORE_BACKEND = os.environ.get('OTP_STORE', 'sqlite')
+OTP_TTL_SECONDS = int(os.environ.get('OTP_TTL_SECONDS', '600'))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', '3'))
+OTP_MEMORY_MAX_ENTRIES = int(os.environ.get('OTP_MEMORY_MAX_ENTRIES', '100000'))
+OTP_SWEEP_INTERVAL = float(os.environ.get('OTP_SWEEP_INTERVAL', '60'))
+
+# Outcomes of OTPStore.verify
+VERIFIED = 'verified'
+NOT_FOUND = 'not_found'
+EXPIRED = 'expired'
+BLOCKED = 'blocked'
+INVALID = 'invalid'
+
+
+class MemoryOTPStore:
+    """Per-process OTP store with a min-heap of expiry times.
+
+    Expired entries are swept from the top of the heap on every write, so
+    abandoned OTPs never accumulate; past ``max_entries`` the entries closest
+    to expiry are evicted first. Only suitable for a single worker process.
+    """
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS,
+                 max_entries=OTP_MEMORY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._heap = []
+        self._seq = 0
+        self.evicted = 0
+
+    def _sweep(self, now):
+        # Heap items are (expires_at, seq, email); stale seqs were superseded
+        while self._heap:
+            expires_at, seq, email = self._heap[0]
+            entry = self._entries.get(email)
+            if entry is None or entry['seq'] != seq:
+                heapq.heappop(self._heap)
+                continue
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            heapq.heappop(self._heap)
+            del self._entries[email]
+            if expires_at > now:
+                self.evicted += 1
+
+    def put(self, email, otp, ip_address=None, user_agent=None):
+        now = time.time()
+        with self._lock:
+            self._seq += 1
+            expires_at = now + self.ttl
+            self._entries[email] = {
+                'otp': otp,
+                'expires_at': expires_at,
+                'attempts': 0,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'seq': self._seq
+            }
+            heapq.heappush(self._heap, (expires_at, self._seq, email))
+            self._sweep(now)
+
+    def verify(self, email, otp):
+        """Check an OTP; returns (outcome, attempts)"""
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return NOT_FOUND, 0
+            if time.time() > entry['expires_at']:
+                del self._entries[email]
+                return EXPIRED, entry['attempts']
+            if entry['attempts'] >= self.max_attempts:
+                del self._entries[email]
+                return BLOCKED, entry['attempts']
+            if not hmac.compare_digest(entry['otp'], otp):
+                entry['attempts'] += 1
+                return INVALID, entry['attempts']
+            del self._entries[email]
+            return VERIFIED, entry['attempts']
+
+    def sweep(self):
+        with self._lock:
+            self._sweep(time.time())
+
+    def size(self):
+        return len(self._entries)
+
+
+class SQLiteOTPStore:
+    """OTP store in the shared SQLite database, so every worker process sees it.
+
+    Verification runs inside ``BEGIN IMMEDIATE`` which makes the expiry check,
+    attempt counting and deletion atomic across processes. Codes are stored
+    as SHA-256 digests keyed by the email rather than in clear text.
+    """
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS,
+                 sweep_interval=OTP_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _digest(email, otp):
+        return hashlib.sha256(f'{email}:{otp}'.encode('utf-8')).hexdigest()
+
+    def put(self, email, otp, ip_address=None, user_agent=None):
+        now = time.time()
+        with pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO otp_codes (email, otp_hash, expires_at, attempts, ip_address, user_agent)
+                VALUES (?, ?, ?, 0, ?, ?)
+            ''', (email, self._digest(email, otp), now + self.ttl, ip_address, user_agent))
+            conn.commit()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = now
+                conn.execute('DELETE FROM otp_codes WHERE expires_at < ?', (now,))
+                conn.commit()
+
+    def verify(self, email, otp):
+        """Check an OTP; returns (outcome, attempts)"""
+        with pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT otp_hash, expires_at, attempts FROM otp_codes WHERE email = ?',
+                                   (email,)).fetchone()
+                if row is None:
+                    outcome, attempts = NOT_FOUND, 0
+                elif time.time() > row['expires_at']:
+                    outcome, attempts = EXPIRED, row['attempts']
+                elif row['attempts'] >= self.max_attempts:
+                    outcome, attempts = BLOCKED, row['attempts']
+                elif not hmac.compare_digest(row['otp_hash'], self._digest(email, otp)):
+                    outcome, attempts = INVALID, row['attempts'] + 1
+                else:
+                    outcome, attempts = VERIFIED, row['attempts']
+
+                if outcome == INVALID:
+                    conn.execute('UPDATE otp_codes SET attempts = ? WHERE email = ?', (attempts, email))
+                elif outcome != NOT_FOUND:
+                    conn.execute('DELETE FROM otp_codes WHERE email = ?', (email,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            return outcome, attempts
+
+    def sweep(self):
+        with pool.connection() as conn:
+            conn.execute('DELETE FROM otp_codes WHERE expires_at < ?', (time.time(),))
+            conn.commit()
+
+    def size(self):
+        with pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM otp_codes').fetchone()[0]
+
+
+def create_otp_store(backend=OTP_STORE_BACKEND):
+    if backend == 'memory':
+        return MemoryOTPStore()
+    if backend == 'sqlite':
+        return SQLiteOTPStore()
+    raise ValueError(f'Unknown OTP store backend: {backend}')
+
+
+otp_store = create_otp_store()
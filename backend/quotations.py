@@ -0,0 +1,226 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+from schema import normalize_postcode, postcode_district
+
+# Quotation store configuration (override through the environment)
+QUOTATIONS_DIR = os.environ.get(
+    'QUOTATIONS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'quotations')
+)
+QUOTE_RELOAD_INTERVAL = float(os.environ.get('QUOTE_RELOAD_INTERVAL', '5'))
+
+KVA_PATTERN = re.compile(r'([\d.,]+)\s*([kKmM]?)VA')
+PHASE_WORDS = {'single': 1, 'one': 1, 'two': 2, 'split': 2, 'three': 3}
+
+
+def parse_kva(value):
+    """Parse a load requirement such as '150 kVA' or '1.2 MVA' into kVA"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = KVA_PATTERN.search(str(value or ''))
+    if not match:
+        return None
+    amount = float(match.group(1).replace(',', ''))
+    unit = match.group(2).lower()
+    if unit == 'm':
+        return amount * 1000
+    if unit == '':
+        return amount / 1000
+    return amount
+
+
+def parse_phases(value):
+    """Number of phases from a connection type such as 'Three Phase'"""
+    if isinstance(value, int):
+        return value
+    text = str(value or '').strip().lower()
+    if text[:1].isdigit():
+        return int(text[0])
+    return PHASE_WORDS.get(text.split(' ')[0]) if text else None
+
+
+def normalize_connection_type(value):
+    return ' '.join(str(value or '').lower().split())
+
+
+def postcode_area(postcode):
+    """Leading letters of a postcode, e.g. 'TW' for 'TW14 0BJ'"""
+    match = re.match(r'[A-Z]+', postcode or '')
+    return match.group(0) if match else None
+
+
+class QuoteStore:
+    """In-memory index over the JSON quote files in a directory.
+
+    Files are parsed once and kept keyed by mtime; ``refresh`` only re-reads
+    files that were added or changed and then rebuilds the lookup indexes.
+    """
+
+    def __init__(self, directory, reload_interval=QUOTE_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._files = {}
+        self._last_check = 0.0
+        self._by_id = {}
+        self._by_district = {}
+        self._by_area = {}
+        self._by_connection_type = {}
+        self._kva_index = ([], [])
+        # Bumped on every index rebuild so derived caches know to refresh
+        self.generation = 0
+
+    def _load_file(self, path):
+        with open(path, 'r') as f:
+            quote = json.load(f)
+        postcode = normalize_postcode(quote.get('postcode'))
+        quote['postcodeDistrict'] = postcode_district(postcode)
+        quote['loadKva'] = parse_kva(quote.get('loadRequirement'))
+        quote['phaseCount'] = parse_phases(quote.get('connectionType'))
+        return quote
+
+    def _rebuild_indexes(self):
+        by_id = {}
+        by_district = {}
+        by_area = {}
+        by_connection_type = {}
+        kva_pairs = []
+        for _, _, quote in self._files.values():
+            quote_id = quote.get('quoteId')
+            if not quote_id:
+                continue
+            by_id[quote_id] = quote
+            district = quote['postcodeDistrict']
+            if district:
+                by_district.setdefault(district, set()).add(quote_id)
+                by_area.setdefault(postcode_area(district), set()).add(quote_id)
+            connection_type = normalize_connection_type(quote.get('connectionType'))
+            by_connection_type.setdefault(connection_type, set()).add(quote_id)
+            if quote['loadKva'] is not None:
+                kva_pairs.append((quote['loadKva'], quote_id))
+        kva_pairs.sort()
+
+        self._by_id = by_id
+        self._by_district = by_district
+        self._by_area = by_area
+        self._by_connection_type = by_connection_type
+        # Swapped as one tuple so readers never see mismatched lists
+        self._kva_index = ([kva for kva, _ in kva_pairs], [quote_id for _, quote_id in kva_pairs])
+        self.generation += 1
+
+    def refresh(self):
+        """Re-read added or modified quote files; returns True if anything changed"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            seen = set()
+            changed = False
+            try:
+                entries = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                cached = self._files.get(entry.name)
+                if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                    continue
+                try:
+                    quote = self._load_file(entry.path)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable quote file {entry.name}: {e}")
+                    continue
+                self._files[entry.name] = (stat.st_mtime_ns, stat.st_size, quote)
+                changed = True
+            for name in set(self._files) - seen:
+                del self._files[name]
+                changed = True
+            if changed:
+                self._rebuild_indexes()
+            return changed
+
+    def maybe_refresh(self):
+        """Refresh at most once per reload interval"""
+        if time.monotonic() - self._last_check >= self.reload_interval:
+            self.refresh()
+
+    def get(self, quote_id):
+        self.maybe_refresh()
+        return self._by_id.get(quote_id)
+
+    def _candidates(self, postcode=None, connection_type=None, fallback_to_area=False):
+        """Quote ids matching the postcode district and connection type"""
+        candidates = None
+        if postcode:
+            district = postcode_district(normalize_postcode(postcode))
+            matches = self._by_district.get(district, set())
+            if not matches and fallback_to_area:
+                matches = self._by_area.get(postcode_area(district), set())
+            candidates = set(matches)
+        if connection_type:
+            matches = self._by_connection_type.get(normalize_connection_type(connection_type), set())
+            candidates = matches & candidates if candidates is not None else set(matches)
+        return candidates
+
+    def search(self, postcode=None, connection_type=None, min_kva=None, max_kva=None):
+        """All quotes matching the filters, ordered by kVA"""
+        self.maybe_refresh()
+        candidates = self._candidates(postcode, connection_type)
+        kva_keys, kva_ids = self._kva_index
+        lo = bisect.bisect_left(kva_keys, min_kva) if min_kva is not None else 0
+        hi = bisect.bisect_right(kva_keys, max_kva) if max_kva is not None else len(kva_keys)
+        results = [self._by_id[quote_id] for quote_id in kva_ids[lo:hi]
+                   if candidates is None or quote_id in candidates]
+        if min_kva is None and max_kva is None:
+            # Quotes without a parseable load are not in the kVA index
+            results += [quote for quote_id, quote in self._by_id.items()
+                        if quote['loadKva'] is None and (candidates is None or quote_id in candidates)]
+        return results
+
+    def nearest(self, postcode=None, connection_type=None, kva=None, limit=5):
+        """Closest quotes by kVA within the postcode district (or area) and connection type"""
+        self.maybe_refresh()
+        candidates = self._candidates(postcode, connection_type, fallback_to_area=True)
+        kva_keys, kva_ids = self._kva_index
+        if kva is None:
+            return [self._by_id[quote_id] for quote_id in kva_ids
+                    if candidates is None or quote_id in candidates][:limit]
+
+        # Walk outwards from the insertion point so only the nearest k are visited
+        results = []
+        right = bisect.bisect_left(kva_keys, kva)
+        left = right - 1
+        while len(results) < limit and (left >= 0 or right < len(kva_keys)):
+            take_left = right >= len(kva_keys) or (
+                left >= 0 and kva - kva_keys[left] <= kva_keys[right] - kva)
+            if take_left:
+                quote_id = kva_ids[left]
+                left -= 1
+            else:
+                quote_id = kva_ids[right]
+                right += 1
+            if candidates is None or quote_id in candidates:
+                results.append(self._by_id[quote_id])
+        return results
+
+    def all(self):
+        self.maybe_refresh()
+        return list(self._by_id.values())
+
+    def stats(self):
+        return {
+            'directory': os.path.abspath(self.directory),
+            'files': len(self._files),
+            'quotes': len(self._by_id),
+            'districts': len(self._by_district),
+            'connection_types': len(self._by_connection_type)
+        }
+
+
+quote_store = QuoteStore(QUOTATIONS_DIR)
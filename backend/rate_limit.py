@@ -0,0 +1,284 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from db import pool
+
+# Rate limiter configuration (override through the environment)
+# Worker processes serving the app: gunicorn.conf.py exports it, uvicorn reads it for --workers
+WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# Per-process counters would let every worker allow the full limit, so several workers share SQLite ones
+RATE_LIMIT_STORE_BACKEND = os.environ.get('RATE_LIMIT_STORE', 'sqlite' if WORKER_PROCESSES > 1 else 'memory')
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_MEMORY_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MEMORY_MAX_KEYS', '200000'))
+RATE_LIMIT_SWEEP_INTERVAL = float(os.environ.get('RATE_LIMIT_SWEEP_INTERVAL', '60'))
+
+RateLimit = namedtuple('RateLimit', ['limit', 'window'])
+
+
+def parse_limit(value):
+    """'5/900' -> RateLimit(limit=5, window=900): at most 5 hits per 900 seconds"""
+    limit, _, window = value.partition('/')
+    return RateLimit(int(limit), float(window))
+
+
+# Limits are 'count/seconds'
+RATE_LIMITS = {
+    'send_otp_email': parse_limit(os.environ.get('RATE_LIMIT_SEND_OTP_EMAIL', '5/900')),
+    'send_otp_ip': parse_limit(os.environ.get('RATE_LIMIT_SEND_OTP_IP', '20/900')),
+    'send_otp_global': parse_limit(os.environ.get('RATE_LIMIT_SEND_OTP_GLOBAL', '300/60')),
+    'verify_otp_email': parse_limit(os.environ.get('RATE_LIMIT_VERIFY_OTP_EMAIL', '10/900')),
+    'verify_otp_ip': parse_limit(os.environ.get('RATE_LIMIT_VERIFY_OTP_IP', '30/900')),
+    'verify_otp_global': parse_limit(os.environ.get('RATE_LIMIT_VERIFY_OTP_GLOBAL', '600/60')),
+    # Failed verifications per IP; only counted on failure, checked on every attempt
+    'login_failures_ip': parse_limit(os.environ.get('RATE_LIMIT_LOGIN_FAILURES_IP', '20/900')),
+}
+
+
+def window_counts(stored, window_index):
+    """(previous, current) counts as of ``window_index`` from a stored (window, previous, current)"""
+    if stored is None:
+        return 0, 0
+    window, previous, current = stored
+    if window == window_index:
+        return previous, current
+    if window == window_index - 1:
+        return current, 0
+    return 0, 0
+
+
+def sliding_count(previous, current, elapsed):
+    """Sliding-window estimate: the previous window weighted by how much of it still overlaps"""
+    return previous * (1.0 - elapsed) + current
+
+
+def retry_after(previous, current, elapsed, rule):
+    """Whole seconds until one more hit fits under the limit"""
+    if current + 1 <= rule.limit:
+        # Wait for the previous window's weight to decay enough
+        needed = 1.0 - (rule.limit - current - 1) / previous if previous else elapsed
+        wait = (needed - elapsed) * rule.window
+    else:
+        # Only possible once this window becomes the previous one and decays
+        needed = 1.0 - (rule.limit - 1) / current if current else 0.0
+        wait = (1.0 - elapsed + max(needed, 0.0)) * rule.window
+    return max(1, math.ceil(wait))
+
+
+def _position(rule, now):
+    window_index, offset = divmod(now, rule.window)
+    return int(window_index), offset / rule.window
+
+
+class MemoryRateLimiter:
+    """Per-process sliding-window counters.
+
+    Each (rule, key) costs one tuple of three ints: the window index and the
+    previous and current window counts. The table is capped at
+    ``max_keys``, evicting the least recently hit keys first, and every
+    ``sweep_interval`` the least recently hit keys whose windows have passed
+    are dropped from the front of that order. A stale key behind a live one
+    (from a rule with a shorter window) waits for a later sweep or the cap.
+    """
+
+    def __init__(self, rules=RATE_LIMITS, max_keys=RATE_LIMIT_MEMORY_MAX_KEYS,
+                 sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self.rules = rules
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.rejected = Counter()
+
+    def allow(self, hits, guards=()):
+        """Count a hit against each (rule, key) in ``hits`` unless any rule is over its limit.
+
+        ``guards`` are checked but not counted: they block once the count
+        reaches the limit. Returns None when allowed, else
+        ``(rule, retry_after_seconds)`` for the first exceeded rule.
+        """
+        now = time.time()
+        with self._lock:
+            updates = []
+            for checks, counted in ((guards, False), (hits, True)):
+                for name, key in checks:
+                    rule = self.rules[name]
+                    window_index, elapsed = _position(rule, now)
+                    previous, current = window_counts(self._counters.get((name, key)), window_index)
+                    if sliding_count(previous, current, elapsed) + 1 > rule.limit:
+                        self.rejected[name] += 1
+                        return name, retry_after(previous, current, elapsed, rule)
+                    if counted:
+                        updates.append(((name, key), (window_index, previous, current + 1)))
+            for item, stored in updates:
+                self._store(item, stored)
+            self._maybe_sweep(now)
+        return None
+
+    def record(self, name, key):
+        """Count a hit without checking the limit (e.g. a failed login)"""
+        now = time.time()
+        rule = self.rules[name]
+        window_index, _ = _position(rule, now)
+        with self._lock:
+            previous, current = window_counts(self._counters.get((name, key)), window_index)
+            self._store((name, key), (window_index, previous, current + 1))
+            self._maybe_sweep(now)
+
+    def count(self, name, key):
+        rule = self.rules[name]
+        window_index, elapsed = _position(rule, time.time())
+        return sliding_count(*window_counts(self._counters.get((name, key)), window_index), elapsed)
+
+    def top(self, name, limit=50):
+        """Keys with the highest current count for a rule, as (key, count) pairs"""
+        rule = self.rules[name]
+        window_index, elapsed = _position(rule, time.time())
+        with self._lock:
+            items = [(key, stored) for (rule_name, key), stored in self._counters.items() if rule_name == name]
+        counts = [(key, sliding_count(*window_counts(stored, window_index), elapsed)) for key, stored in items]
+        return sorted((item for item in counts if item[1] > 0), key=lambda item: -item[1])[:limit]
+
+    def _store(self, item, stored):
+        self._counters[item] = stored
+        self._counters.move_to_end(item)
+
+    def _maybe_sweep(self, now):
+        # Over the cap: drop the least recently hit keys, one per key over
+        while len(self._counters) > self.max_keys:
+            self._counters.popitem(last=False)
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        # Least recently hit keys sit at the front; drop them while their windows
+        # have passed and stop at the first live one, so a sweep costs what it removes
+        positions = {name: _position(rule, now)[0] for name, rule in self.rules.items()}
+        while self._counters:
+            (name, key), stored = next(iter(self._counters.items()))
+            if stored[0] >= positions[name] - 1:
+                break
+            self._counters.popitem(last=False)
+
+    def size(self):
+        return len(self._counters)
+
+    def stats(self):
+        return {'backend': 'memory', 'keys': self.size(), 'rejected': dict(self.rejected)}
+
+
+class SQLiteRateLimiter:
+    """Sliding-window counters in the shared database, so limits hold across worker processes.
+
+    Each decision reads and updates the counters inside ``BEGIN IMMEDIATE``.
+    """
+
+    def __init__(self, rules=RATE_LIMITS, sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self.rules = rules
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self.rejected = Counter()
+
+    def _load(self, conn, name, key):
+        row = conn.execute('SELECT window, previous, current FROM rate_limits WHERE rule = ? AND key = ?',
+                           (name, key)).fetchone()
+        return tuple(row) if row else None
+
+    def _store(self, conn, updates):
+        conn.executemany('''
+            INSERT INTO rate_limits (rule, key, window, previous, current, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (rule, key) DO UPDATE SET
+                window = excluded.window, previous = excluded.previous,
+                current = excluded.current, expires_at = excluded.expires_at
+        ''', updates)
+
+    def _update(self, name, key, window_index, previous, current):
+        # A counter stops mattering once its window is two windows old
+        return (name, key, window_index, previous, current, (window_index + 2) * self.rules[name].window)
+
+    def allow(self, hits, guards=()):
+        """Count a hit against each (rule, key) in ``hits`` unless any rule is over its limit.
+
+        ``guards`` are checked but not counted: they block once the count
+        reaches the limit. Returns None when allowed, else
+        ``(rule, retry_after_seconds)`` for the first exceeded rule.
+        """
+        now = time.time()
+        with pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                updates = []
+                for checks, counted in ((guards, False), (hits, True)):
+                    for name, key in checks:
+                        rule = self.rules[name]
+                        window_index, elapsed = _position(rule, now)
+                        previous, current = window_counts(self._load(conn, name, key), window_index)
+                        if sliding_count(previous, current, elapsed) + 1 > rule.limit:
+                            conn.rollback()
+                            self.rejected[name] += 1
+                            return name, retry_after(previous, current, elapsed, rule)
+                        if counted:
+                            updates.append(self._update(name, key, window_index, previous, current + 1))
+                self._store(conn, updates)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            self._maybe_sweep(conn, now)
+        return None
+
+    def record(self, name, key):
+        """Count a hit without checking the limit (e.g. a failed login)"""
+        window_index, _ = _position(self.rules[name], time.time())
+        with pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                previous, current = window_counts(self._load(conn, name, key), window_index)
+                self._store(conn, [self._update(name, key, window_index, previous, current + 1)])
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def count(self, name, key):
+        window_index, elapsed = _position(self.rules[name], time.time())
+        with pool.connection() as conn:
+            stored = self._load(conn, name, key)
+        return sliding_count(*window_counts(stored, window_index), elapsed)
+
+    def top(self, name, limit=50):
+        """Keys with the highest current count for a rule, as (key, count) pairs"""
+        window_index, elapsed = _position(self.rules[name], time.time())
+        with pool.connection() as conn:
+            rows = conn.execute('SELECT key, window, previous, current FROM rate_limits WHERE rule = ? AND window >= ?',
+                                (name, window_index - 1)).fetchall()
+        counts = [(row['key'], sliding_count(*window_counts(tuple(row)[1:], window_index), elapsed)) for row in rows]
+        return sorted((item for item in counts if item[1] > 0), key=lambda item: -item[1])[:limit]
+
+    def _maybe_sweep(self, conn, now):
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            conn.execute('DELETE FROM rate_limits WHERE expires_at < ?', (now,))
+            conn.commit()
+
+    def size(self):
+        with pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0]
+
+    def stats(self):
+        return {'backend': 'sqlite', 'keys': self.size(), 'rejected': dict(self.rejected)}
+
+
+def create_rate_limiter(backend=RATE_LIMIT_STORE_BACKEND):
+    if backend == 'memory':
+        return MemoryRateLimiter()
+    if backend == 'sqlite':
+        return SQLiteRateLimiter()
+    raise ValueError(f'Unknown rate limit store backend: {backend}')
+
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,380 @@
+import json
+
+from geometry import create_geometry_index, rebuild_geometry_index
+
+# Sections stored as JSON TEXT columns on the applications table
+JSON_SECTIONS = ['applicant_details', 'general_information', 'site_address',
+                 'load_details', 'other_contact', 'click_quote_data',
+                 'project_details', 'auto_quote_eligibility', 'upload_docs', 'summary']
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Full-text search columns: (JSON section, keys) pairs, or a section whose every text value is indexed
+SEARCH_COLUMNS = {
+    'applicant': [('applicant_details', ['title', 'firstName', 'lastName', 'email'])],
+    'company': [('applicant_details', ['companyName'])],
+    'address': [('site_address', ['street', 'street2', 'street3', 'city', 'postcode', 'state'])],
+    'project': ['project_details', 'general_information'],
+}
+# bm25 weight per search column, in SEARCH_COLUMNS order
+SEARCH_WEIGHTS = [10.0, 8.0, 5.0, 1.0]
+# Sections whose changes must be re-indexed
+SEARCH_SECTIONS = ['applicant_details', 'site_address', 'project_details', 'general_information']
+
+
+def normalize_postcode(value):
+    """Upper-case a UK postcode and put a single space before the inward code"""
+    if not value:
+        return None
+    compact = ''.join(str(value).upper().split())
+    if not compact:
+        return None
+    if len(compact) > 4:
+        return f'{compact[:-3]} {compact[-3:]}'
+    return compact
+
+
+def postcode_district(postcode):
+    """Outward code of a normalized postcode, e.g. 'TW14' for 'TW14 0BJ'"""
+    if not postcode:
+        return None
+    return postcode.split(' ')[0]
+
+
+def _section(value):
+    if isinstance(value, dict):
+        return value
+    if not value:
+        return {}
+    try:
+        parsed = json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def section_hot_fields(section, value):
+    """Indexed columns derived from a single JSON section (dict or JSON text)"""
+    value = _section(value)
+    if section == 'site_address':
+        postcode = normalize_postcode(value.get('postcode'))
+        return {'postcode': postcode, 'postcode_district': postcode_district(postcode)}
+    if section == 'applicant_details':
+        email = value.get('email')
+        return {'applicant_email': email.strip().lower() if isinstance(email, str) and email.strip() else None}
+    if section == 'summary':
+        status = value.get('status')
+        return {'status': status} if status else {}
+    return {}
+
+
+def hot_fields(applicant_details, site_address, summary):
+    """Typed, indexed columns derived from the JSON sections.
+
+    Each argument may be a dict or its JSON text. ``status`` is None when the
+    summary does not carry one, so callers can keep the stored value.
+    """
+    fields = {'status': None}
+    fields.update(section_hot_fields('applicant_details', applicant_details))
+    fields.update(section_hot_fields('site_address', site_address))
+    fields.update(section_hot_fields('summary', summary))
+    return fields
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _add_column(conn, table, column, definition):
+    if column not in _columns(conn, table):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def backfill_hot_columns(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """One-shot migrator: populate hot columns from the existing JSON sections.
+
+    Walks the table in id order so memory stays bounded on large databases.
+    Returns the number of rows rewritten.
+    """
+    last_id = 0
+    updated = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, applicant_details, site_address, summary, status
+            FROM applications WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            fields = hot_fields(row[1], row[2], row[3])
+            params.append((
+                fields['postcode'], fields['postcode_district'],
+                fields['applicant_email'], fields['status'] or row[4], row[0]
+            ))
+        conn.executemany('''
+            UPDATE applications
+            SET postcode = ?, postcode_district = ?, applicant_email = ?, status = ?
+            WHERE id = ?
+        ''', params)
+        conn.commit()
+
+        updated += len(rows)
+        last_id = rows[-1][0]
+    return updated
+
+
+def _search_expression(row, sources):
+    """SQL text for one search column from the JSON sections of ``row`` (e.g. 'new')"""
+    parts = []
+    for source in sources:
+        if isinstance(source, str):
+            # Malformed JSON must not fail the write, so only valid text reaches json_each
+            parts.append(f"(SELECT group_concat(value, ' ') FROM json_each(CASE WHEN json_valid({row}.{source}) "
+                         f"THEN {row}.{source} END) WHERE type = 'text')")
+        else:
+            section, keys = source
+            valid = f'CASE WHEN json_valid({row}.{section}) THEN {row}.{section} END'
+            parts.extend(f"json_extract({valid}, '$.{key}')" for key in keys)
+    return " || ' ' || ".join(f"coalesce({part}, '')" for part in parts)
+
+
+def _search_values(row):
+    return ', '.join(_search_expression(row, sources) for sources in SEARCH_COLUMNS.values())
+
+
+def create_search_index(conn):
+    """FTS5 table over the searchable JSON fields, kept in sync by triggers"""
+    columns = ', '.join(SEARCH_COLUMNS)
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS applications_fts USING fts5(
+            {columns}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS applications_fts_insert AFTER INSERT ON applications BEGIN
+            INSERT INTO applications_fts (rowid, {columns}) VALUES (new.id, {_search_values('new')});
+        END
+    ''')
+    # Only the indexed sections re-index a row, so status and summary updates stay cheap
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS applications_fts_update
+        AFTER UPDATE OF {', '.join(SEARCH_SECTIONS)} ON applications BEGIN
+            DELETE FROM applications_fts WHERE rowid = old.id;
+            INSERT INTO applications_fts (rowid, {columns}) VALUES (new.id, {_search_values('new')});
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS applications_fts_delete AFTER DELETE ON applications BEGIN
+            DELETE FROM applications_fts WHERE rowid = old.id;
+        END
+    ''')
+
+
+def rebuild_search_index(conn):
+    """Re-index every application from its JSON sections; returns the number of rows indexed"""
+    conn.execute('DELETE FROM applications_fts')
+    cursor = conn.execute(f'''
+        INSERT INTO applications_fts (rowid, {', '.join(SEARCH_COLUMNS)})
+        SELECT id, {_search_values('applications')} FROM applications
+    ''')
+    conn.execute("INSERT INTO applications_fts (applications_fts) VALUES ('optimize')")
+    conn.commit()
+    return cursor.rowcount
+
+
+def _migration_1_hot_columns(conn):
+    """Typed postcode/email columns and indexes for the hot lookup paths"""
+    _add_column(conn, 'applications', 'postcode', 'TEXT')
+    _add_column(conn, 'applications', 'postcode_district', 'TEXT')
+    _add_column(conn, 'applications', 'applicant_email', 'TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_postcode ON applications (postcode)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_postcode_district ON applications (postcode_district)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_applicant_email ON applications (applicant_email)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_created_at ON applications (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_load_items_application_id ON load_items (application_id)')
+    conn.commit()
+    backfill_hot_columns(conn)
+
+
+def _migration_2_row_version(conn):
+    """Row version counter used for ETags and optimistic concurrency"""
+    _add_column(conn, 'applications', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    conn.commit()
+
+
+def _migration_3_estimates(conn):
+    """Indicative quote columns written by the estimator"""
+    _add_column(conn, 'applications', 'estimated_cost', 'REAL')
+    _add_column(conn, 'applications', 'estimated_at', 'TIMESTAMP')
+    conn.commit()
+
+
+def _migration_4_outbound_emails(conn):
+    """Durable outbound email queue drained by the delivery worker"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbound_emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbound_emails_due
+        ON outbound_emails (status, next_attempt_at)
+    ''')
+    conn.commit()
+
+
+def _migration_5_otp_codes(conn):
+    """Shared OTP store so every worker process can verify any code"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS otp_codes (
+            email TEXT PRIMARY KEY,
+            otp_hash TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            ip_address TEXT,
+            user_agent TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_otp_codes_expires_at ON otp_codes (expires_at)')
+    conn.commit()
+
+
+def _migration_6_rate_limits(conn):
+    """Sliding-window rate limit counters shared by every worker process"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            rule TEXT NOT NULL,
+            key TEXT NOT NULL,
+            window INTEGER NOT NULL,
+            previous INTEGER NOT NULL DEFAULT 0,
+            current INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (rule, key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limits_expires_at ON rate_limits (expires_at)')
+    conn.commit()
+
+
+def _migration_7_listing_indexes(conn):
+    """Indexes for listing applications by last update, filtered or not"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_applications_updated_at ON applications (updated_at)')
+    # (column, rowid) order already serves the id sort; these serve the updated_at sort
+    for column in ('status', 'postcode', 'postcode_district', 'applicant_email'):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_applications_{column}_updated_at ON applications ({column}, updated_at)')
+    conn.commit()
+
+
+def _migration_8_search_index(conn):
+    """Full-text search index over applicant, company, address and project fields"""
+    create_search_index(conn)
+    conn.commit()
+    rebuild_search_index(conn)
+
+
+def _migration_9_geometry_index(conn):
+    """R*Tree index over the site boundaries, substation positions and cable routes drawn on the map"""
+    create_geometry_index(conn)
+    conn.commit()
+    rebuild_geometry_index(conn)
+
+
+def _migration_10_uploads(conn):
+    """Resumable document upload sessions; finished files live in the blob store"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            application_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            filename TEXT,
+            content_type TEXT,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_expires_at ON uploads (expires_at)')
+    conn.commit()
+
+
+def _migration_11_offer_issued_at(conn):
+    """Date an application's formal offer was first issued, printed on every copy of it"""
+    _add_column(conn, 'applications', 'offer_issued_at', 'TEXT')
+    conn.commit()
+
+
+def _migration_12_revoked_tokens(conn):
+    """Revoked session tokens shared by every worker process, kept until they expire"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens (expires_at)')
+    conn.commit()
+
+
+# Ordered list of schema migrations; the position is the schema version
+MIGRATIONS = [
+    _migration_1_hot_columns,
+    _migration_2_row_version,
+    _migration_3_estimates,
+    _migration_4_outbound_emails,
+    _migration_5_otp_codes,
+    _migration_6_rate_limits,
+    _migration_7_listing_indexes,
+    _migration_8_search_index,
+    _migration_9_geometry_index,
+    _migration_10_uploads,
+    _migration_11_offer_issued_at,
+    _migration_12_revoked_tokens,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations and record the version in PRAGMA user_version.
+
+    Returns the list of applied migration versions.
+    """
+    applied = []
+    current = schema_version(conn)
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+        applied.append(version)
+        print(f"Applied schema migration {version}: {migration.__doc__}")
+    return applied
+
+
+def json_merge_patch(target, patch):
+    """Apply an RFC 7386 JSON merge patch; ``None`` values delete keys"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = json_merge_patch(result.get(key), value)
+    return result
@@ -0,0 +1,59 @@
+"""Local SMTP sink for offline development and email throughput benchmarks.
+
+Run it, then point the backend at it:
+
+    python smtp_sink.py --port 1025
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=1025 SMTP_STARTTLS=0 EMAIL_ADDRESS=dev@localhost EMAIL_PASSWORD= python app.py
+
+Requires aiosmtpd (see requirements-dev.txt).
+"""
+import argparse
+import threading
+import time
+
+
+class CountingHandler:
+    """aiosmtpd handler that counts (and optionally prints) received messages"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.received = 0
+        self.first_at = None
+        self.last_at = None
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.received += 1
+            self.last_at = time.perf_counter()
+            if self.first_at is None:
+                self.first_at = self.last_at
+        if self.verbose:
+            print(f"Received message from {envelope.mail_from} to {', '.join(envelope.rcpt_tos)}")
+        return '250 Message accepted for delivery'
+
+
+def start_sink(host='127.0.0.1', port=1025, verbose=False):
+    """Start the sink in a background thread; returns (controller, handler)"""
+    from aiosmtpd.controller import Controller
+
+    handler = CountingHandler(verbose)
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    return controller, handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local SMTP sink')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    controller, handler = start_sink(args.host, args.port, verbose=True)
+    print(f"SMTP sink listening on {args.host}:{args.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        controller.stop()
+        print(f"Received {handler.received} messages")
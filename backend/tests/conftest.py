@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# db.py reads the paths at import time, so point them at a throwaway directory first
+DATA_DIR = tempfile.mkdtemp(prefix='backend-tests-')
+os.environ.update({'DATA_DIR': DATA_DIR, 'DATABASE_PATH': os.path.join(DATA_DIR, 'applications.db'),
+                   'LOG_DIR': os.path.join(DATA_DIR, 'logs'), 'LOGIN_LOG_CONSOLE': '0',
+                   'EMAIL_ADDRESS': 'tests@example.com', 'EMAIL_PASSWORD': '', 'SMTP_SERVER': '127.0.0.1',
+                   'SMTP_PORT': '9', 'SMTP_STARTTLS': '0', 'ADMIN_EMAILS': 'admin@example.com',
+                   'METRICS_TOKEN': 'test-metrics-token'})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app, startup
+
+    startup()
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    from auth import token_signer
+
+    return {'Authorization': f"Bearer {token_signer.issue('tester@example.com')}"}
+
+
+@pytest.fixture
+def application_id(client, auth_headers):
+    """A fresh draft application"""
+    response = client.post('/api/applications', json={'summary': {'status': 'draft'}}, headers=auth_headers)
+    return response.get_json()['id']
+
+
+@pytest.fixture
+def admin_headers():
+    from auth import token_signer
+
+    return {'Authorization': f"Bearer {token_signer.issue('admin@example.com')}"}
@@ -0,0 +1,19 @@
+import pytest
+
+METRICS_ROUTES = ['/api/metrics', '/api/metrics/profiler', '/api/db/pool-stats', '/api/email-queue/stats']
+
+
+@pytest.mark.parametrize('path', METRICS_ROUTES)
+def test_metrics_routes_need_an_admin_or_the_metrics_token(client, auth_headers, admin_headers, path):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=auth_headers).status_code == 403
+    assert client.get(path, headers=admin_headers).status_code == 200
+    assert client.get(path, headers={'Authorization': 'Bearer test-metrics-token'}).status_code == 200
+
+
+def test_only_admins_switch_the_profiler(client, auth_headers, admin_headers):
+    body = {'enabled': False}
+    assert client.put('/api/metrics/profiler', json=body, headers=auth_headers).status_code == 403
+    assert client.put('/api/metrics/profiler', json=body,
+                      headers={'Authorization': 'Bearer test-metrics-token'}).status_code == 401
+    assert client.put('/api/metrics/profiler', json=body, headers=admin_headers).status_code == 200
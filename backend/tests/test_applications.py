@@ -0,0 +1,71 @@
+import pytest
+
+
+def etag(response):
+    return response.headers['ETag']
+
+
+@pytest.fixture
+def application(client, auth_headers):
+    response = client.post('/api/applications', headers=auth_headers, json={
+        'summary': {'status': 'draft'},
+        'applicant_details': {'name': 'Ada', 'phone': '0123', 'company': {'name': 'Grid Ltd', 'vat': 'GB1'}}})
+    return response.get_json()['id']
+
+
+def test_patch_with_a_stale_etag_is_refused(client, auth_headers, application):
+    url = f'/api/applications/{application}'
+    seen = etag(client.get(url, headers=auth_headers))
+    response = client.patch(f'{url}/applicant_details', json={'name': 'Grace'}, headers={**auth_headers, 'If-Match': seen})
+    assert response.status_code == 200
+    assert etag(response) != seen
+
+    stale = client.patch(f'{url}/applicant_details', json={'name': 'Edsger'}, headers={**auth_headers, 'If-Match': seen})
+    assert stale.status_code == 412
+    assert etag(stale) == etag(response)
+    assert client.get(url, headers=auth_headers).get_json()['applicant_details']['name'] == 'Grace'
+
+
+def test_put_with_a_stale_etag_is_refused(client, auth_headers, application):
+    url = f'/api/applications/{application}'
+    seen = etag(client.get(url, headers=auth_headers))
+    client.patch(f'{url}/summary', json={'note': 'first'}, headers=auth_headers)
+    response = client.put(url, json={'summary': {'status': 'draft'}}, headers={**auth_headers, 'If-Match': seen})
+    assert response.status_code == 412
+
+
+def test_unconditional_patch_applies_to_the_latest_version(client, auth_headers, application):
+    url = f'/api/applications/{application}'
+    client.patch(f'{url}/applicant_details', json={'name': 'Grace'}, headers=auth_headers)
+    assert client.patch(f'{url}/applicant_details', json={'phone': '0456'}, headers=auth_headers).status_code == 200
+    details = client.get(url, headers=auth_headers).get_json()['applicant_details']
+    assert (details['name'], details['phone']) == ('Grace', '0456')
+
+
+def test_unchanged_application_is_not_modified(client, auth_headers, application):
+    url = f'/api/applications/{application}'
+    seen = etag(client.get(url, headers=auth_headers))
+    response = client.get(url, headers={**auth_headers, 'If-None-Match': seen})
+    assert response.status_code == 304
+    assert not response.data
+    assert etag(response) == seen
+
+    client.patch(f'{url}/summary', json={'note': 'changed'}, headers=auth_headers)
+    response = client.get(url, headers={**auth_headers, 'If-None-Match': seen})
+    assert response.status_code == 200
+    assert response.get_json()['summary']['note'] == 'changed'
+
+
+def test_merge_patch_null_deletes_members(client, auth_headers, application):
+    url = f'/api/applications/{application}'
+    response = client.patch(f'{url}/applicant_details', headers=auth_headers,
+                            json={'phone': None, 'company': {'vat': None, 'number': '42'}})
+    assert response.status_code == 200
+    details = client.get(url, headers=auth_headers).get_json()['applicant_details']
+    assert details == {'name': 'Ada', 'company': {'name': 'Grid Ltd', 'number': '42'}}
+
+
+def test_patch_of_an_unknown_section_or_application(client, auth_headers, application):
+    assert client.patch(f'/api/applications/{application}/secrets', json={}, headers=auth_headers).status_code == 404
+    assert client.patch('/api/applications/999999/summary', json={}, headers=auth_headers).status_code == 404
+    assert client.patch(f'/api/applications/{application}/summary', json=[1], headers=auth_headers).status_code == 400
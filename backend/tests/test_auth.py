@@ -0,0 +1,54 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from auth import InvalidToken, RevokedTokens, token_signer
+
+
+def test_logout_revokes_the_token(client, auth_headers):
+    assert client.post('/api/logout', headers=auth_headers).status_code == 200
+    assert client.get('/api/applications', headers=auth_headers).status_code == 401
+
+
+def test_revocation_is_shared_between_processes():
+    payload = token_signer.verify(token_signer.issue('shared@example.com'))
+    RevokedTokens().add(payload['jti'], payload['exp'])
+    # A fresh instance stands in for another worker process's empty cache
+    assert payload['jti'] in RevokedTokens()
+
+
+def test_cache_eviction_does_not_unrevoke():
+    revoked = RevokedTokens(max_size=1)
+    tokens = [token_signer.verify(token_signer.issue(f'user{i}@example.com')) for i in range(3)]
+    for payload in tokens:
+        revoked.add(payload['jti'], payload['exp'])
+    assert all(payload['jti'] in revoked for payload in tokens)
+
+
+def test_expired_revocations_are_swept():
+    revoked = RevokedTokens(sweep_interval=0)
+    revoked.add('stale', time.time() - 1)
+    revoked.add('fresh', time.time() + 60)
+    assert 'stale' not in RevokedTokens()
+    assert len(revoked) >= 1
+
+
+def test_revoked_token_is_rejected():
+    token = token_signer.issue('gone@example.com')
+    token_signer.revoke(token_signer.verify(token))
+    with pytest.raises(InvalidToken, match='revoked'):
+        token_signer.verify(token)
+
+
+def test_otp_login_issues_a_working_token(client, monkeypatch):
+    import login
+
+    monkeypatch.setattr(login, 'generate_otp', lambda: '135790')
+    monkeypatch.setattr(login, 'validate_email', lambda email: SimpleNamespace(email=email))
+    assert client.post('/api/send-otp', json={'email': 'login@example.com'}).status_code == 200
+    response = client.post('/api/verify-otp', json={'email': 'login@example.com', 'otp': '135790'})
+    assert response.status_code == 200
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    assert client.get('/api/applications', headers=headers).status_code == 200
+    assert client.post('/api/verify-otp', json={'email': 'login@example.com', 'otp': '135790'}).status_code == 400
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.mark.parametrize('query', ['kva=nan', 'kva=inf', 'kva=-inf', 'kva=50&tariff_multiplier=nan',
+                                   'kva=50&tariff_multiplier=1e400'])
+def test_non_finite_estimate_inputs_are_rejected(client, auth_headers, query):
+    assert client.get(f'/api/estimates?{query}', headers=auth_headers).status_code == 400
+
+
+def test_finite_estimate_is_priced(client, auth_headers):
+    response = client.get('/api/estimates?kva=50&phases=Three', headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_batch_repricing_needs_an_admin(client, auth_headers, admin_headers, application_id):
+    body = {'application_ids': [application_id], 'save': False}
+    assert client.post('/api/estimates/batch', json=body, headers=auth_headers).status_code == 403
+    assert client.post('/api/estimates/batch', json=body, headers=admin_headers).status_code == 200
+    body['tariff_multiplier'] = 'inf'
+    assert client.post('/api/estimates/batch', json=body, headers=admin_headers).status_code == 400
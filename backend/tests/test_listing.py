@@ -0,0 +1,40 @@
+import base64
+import json
+
+import pytest
+
+from applications import parse_timestamp
+
+
+def cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('updated_at', [{'a': 1}, 2]),
+    ('updated_at', [None, 2]),
+    ('updated_at', ['2024-01-01 00:00:00', '2']),
+    ('id', [True]),
+    ('id', [1.5]),
+])
+def test_malformed_cursor_is_rejected(client, auth_headers, sort, key):
+    response = client.get(f'/api/applications?sort={sort}&cursor={cursor(key)}', headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_cursor_pages_do_not_overlap(client, auth_headers, application_id):
+    client.post('/api/applications', json={'summary': {'status': 'draft'}}, headers=auth_headers)
+    first = client.get('/api/applications?sort=updated_at&limit=1', headers=auth_headers).get_json()
+    second = client.get(f"/api/applications?sort=updated_at&limit=1&cursor={first['next_cursor']}",
+                        headers=auth_headers).get_json()
+    assert first['applications'][0]['id'] != second['applications'][0]['id']
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-06-01', '2024-06-01 00:00:00'),
+    ('2024-06-01T12:30:00Z', '2024-06-01 12:30:00'),
+    ('2024-06-01T12:30:00+02:00', '2024-06-01 10:30:00'),
+    ('2024-06-01T00:30:00-01:00', '2024-06-01 01:30:00'),
+])
+def test_parse_timestamp_converts_to_utc(value, expected):
+    assert parse_timestamp(value) == expected
@@ -0,0 +1,35 @@
+def test_add_load_item_computes_summed_load(client, auth_headers, application_id):
+    response = client.post(f'/api/load-items/{application_id}', headers=auth_headers,
+                           json={'quantity': 2, 'load_per_installation': 7.5, 'summed_load': 99999})
+    assert response.status_code == 200
+    items = client.get(f'/api/load-items/{application_id}', headers=auth_headers).get_json()
+    assert [item['summed_load'] for item in items] == [15.0]
+
+
+def test_add_load_item_to_unknown_application(client, auth_headers):
+    response = client.post('/api/load-items/999999', headers=auth_headers,
+                           json={'quantity': 1, 'load_per_installation': 3})
+    assert response.status_code == 404
+
+
+def test_fractional_quantity_is_kept(client, auth_headers, application_id):
+    response = client.post(f'/api/load-items/{application_id}', headers=auth_headers,
+                           json={'quantity': '2.5', 'load_per_installation': 4})
+    assert response.status_code == 200
+    item = client.get(f'/api/load-items/{application_id}', headers=auth_headers).get_json()[0]
+    assert (item['quantity'], item['summed_load']) == (2.5, 10.0)
+
+
+def test_non_finite_numbers_are_rejected(client, auth_headers, application_id):
+    for item in ({'quantity': 1, 'load_per_installation': 'inf'}, {'quantity': 'nan', 'load_per_installation': 1}):
+        response = client.post(f'/api/load-items/{application_id}', headers=auth_headers, json=item)
+        assert response.status_code == 400
+    response = client.post(f'/api/load-items/{application_id}/batch', headers=auth_headers,
+                           json={'items': [{'quantity': 1, 'load_per_installation': 1e400}]})
+    assert response.status_code == 400
+
+
+def test_batch_for_unknown_application(client, auth_headers):
+    response = client.post('/api/load-items/999999/batch', headers=auth_headers,
+                           json={'items': [{'quantity': 1, 'load_per_installation': 3}]})
+    assert response.status_code == 404
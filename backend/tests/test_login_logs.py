@@ -0,0 +1,186 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from login_logs import CompressingRotatingFileHandler, LoginLogIndex, iter_lines_backward, query_login_logs
+
+START = datetime(2024, 1, 31, 9, 0)
+
+
+def write_record(path, created):
+    timestamp = datetime.fromtimestamp(created).strftime('%Y-%m-%dT%H:%M:%S.000')
+    with open(path, 'a') as f:
+        f.write(json.dumps({'timestamp': timestamp, 'level': 'INFO'}, separators=(',', ':')) + '\n')
+
+
+def test_age_rotation_counts_from_the_first_record(tmp_path):
+    path = str(tmp_path / 'login.log')
+    started = time.time() - 7200
+    write_record(path, started)
+    write_record(path, time.time())  # a recent append must not push the deadline out
+    handler = CompressingRotatingFileHandler(path, rotate_seconds=3600)
+    try:
+        assert abs(handler.rollover_at - (started + 3600)) < 1
+        assert handler.shouldRollover(None)
+    finally:
+        handler.close()
+
+
+def test_age_rotation_of_a_new_file_counts_from_now(tmp_path):
+    path = str(tmp_path / 'login.log')
+    handler = CompressingRotatingFileHandler(path, rotate_seconds=3600)
+    try:
+        assert os.path.getsize(path) == 0
+        assert handler.rollover_at >= time.time() + 3590
+    finally:
+        handler.close()
+
+
+def test_send_otp_does_not_print_the_code(client, capsys, monkeypatch):
+    import login
+
+    monkeypatch.setattr(login, 'generate_otp', lambda: '424242')
+    # Skip the DNS deliverability check, which has no network here
+    monkeypatch.setattr(login, 'validate_email', lambda email: SimpleNamespace(email=email))
+    assert client.post('/api/send-otp', json={'email': 'printed@example.com'}).status_code == 200
+    assert '424242' not in capsys.readouterr().out
+
+
+def append_entries(path, first, count):
+    """Lines numbered first..first+count-1, one minute apart"""
+    with open(path, 'a') as f:
+        for n in range(first, first + count):
+            timestamp = (START + timedelta(minutes=n)).strftime('%Y-%m-%dT%H:%M:%S.000')
+            status = 'FAILED' if n % 3 == 0 else 'SUCCESS'
+            f.write(json.dumps({'timestamp': timestamp, 'level': 'INFO', 'activity_type': 'LOGIN_ATTEMPT',
+                                'email': f'user{n}@example.com', 'status': status},
+                               separators=(',', ':')) + '\n')
+
+
+def line_numbers(entries):
+    return [int(entry['email'][4:].split('@')[0]) for entry in entries]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LoginLogIndex(str(tmp_path / 'login.log'), interval=4)
+    append_entries(index.path, 0, 10)
+    return index
+
+
+def test_index_records_every_nth_line(index):
+    state = index.refresh()
+    assert state['line_count'] == 10
+    assert state['indexed_size'] == os.path.getsize(index.path)
+    with open(index.path, 'rb') as f:
+        lines = f.readlines()
+    assert state['offsets'] == [sum(map(len, lines[:n])) for n in (0, 4, 8)]
+    assert state['timestamps'] == [json.loads(lines[n])['timestamp'] for n in (0, 4, 8)]
+
+
+def test_index_is_extended_and_persisted(index):
+    first = index.refresh()
+    append_entries(index.path, 10, 3)
+    state = index.refresh()
+    assert state['line_count'] == 13
+    assert state['offsets'][:3] == first['offsets'] and len(state['offsets']) == 4
+    # A new instance (another worker) picks the saved index up instead of rescanning
+    assert LoginLogIndex(index.path, interval=4).refresh()['offsets'] == state['offsets']
+
+
+def test_index_is_rebuilt_when_the_log_is_replaced(index):
+    index.refresh()
+    os.remove(index.path)
+    append_entries(index.path, 100, 2)
+    state = index.refresh()
+    assert state['line_count'] == 2 and state['offsets'] == [0]
+
+
+def test_index_is_rebuilt_when_the_log_shrinks(index):
+    index.refresh()
+    with open(index.path, 'r+b') as f:
+        f.truncate(0)
+    append_entries(index.path, 50, 1)
+    assert index.refresh()['line_count'] == 1
+
+
+@pytest.mark.parametrize('saved', ['not json', json.dumps({'version': 0}), None])
+def test_unusable_saved_index_is_rebuilt(index, saved):
+    if saved is None:
+        LoginLogIndex(index.path, interval=3).refresh()  # saved with another interval
+    else:
+        with open(index.index_path, 'w') as f:
+            f.write(saved)
+    state = LoginLogIndex(index.path, interval=4).refresh()
+    assert state['line_count'] == 10 and len(state['offsets']) == 3
+
+
+def test_backward_reading_handles_lines_across_blocks(index):
+    with open(index.path, 'rb') as f:
+        size = os.path.getsize(index.path)
+        expected = [line for _, line in iter_lines_backward(f, size)]
+        assert [line for _, line in iter_lines_backward(f, size, block_size=7)] == expected
+    assert len(expected) == 10
+
+
+@pytest.mark.parametrize('order, expected', [('desc', list(range(9, -1, -1))), ('asc', list(range(10)))])
+def test_cursor_pages_cover_the_log_once(index, order, expected):
+    seen = []
+    cursor = None
+    while True:
+        entries, cursor, _ = query_login_logs(limit=3, cursor=cursor, order=order, index=index)
+        seen.extend(line_numbers(entries))
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_newest_first_pages_are_stable_while_the_log_grows(index):
+    entries, cursor, _ = query_login_logs(limit=4, index=index)
+    assert line_numbers(entries) == [9, 8, 7, 6]
+    append_entries(index.path, 10, 5)
+    entries, cursor, _ = query_login_logs(limit=4, cursor=cursor, index=index)
+    assert line_numbers(entries) == [5, 4, 3, 2]
+
+
+def test_time_range_and_filters_page_through_the_index(index):
+    since = (START + timedelta(minutes=2)).strftime('%Y-%m-%dT%H:%M')
+    until = (START + timedelta(minutes=8)).strftime('%Y-%m-%dT%H:%M')
+    for order in ('asc', 'desc'):
+        seen = []
+        cursor = None
+        while True:
+            entries, cursor, _ = query_login_logs(limit=2, cursor=cursor, order=order, since=since, until=until,
+                                                  filters={'status': 'failed'}, index=index)
+            seen.extend(line_numbers(entries))
+            if cursor is None:
+                break
+        assert sorted(seen) == [3, 6]
+
+
+def test_login_log_route_needs_an_admin(client, auth_headers, admin_headers):
+    assert client.get('/api/login-logs', headers=auth_headers).status_code == 403
+    assert client.post('/api/login-logs/clear', headers=auth_headers).status_code == 403
+    assert client.get('/api/login-logs?cursor=-1', headers=admin_headers).status_code == 400
+    assert client.get('/api/login-logs?cursor=abc', headers=admin_headers).status_code == 400
+
+
+def test_login_log_route_pages_with_next_cursor(client, admin_headers, monkeypatch, tmp_path):
+    import app as app_module
+
+    index = LoginLogIndex(str(tmp_path / 'login.log'), interval=4)
+    append_entries(index.path, 0, 7)
+    monkeypatch.setattr(app_module, 'LOGIN_LOG_FILE', index.path)
+    monkeypatch.setattr(app_module, 'query_login_logs',
+                        lambda **kwargs: query_login_logs(index=index, **kwargs))
+    seen = []
+    query = '/api/login-logs?limit=3'
+    while query:
+        body = client.get(query, headers=admin_headers).get_json()
+        seen.extend(line_numbers(body['logs']))
+        query = f"/api/login-logs?limit=3&cursor={body['next_cursor']}" if body['next_cursor'] is not None else None
+    assert seen == list(range(6, -1, -1))
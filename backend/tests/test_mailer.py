@@ -0,0 +1,14 @@
+import pytest
+
+import mailer
+
+
+@pytest.mark.parametrize('setting', ['EMAIL_ADDRESS', 'EMAIL_PASSWORD'])
+def test_enqueue_refuses_without_credentials(monkeypatch, setting):
+    monkeypatch.setattr(mailer, setting, None)
+    with pytest.raises(mailer.EmailNotConfigured, match=setting):
+        mailer.enqueue_email('someone@example.com', 'Subject', 'Body', wake=False)
+
+
+def test_empty_password_means_no_login():
+    mailer.require_email_settings()
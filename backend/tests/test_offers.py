@@ -0,0 +1,37 @@
+from quotations import quote_store
+
+
+def selected_quote_application(client, auth_headers, selected):
+    response = client.post('/api/applications', headers=auth_headers,
+                           json={'summary': {'status': 'accepted'}, 'click_quote_data': {'selectedQuote': selected}})
+    return response.get_json()['id']
+
+
+def test_offer_prices_come_from_the_quote_store(client, auth_headers):
+    from app import quote_estimator
+    from offers import load_offer_inputs
+    from db import pool
+
+    stored = quote_store.all()[0]
+    app_id = selected_quote_application(client, auth_headers, {
+        'quoteId': stored['quoteId'], 'estimatedCost': 1, 'breakdown': {'forged': 1}})
+    with pool.connection() as conn:
+        quote = load_offer_inputs(conn, [app_id], quote_store, quote_estimator)[app_id]['quote']
+    assert quote['total'] == float(stored['estimatedCost'])
+    assert ['Forged', 1.0] not in quote['breakdown']
+
+
+def test_download_does_not_issue_the_offer(client, auth_headers):
+    from db import pool
+
+    stored = quote_store.all()[0]
+    app_id = selected_quote_application(client, auth_headers, {'quoteId': stored['quoteId']})
+    assert client.get(f'/api/applications/{app_id}/offer.pdf', headers=auth_headers).status_code == 200
+    with pool.connection() as conn:
+        row = conn.execute('SELECT offer_issued_at FROM applications WHERE id = ?', (app_id,)).fetchone()
+    assert row['offer_issued_at'] is None
+
+    assert client.post('/api/offers/batch', headers=auth_headers, json={'application_ids': [app_id]}).status_code == 200
+    with pool.connection() as conn:
+        row = conn.execute('SELECT offer_issued_at FROM applications WHERE id = ?', (app_id,)).fetchone()
+    assert row['offer_issued_at'] is not None
@@ -0,0 +1,79 @@
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import otp_store as otp_store_module
+from otp_store import MemoryOTPStore, SQLiteOTPStore, VERIFIED, NOT_FOUND, EXPIRED, BLOCKED, INVALID
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request):
+    if request.param == 'sqlite':
+        request.getfixturevalue('app')  # the otp_codes table
+        return SQLiteOTPStore(ttl=60, max_attempts=3)
+    return MemoryOTPStore(ttl=60, max_attempts=3)
+
+
+@pytest.fixture
+def email():
+    return f'otp-{secrets.token_hex(4)}@example.com'
+
+
+def later(monkeypatch, seconds):
+    now = time.time() + seconds
+    monkeypatch.setattr(otp_store_module, 'time', SimpleNamespace(time=lambda: now))
+
+
+def test_a_code_is_consumed_by_its_first_use(store, email):
+    store.put(email, '123456')
+    assert store.verify(email, '123456') == (VERIFIED, 0)
+    assert store.verify(email, '123456') == (NOT_FOUND, 0)
+
+
+def test_concurrent_verifications_succeed_once(store, email):
+    store.put(email, '123456')
+    with ThreadPoolExecutor(8) as executor:
+        outcomes = [outcome for outcome, _ in executor.map(lambda _: store.verify(email, '123456'), range(16))]
+    assert outcomes.count(VERIFIED) == 1
+    assert set(outcomes) == {VERIFIED, NOT_FOUND}
+
+
+def test_an_expired_code_is_rejected_and_removed(store, email, monkeypatch):
+    store.put(email, '123456')
+    later(monkeypatch, 61)
+    assert store.verify(email, '123456') == (EXPIRED, 0)
+    monkeypatch.undo()
+    assert store.verify(email, '123456') == (NOT_FOUND, 0)
+
+
+def test_a_code_is_valid_until_it_expires(store, email, monkeypatch):
+    store.put(email, '123456')
+    later(monkeypatch, 59)
+    assert store.verify(email, '123456') == (VERIFIED, 0)
+
+
+def test_wrong_guesses_block_the_code(store, email):
+    store.put(email, '123456')
+    assert [store.verify(email, '000000') for _ in range(3)] == [(INVALID, 1), (INVALID, 2), (INVALID, 3)]
+    assert store.verify(email, '123456') == (BLOCKED, 3)
+    assert store.verify(email, '123456') == (NOT_FOUND, 0)
+
+
+def test_a_new_code_replaces_the_old_one(store, email):
+    store.put(email, '111111')
+    store.put(email, '222222')
+    assert store.verify(email, '111111') == (INVALID, 1)
+    assert store.verify(email, '222222') == (VERIFIED, 1)
+
+
+def test_sweep_drops_expired_codes(store, email, monkeypatch):
+    store.put(email, '123456')
+    before = store.size()
+    later(monkeypatch, 61)
+    store.sweep()
+    monkeypatch.undo()
+    assert store.size() < before
+    assert store.verify(email, '123456') == (NOT_FOUND, 0)
@@ -0,0 +1,36 @@
+"""Every application listing query must stay an index seek.
+
+A plan that sorts in a temp B-tree, or scans the table under a filter,
+costs O(matching rows) per page instead of O(page).
+"""
+import pytest
+
+from benchmarks.query_plans import explain, plan_cases, plan_problems, populate
+
+ROWS = 300
+LIMIT = 50
+
+
+@pytest.fixture(scope='module')
+def conn():
+    from app import init_db
+    from db import pool
+
+    init_db()
+    with pool.connection() as conn:
+        populate(conn, ROWS)
+        yield conn
+
+
+def case_id(case):
+    sort, order, combo, cursor = case
+    return f"{sort}-{order}-{'+'.join(combo) or 'all'}-{'next' if cursor else 'first'}"
+
+
+CASES = list(plan_cases(ROWS))
+
+
+@pytest.mark.parametrize('sort, order, combo, cursor', CASES, ids=[case_id(case) for case in CASES])
+def test_listing_query_uses_an_index(conn, sort, order, combo, cursor):
+    plan = explain(conn, LIMIT, sort, order, combo, cursor)
+    assert plan_problems(plan, bool(combo)) is None, plan
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from rate_limit import MemoryRateLimiter, RateLimit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('workers, backend', [('1', 'memory'), ('4', 'sqlite')])
+def test_store_defaults_to_sqlite_with_several_workers(workers, backend):
+    env = {**os.environ, 'WEB_CONCURRENCY': workers}
+    env.pop('RATE_LIMIT_STORE', None)
+    output = subprocess.run([sys.executable, '-c', 'import rate_limit; print(rate_limit.RATE_LIMIT_STORE_BACKEND)'],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == backend
+
+
+def test_cap_evicts_least_recently_hit_keys():
+    limiter = MemoryRateLimiter(rules={'ip': RateLimit(100, 60)}, max_keys=3, sweep_interval=3600)
+    for key in 'abc':
+        limiter.allow([('ip', key)])
+    limiter.allow([('ip', 'a')])
+    limiter.allow([('ip', 'd')])
+    assert set(limiter._counters) == {('ip', 'a'), ('ip', 'c'), ('ip', 'd')}
+
+
+def test_sweep_drops_expired_keys_from_the_front():
+    limiter = MemoryRateLimiter(rules={'ip': RateLimit(100, 60)}, max_keys=100, sweep_interval=0)
+    for key in 'abc':
+        limiter.record('ip', key)
+    window = next(iter(limiter._counters.values()))[0]
+    limiter._counters[('ip', 'a')] = (window - 5, 0, 1)
+    limiter._counters[('ip', 'b')] = (window - 5, 0, 1)
+    limiter.record('ip', 'c')
+    assert list(limiter._counters) == [('ip', 'c')]
+
+
+def test_login_failures_requires_auth(client, auth_headers):
+    assert client.get('/api/login-failures').status_code == 401
+    assert client.get('/api/login-failures', headers=auth_headers).status_code == 200
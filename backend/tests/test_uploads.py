@@ -0,0 +1,59 @@
+import app as app_module
+from applications import CONFLICT
+
+
+def upload(client, auth_headers, application_id, body, **fields):
+    response = client.post(f'/api/applications/{application_id}/uploads', headers=auth_headers,
+                           json={'name': 'Site Plan', 'size': len(body), **fields})
+    return response.get_json()['id']
+
+
+def put_all(client, auth_headers, upload_id, body):
+    return client.put(f'/api/uploads/{upload_id}', data=body, headers={
+        **auth_headers, 'Content-Range': f'bytes 0-{len(body) - 1}/{len(body)}'})
+
+
+def test_unlisted_content_type_is_downloaded_with_nosniff(client, auth_headers, application_id):
+    body = b'<script>alert(1)</script>'
+    upload_id = upload(client, auth_headers, application_id, body,
+                       filename='../../evil"\r\n.html', content_type='text/html')
+    document = put_all(client, auth_headers, upload_id, body).get_json()['document']
+    assert document['contentType'] == 'application/octet-stream'
+    assert document['filename'] == 'evil".html'
+
+    response = client.get(f"/api/applications/{application_id}/documents/{document['sha256']}",
+                          headers=auth_headers)
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+    assert response.mimetype == 'application/octet-stream'
+    assert response.headers['Content-Disposition'] == "attachment; filename*=UTF-8''evil%22.html"
+
+
+def test_listed_content_type_is_served_inline(client, auth_headers, application_id):
+    body = b'%PDF-1.4 plan'
+    upload_id = upload(client, auth_headers, application_id, body,
+                       filename='plan.pdf', content_type='Application/PDF; charset=binary')
+    document = put_all(client, auth_headers, upload_id, body).get_json()['document']
+
+    response = client.get(f"/api/applications/{application_id}/documents/{document['sha256']}",
+                          headers=auth_headers)
+    assert response.mimetype == 'application/pdf'
+    assert response.headers['Content-Disposition'].startswith('inline;')
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_failed_attach_keeps_the_upload_for_a_retry(client, auth_headers, application_id, monkeypatch):
+    body = b'retry me'
+    upload_id = upload(client, auth_headers, application_id, body, filename='retry.txt', content_type='text/plain')
+    monkeypatch.setattr(app_module, 'patch_section', lambda *args, **kwargs: (CONFLICT, None))
+    response = put_all(client, auth_headers, upload_id, body)
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == str(len(body))
+    monkeypatch.undo()
+
+    assert client.get(f'/api/uploads/{upload_id}', headers=auth_headers).get_json()['offset'] == len(body)
+    response = put_all(client, auth_headers, upload_id, body)
+    assert response.status_code == 201
+    document = response.get_json()['document']
+    assert client.get(f"/api/applications/{application_id}/documents/{document['sha256']}",
+                      headers=auth_headers).data == body
+    assert client.get(f'/api/uploads/{upload_id}', headers=auth_headers).status_code == 404
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import re
+import secrets
+import shutil
+import time
+
+from werkzeug.exceptions import ClientDisconnected
+
+from db import DATA_DIR
+
+# Document storage configuration (override through the environment)
+BLOB_DIR = os.environ.get('BLOB_DIR', os.path.join(DATA_DIR, 'blobs'))
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+MAX_UPLOAD_CHUNK_SIZE = int(os.environ.get('MAX_UPLOAD_CHUNK_SIZE', str(16 * 1024 * 1024)))
+UPLOAD_TTL_SECONDS = int(os.environ.get('UPLOAD_TTL_SECONDS', '86400'))
+UPLOAD_SWEEP_INTERVAL = float(os.environ.get('UPLOAD_SWEEP_INTERVAL', '600'))
+
+# Partial files live under BLOB_DIR so finishing an upload is a hard link, not a copy
+PARTIAL_DIR = os.path.join(BLOB_DIR, 'partial')
+IO_BLOCK_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Types a browser may render in place; anything else is stored as octet-stream and downloaded
+INLINE_CONTENT_TYPES = {'application/pdf', 'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'text/plain'}
+MAX_FILENAME_LENGTH = 255
+
+# Outcomes of write_chunk
+ACCEPTED = 'accepted'
+COMPLETE = 'complete'
+NOT_FOUND = 'not_found'
+OFFSET_MISMATCH = 'offset_mismatch'
+INTERRUPTED = 'interrupted'
+
+_last_sweep = 0.0
+
+
+def blob_path(sha256):
+    """Path of a stored blob, fanned out by the first two bytes of its hash"""
+    if not SHA256_PATTERN.match(sha256 or ''):
+        raise ValueError('Not a SHA-256 hex digest')
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def document_content_type(content_type):
+    """The client's content type if it is safe to serve inline, else application/octet-stream"""
+    media_type = str(content_type or '').split(';')[0].strip().lower()
+    return media_type if media_type in INLINE_CONTENT_TYPES else 'application/octet-stream'
+
+
+def safe_filename(filename):
+    """The last path component of a client filename, without control characters; None if nothing is left"""
+    if not isinstance(filename, str):
+        return None
+    name = re.split(r'[\\/]', filename)[-1]
+    name = ''.join(char for char in name if char.isprintable()).strip().lstrip('.')
+    return name[:MAX_FILENAME_LENGTH] or None
+
+
+def partial_path(upload_id):
+    return os.path.join(PARTIAL_DIR, upload_id)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_uploads(conn, now=None):
+    """Drop upload sessions (and their partial files) that have not seen a chunk within the TTL"""
+    now = time.time() if now is None else now
+    expired = [row[0] for row in conn.execute('SELECT id FROM uploads WHERE expires_at < ?', (now,))]
+    for upload_id in expired:
+        _remove(partial_path(upload_id))
+    conn.executemany('DELETE FROM uploads WHERE id = ?', [(upload_id,) for upload_id in expired])
+    conn.commit()
+    return len(expired)
+
+
+def create_upload(conn, app_id, name, filename, size, content_type):
+    """Start a resumable upload of one document; returns the session"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep >= UPLOAD_SWEEP_INTERVAL:
+        _last_sweep = now
+        sweep_uploads(conn, now)
+
+    upload_id = secrets.token_urlsafe(24)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    open(partial_path(upload_id), 'wb').close()
+    conn.execute('''
+        INSERT INTO uploads (id, application_id, name, filename, content_type, size, received, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+    ''', (upload_id, app_id, name, safe_filename(filename), document_content_type(content_type), size,
+          now + UPLOAD_TTL_SECONDS))
+    conn.commit()
+    return get_upload(conn, upload_id)
+
+
+def get_upload(conn, upload_id):
+    row = conn.execute('SELECT * FROM uploads WHERE id = ? AND expires_at >= ?',
+                       (upload_id, time.time())).fetchone()
+    return dict(row) if row else None
+
+
+def delete_upload(conn, upload_id):
+    cursor = conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+    conn.commit()
+    _remove(partial_path(upload_id))
+    return cursor.rowcount > 0
+
+
+def write_chunk(conn, upload, start, stream, length):
+    """Append ``length`` bytes read from ``stream`` at offset ``start``, a block at a time.
+
+    Chunks must arrive in order: ``start`` has to equal the bytes received
+    so far. If the client goes away mid-chunk, whatever arrived is kept and
+    the upload resumes from there. Returns (outcome, received).
+    """
+    if start != upload['received']:
+        return OFFSET_MISMATCH, upload['received']
+
+    written = 0
+    interrupted = False
+    with open(partial_path(upload['id']), 'r+b') as f:
+        f.seek(start)
+        try:
+            while written < length:
+                block = stream.read(min(IO_BLOCK_SIZE, length - written))
+                if not block:
+                    interrupted = True
+                    break
+                f.write(block)
+                written += len(block)
+        except (ClientDisconnected, OSError):
+            interrupted = True
+
+    received = start + written
+    cursor = conn.execute('''
+        UPDATE uploads SET received = ?, expires_at = ? WHERE id = ? AND received = ?
+    ''', (received, time.time() + UPLOAD_TTL_SECONDS, upload['id'], start))
+    conn.commit()
+    if not cursor.rowcount:
+        current = get_upload(conn, upload['id'])
+        return (OFFSET_MISMATCH, current['received']) if current else (NOT_FOUND, None)
+    if interrupted:
+        return INTERRUPTED, received
+    return (COMPLETE if received == upload['size'] else ACCEPTED), received
+
+
+def store_blob(path):
+    """Link a finished file into the blob store under its SHA-256; returns the digest.
+
+    The file itself stays where it is until the caller deletes it. A blob
+    that is already stored is kept, so identical documents take disk space
+    once.
+    """
+    with open(path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    target = blob_path(sha256)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging = f'{target}.{secrets.token_hex(4)}.tmp'
+        try:
+            os.link(path, staging)
+        except OSError:
+            shutil.copyfile(path, staging)
+        os.replace(staging, target)
+    return sha256
+
+
+def finish_upload(upload):
+    """Store a complete upload as a blob; returns the document reference.
+
+    The session is kept: end it with delete_upload once the reference is
+    attached to the application, so a failed attach can be retried.
+    """
+    sha256 = store_blob(partial_path(upload['id']))
+    return {
+        'sha256': sha256,
+        'size': upload['size'],
+        'filename': safe_filename(upload['filename']),
+        'contentType': document_content_type(upload['content_type']),
+        'uploadedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+
+
+def find_document(upload_docs, sha256):
+    """The document reference in an upload_docs section with this hash, or None"""
+    documents = upload_docs.get('documents') if isinstance(upload_docs, dict) else None
+    if not isinstance(documents, dict):
+        return None
+    for document in documents.values():
+        if isinstance(document, dict) and document.get('sha256') == sha256:
+            return document
+    return None
+
+
+class FileRange:
+    """Read-only view of ``length`` bytes of a file from ``start``.
+
+    The descriptor is left positioned at ``start`` and exposed through
+    fileno(), so a server whose wsgi.file_wrapper uses sendfile (gunicorn)
+    sends the range from the page cache without copying it through Python.
+    Other servers call read() and get exactly the range.
+    """
+
+    def __init__(self, path, start, length):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
@@ -15,10 +15,29 @@ import AutoQuoteEligibility from './pages/AutoQuoteEligibility';
 import UploadDocs from './pages/UploadDocs';
 import Summary from './pages/Summary';
 import Submitted from './pages/Submitted';
-import { ApplicationProvider } from './context/ApplicationContext';
+import { ApplicationProvider, useApplication } from './context/ApplicationContext';
 import { AuthProvider, useAuth } from './context/AuthContext';
 import './App.css';
 
+// Shown when another tab or user saved the same fields of this application first
+function ConflictBanner() {
+  const { conflict, resolveConflict } = useApplication();
+  if (!conflict) {
+    return null;
+  }
+  const section = conflict.section.replace(/_/g, ' ');
+  return (
+    <div className="conflict-banner" role="alert">
+      <span>
+        The {section} section was changed elsewhere while you were editing
+        ({conflict.fields.join(', ')}). Which version should be kept?
+      </span>
+      <button type="button" onClick={() => resolveConflict('mine')}>Keep my changes</button>
+      <button type="button" onClick={() => resolveConflict('theirs')}>Use the saved version</button>
+    </div>
+  );
+}
+
 function AppContent() {
   const { isAuthenticated, loading } = useAuth();
   const [currentStep, setCurrentStep] = useState(0);
@@ -86,6 +105,7 @@ function AppContent() {
       <Header />
       <ProgressBar steps={steps} currentStep={currentStep} />
       <main className="main-content">
+        <ConflictBanner />
         <Routes>
           <Route path="/" element={<ApplicantDetails onNext={() => setCurrentStep(1)} />} />
           <Route path="/general-information" element={<GeneralInformation onNext={() => setCurrentStep(2)} />} />
@@ -3,6 +3,53 @@ import axios from 'axios';
 
 const ApplicationContext = createContext();
 
+const JSON_SECTIONS = [
+  'applicant_details', 'general_information', 'site_address', 'load_details', 'other_contact',
+  'click_quote_data', 'project_details', 'auto_quote_eligibility', 'upload_docs', 'summary'
+];
+
+const serverSections = (application) => Object.fromEntries(
+  JSON_SECTIONS.map((section) => [section, application[section] || {}])
+);
+
+// RFC 7386 merge patch, as the backend applies it to a section
+const mergePatch = (target, patch) => {
+  const result = { ...(target || {}) };
+  Object.entries(patch).forEach(([key, value]) => {
+    if (value === null) {
+      delete result[key];
+    } else if (typeof value === 'object' && !Array.isArray(value)) {
+      result[key] = mergePatch(result[key] && typeof result[key] === 'object' ? result[key] : {}, value);
+    } else {
+      result[key] = value;
+    }
+  });
+  return result;
+};
+
+// Top-level fields of ``section`` that differ from ``base``, as a merge patch
+const changedFields = (base, section) => {
+  const changed = {};
+  Object.keys({ ...base, ...section }).forEach((key) => {
+    if (JSON.stringify(base[key]) !== JSON.stringify(section[key])) {
+      changed[key] = key in section ? section[key] : null;
+    }
+  });
+  return changed;
+};
+
+// Another writer saved first: 412 for a stale If-Match, 409 for an unconditional write
+const isConflict = (error) => Boolean(error.response) && [409, 412].includes(error.response.status);
+
+// Send the session token issued by /api/verify-otp with every API call
+axios.interceptors.request.use((config) => {
+  const token = localStorage.getItem('authToken');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
 export const useApplication = () => {
   const context = useContext(ApplicationContext);
   if (!context) {
@@ -28,6 +75,10 @@ export const ApplicationProvider = ({ children }) => {
   const [applicationId, setApplicationId] = useState(null);
   const [loadItems, setLoadItems] = useState([]);
   const debounceTimeoutRef = useRef(null);
+  const versionRef = useRef(null);
+  // The sections as last read from or saved to the server: the common base for conflicts
+  const serverSectionsRef = useRef({});
+  const [conflict, setConflict] = useState(null);
 
   const API_BASE_URL = 'http://149.102.158.71:5000/api';
 
@@ -36,6 +87,7 @@ export const ApplicationProvider = ({ children }) => {
     try {
       const response = await axios.post(`${API_BASE_URL}/applications`, applicationData);
       setApplicationId(response.data.id);
+      serverSectionsRef.current = serverSections(applicationData);
       return response.data.id;
     } catch (error) {
       console.error('Error creating application:', error);
@@ -43,6 +95,79 @@ export const ApplicationProvider = ({ children }) => {
     }
   };
 
+  // PATCH a single section against the version this tab last saw. On a 412
+  // (409 without a version) another tab or user saved first: re-fetch, and only resend the fields this
+  // tab changed if the other writer did not touch them; otherwise surface the
+  // conflict and let the user choose.
+  const patchSection = async (section, data) => {
+    const url = `${API_BASE_URL}/applications/${applicationId}/${section}`;
+    const send = (body) => axios.patch(url, body, {
+      headers: versionRef.current ? { 'If-Match': `"${versionRef.current}"` } : {}
+    });
+    const saved = (body, response) => {
+      versionRef.current = response.data.version;
+      serverSectionsRef.current[section] = mergePatch(serverSectionsRef.current[section], body);
+    };
+    try {
+      saved(data, await send(data));
+      return;
+    } catch (error) {
+      if (!isConflict(error)) {
+        throw error;
+      }
+    }
+
+    const latest = (await axios.get(`${API_BASE_URL}/applications/${applicationId}`)).data;
+    const base = serverSectionsRef.current[section] || {};
+    const remote = latest[section] || {};
+    const mine = changedFields(base, data);
+    const theirs = changedFields(base, remote);
+    const clashes = Object.keys(mine).filter(
+      (key) => key in theirs && JSON.stringify(mine[key]) !== JSON.stringify(theirs[key])
+    );
+    adoptServerCopy(latest);
+
+    if (clashes.length > 0) {
+      setApplicationData((current) => ({ ...current, ...serverSections(latest), [section]: data }));
+      setConflict({ section, fields: clashes, mine: data, theirs: remote });
+      return;
+    }
+    setApplicationData((current) => ({ ...current, ...serverSections(latest), [section]: mergePatch(remote, mine) }));
+    if (Object.keys(mine).length > 0) {
+      try {
+        saved(mine, await send(mine));
+      } catch (error) {
+        if (isConflict(error)) {
+          // Changed again meanwhile: stop here rather than race the other writer
+          setConflict({ section, fields: Object.keys(mine), mine: data, theirs: remote });
+          return;
+        }
+        throw error;
+      }
+    }
+  };
+
+  const adoptServerCopy = (application) => {
+    versionRef.current = application.version;
+    serverSectionsRef.current = serverSections(application);
+  };
+
+  // Settle a surfaced conflict: 'mine' saves this tab's section over the
+  // latest version, 'theirs' drops this tab's edits to it
+  const resolveConflict = async (choice) => {
+    if (!conflict) {
+      return;
+    }
+    const { section, mine, theirs } = conflict;
+    setConflict(null);
+    if (choice === 'mine') {
+      setApplicationData((current) => ({ ...current, [section]: mine }));
+      await patchSection(section, mine);
+    } else {
+      setApplicationData((current) => ({ ...current, [section]: theirs }));
+    }
+  };
+
   // Update application with debouncing
   const updateApplication = async (section, data) => {
     try {
@@ -58,10 +183,11 @@ export const ApplicationProvider = ({ children }) => {
       debounceTimeoutRef.current = setTimeout(async () => {
         try {
           if (applicationId) {
-            await axios.put(`${API_BASE_URL}/applications/${applicationId}`, updatedData);
+            await patchSection(section, data);
           } else {
             const response = await axios.post(`${API_BASE_URL}/applications`, updatedData);
             setApplicationId(response.data.id);
+            serverSectionsRef.current = serverSections(updatedData);
           }
         } catch (error) {
           console.error('Error updating application:', error);
@@ -79,6 +205,7 @@ export const ApplicationProvider = ({ children }) => {
       const response = await axios.get(`${API_BASE_URL}/applications/${id}`);
       setApplicationData(response.data);
       setApplicationId(id);
+      adoptServerCopy(response.data);
       
       // Load load items
       const loadItemsResponse = await axios.get(`${API_BASE_URL}/load-items/${id}`);
@@ -139,7 +266,9 @@ export const ApplicationProvider = ({ children }) => {
     loadApplication,
     addLoadItem,
     removeLoadItem,
-    updateLoadItem
+    updateLoadItem,
+    conflict,
+    resolveConflict
   };
 
   return (
@@ -36,6 +36,14 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    // Revoke the token server-side; the local session is cleared regardless
+    const token = localStorage.getItem('authToken');
+    if (token) {
+      fetch('http://149.102.158.71:5000/api/logout', {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${token}` }
+      }).catch((error) => console.error('Error revoking session:', error));
+    }
     localStorage.removeItem('authToken');
     localStorage.removeItem('userEmail');
     setIsAuthenticated(false);
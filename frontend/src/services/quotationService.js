@@ -1,5 +1,20 @@
 // Quotation service for handling quote data
+const API_BASE_URL = 'http://149.102.158.71:5000/api';
+
 export const getQuotationsByPostcode = async (postcode) => {
+  // Prefer the backend quotation store; fall back to the bundled samples
+  try {
+    const response = await fetch(`${API_BASE_URL}/quotations?postcode=${encodeURIComponent(postcode || '')}`);
+    if (response.ok) {
+      const data = await response.json();
+      if (data.quotations && data.quotations.length > 0) {
+        return data.quotations;
+      }
+    }
+  } catch (error) {
+    console.error('Error fetching quotations from backend:', error);
+  }
+
   try {
     // For TW14 0BJ postcode, return quotations based on the four sets
     if (postcode && postcode.toUpperCase().includes('TW14')) {